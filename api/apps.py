@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import replicas, response_cache, signals
+        checks.register(response_cache.check_shared_cache, checks.Tags.caches)
+        checks.register(replicas.check_sticky_cache, checks.Tags.caches)
+        signals.connect_search_signals()
+        signals.connect_tag_signals()
+        signals.connect_auth_signals()
+        signals.connect_cache_signals()
+        signals.connect_rollup_signals()
+        signals.connect_database_signals()
+        signals.connect_metrics_signals()
+        signals.connect_changefeed_signals()
+        signals.connect_changelog_signals()
+        post_migrate.connect(signals.install_search_index, sender=self)
@@ -0,0 +1,217 @@
+"""
+Async versions of the read endpoints, for ASGI deployments.
+
+They answer with the same bytes as their DRF counterparts in views.py but
+use Django's async ORM throughout, so under ASGI a slow query does not hold a
+worker thread. They are mounted under /api/async/, next to the change stream,
+which only exists here.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import Throttled, ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import changefeed, throttling
+from .authentication import aauthenticate_token
+from .facets import facet_counts
+from .metrics import rendering
+from .models import Category, Item
+from .pagination import ItemCursorPagination
+from .renderers import FastJSONRenderer
+from .serializers import CategoryRowSerializer, ItemRowSerializer
+from .queries import acount_items, item_queryset
+
+PAGE_SIZE = 5
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    with rendering():
+        content = FastJSONRenderer().render(data)
+    return HttpResponse(content, status=status_code, content_type='application/json', headers=headers)
+
+
+async def authenticate_stream_token(value):
+    user_id = changefeed.stream_token_user_id(value)
+    if user_id is None:
+        return None
+    user = await User.objects.filter(pk=user_id, is_active=True).afirst()
+    return None if user is None else (user, None)
+
+
+def async_api_view(methods, stream_token=False):
+    """
+    Method check, token authentication and throttling for async views,
+    answering like DRF's TokenAuthentication + IsAuthenticated and
+    TokenBucketThrottle would. Views with ``stream_token`` also take a
+    ?stream_token= from streamToken instead of the header.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({'detail': f'Method "{request.method}" not allowed.'},
+                                     status.HTTP_405_METHOD_NOT_ALLOWED, {'Allow': ', '.join(methods)})
+            challenge = {'WWW-Authenticate': 'Token'}
+            auth = request.headers.get('Authorization', '').split()
+            if stream_token and not auth and request.GET.get('stream_token'):
+                resolved = await authenticate_stream_token(request.GET['stream_token'])
+                if resolved is None:
+                    return json_response({'detail': 'Invalid or expired stream token.'},
+                                         status.HTTP_401_UNAUTHORIZED, challenge)
+                request.user, request.auth = resolved
+                return await _throttled(view, request, *args, **kwargs)
+            if not auth or auth[0].lower() != 'token':
+                return json_response({'detail': 'Authentication credentials were not provided.'},
+                                     status.HTTP_401_UNAUTHORIZED, challenge)
+            if len(auth) != 2:
+                return json_response({'detail': 'Invalid token header. No credentials provided.'},
+                                     status.HTTP_401_UNAUTHORIZED, challenge)
+            resolved = await aauthenticate_token(auth[1])
+            if resolved is None:
+                return json_response({'detail': 'Invalid token.'}, status.HTTP_401_UNAUTHORIZED, challenge)
+            request.user, request.auth = resolved
+            return await _throttled(view, request, *args, **kwargs)
+        # authenticated by header, never by cookie: nothing to forge
+        return csrf_exempt(wrapper)
+    return decorator
+
+
+async def _throttled(view, request, *args, **kwargs):
+    # the same buckets as the DRF view of the same name
+    wait = await throttling.acheck(request, view.__name__)
+    if wait:
+        exc = Throttled(wait)
+        return json_response({'detail': exc.detail}, status.HTTP_429_TOO_MANY_REQUESTS,
+                             {'Retry-After': str(exc.wait)})
+    try:
+        return await view(request, *args, **kwargs)
+    except ValidationError as exc:
+        return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+
+
+def page_link(request, page_number):
+    url = request.build_absolute_uri()
+    if page_number == 1:
+        return remove_query_param(url, 'page')
+    return replace_query_param(url, 'page', page_number)
+
+
+@async_api_view(['GET'])
+async def getAllItems(request):
+    if request.GET.get('pagination') == 'cursor' or 'cursor' in request.GET:
+        return await cursor_page(request)
+
+    serializer = ItemRowSerializer(ItemRowSerializer.parse_fields(request.GET.get('fields')))
+    queryset = item_queryset(request.GET)
+    estimate = request.GET.get('count') == 'estimate'
+    count = await acount_items(request.GET, queryset, estimate=estimate)
+    if not count and estimate:
+        count = await queryset.acount()
+    if not count:
+        return json_response([], status.HTTP_404_NOT_FOUND)
+    last_page = max(1, -(-count // PAGE_SIZE))
+    page_number = request.GET.get('page', 1)
+    try:
+        page_number = last_page if page_number == 'last' else int(page_number)
+    except ValueError:
+        page_number = 0
+    if not 1 <= page_number <= last_page:
+        return json_response({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+
+    offset = (page_number - 1) * PAGE_SIZE
+    rows = serializer.project(queryset)[offset:offset + PAGE_SIZE]
+    payload = {
+        'count': count,
+        'next': page_link(request, page_number + 1) if page_number < last_page else None,
+        'previous': page_link(request, page_number - 1) if page_number > 1 else None,
+        'results': serializer.serialize([row async for row in rows]),
+    }
+    facets = await sync_to_async(facet_counts)(request, item_queryset(request.GET, ordered=False))
+    if facets is not None:
+        payload['facets'] = facets
+    return json_response(payload)
+
+
+async def cursor_page(request):
+    # keyset pages are a single indexed query, cheap enough to run in the thread pool
+    def build():
+        paginator = ItemCursorPagination()
+        serializer = ItemRowSerializer(ItemRowSerializer.parse_fields(request.GET.get('fields')),
+                                       [paginator.get_ordering(request)[0]])
+        queryset = item_queryset(request.GET, ordered=False)
+        rows = paginator.paginate_queryset(serializer.project(queryset), request)
+        payload = paginator.get_paginated_response(serializer.serialize(rows)).data
+        facets = facet_counts(request, queryset)
+        if facets is not None:
+            payload['facets'] = facets
+        return payload
+    return json_response(await sync_to_async(build)())
+
+
+@async_api_view(['GET'])
+async def getItem(request):
+    SKU = request.GET.get('SKU')
+    if not SKU:
+        return json_response("Please provide SKU", status.HTTP_400_BAD_REQUEST)
+    serializer = ItemRowSerializer(ItemRowSerializer.parse_fields(request.GET.get('fields')))
+    item = await serializer.project(Item.objects.filter(SKU=SKU)).afirst()
+    if not item:
+        return json_response("Not found", status.HTTP_404_NOT_FOUND)
+    return json_response(serializer.to_dict(item))
+
+
+@async_api_view(['GET'])
+async def getAllCategories(request):
+    serializer = CategoryRowSerializer(CategoryRowSerializer.parse_fields(request.GET.get('fields')))
+    rows = serializer.project(Category.objects.all())
+    return json_response(serializer.serialize([row async for row in rows]))
+
+
+@async_api_view(['GET'])
+async def testToken(request):
+    return json_response("passed!")
+
+
+def split_param(request, name):
+    # ?category=a&category=b and ?category=a,b both work
+    return [value.strip() for raw in request.GET.getlist(name) for value in raw.split(',') if value.strip()]
+
+
+@async_api_view(['POST'])
+async def streamToken(request):
+    # a short-lived credential for EventSource, which can't send the token header
+    return json_response({
+        'stream_token': changefeed.issue_stream_token(request.user),
+        'expires_in': changefeed.get_config()['STREAM_TOKEN_TTL'],
+    })
+
+
+@async_api_view(['GET'], stream_token=True)
+async def changeStream(request):
+    if not isinstance(request, ASGIRequest):
+        # a WSGI worker would buffer the endless body forever
+        return json_response("The change stream needs an ASGI server.", status.HTTP_501_NOT_IMPLEMENTED)
+    types = split_param(request, 'type')
+    unknown = [name for name in types if name not in changefeed.EVENT_TYPES]
+    if unknown:
+        raise ValidationError({'type': f'Unknown event types: {", ".join(unknown)}.'})
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    resume = changefeed.parse_event_id(last_event_id)
+    if last_event_id and resume is None:
+        raise ValidationError({'last_event_id': 'Expected an id from a previous event.'})
+    event_filter = changefeed.EventFilter(split_param(request, 'category'), split_param(request, 'sku'), types)
+    subscription, backlog, reset = changefeed.get_hub().subscribe(event_filter, resume)
+    response = StreamingHttpResponse(
+        changefeed.stream(subscription, backlog, reset, changefeed.get_config()['HEARTBEAT']),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # keep proxies such as nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
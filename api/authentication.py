@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    # seconds a resolved token stays in the in-process cache
+    'LOCAL_TTL': 300,
+    'MAX_SIZE': 10000,
+    # alias from CACHES to share resolved tokens between processes, e.g. a redis
+    # cache. Other processes only see an invalidation once their local entry
+    # expires, so keep LOCAL_TTL short when this is set.
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU with a per-entry time to live.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenCache:
+    """
+    Token key to (user, token) lookups, in process first and then in the
+    optional shared cache.
+    """
+    prefix = 'authtoken:'
+
+    def __init__(self):
+        config = get_config()
+        self.local = LRUCache(config['MAX_SIZE'], config['LOCAL_TTL'])
+        self.shared = caches[config['SHARED_CACHE']] if config['SHARED_CACHE'] else None
+        self.shared_ttl = config['SHARED_TTL']
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(self.prefix + key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(self.prefix + key, value, self.shared_ttl)
+
+    async def aget(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = await self.shared.aget(self.prefix + key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    async def aset(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            await self.shared.aset(self.prefix + key, value, self.shared_ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(self.prefix + key)
+
+    def clear_local(self):
+        self.local.clear()
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache()
+    return _token_cache
+
+
+def invalidate_token(key):
+    get_token_cache().delete(key)
+
+
+def invalidate_user(user):
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that skips the Token/User query for recently seen tokens.
+    """
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        cache.set(key, (user, token))
+        return user, token
+
+
+async def aauthenticate_token(key):
+    """
+    Async counterpart of CachedTokenAuthentication.authenticate_credentials.
+
+    Returns (user, token), or None when the key is unknown or the user inactive.
+    """
+    cache = get_token_cache()
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        return None
+    if not token.user.is_active:
+        return None
+    await cache.aset(key, (token.user, token))
+    return token.user, token
@@ -0,0 +1,208 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from .importer import MAX_LENGTHS, STOCK_STATUSES, UPDATE_FIELDS
+from .models import Category, Item
+from .rollups import contribution
+from .serializers import ItemRowSerializer
+from .signals import bulk_item_writes, items_bulk_deleted, items_bulk_saved
+
+# more SKUs than this in one call is a client bug, not a batch
+MAX_BATCH_SIZE = 1000
+# leave room for the other parameters of the query
+RESERVED_PARAMS = 10
+DEFAULT_CHUNK_SIZE = 500
+
+
+def chunk_size():
+    """How many values fit in one IN (...) list on this database."""
+    limit = connection.features.max_query_params
+    if not limit:
+        return DEFAULT_CHUNK_SIZE
+    return max(1, min(DEFAULT_CHUNK_SIZE, limit - RESERVED_PARAMS))
+
+
+def chunked(values, size=None):
+    size = size or chunk_size()
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def parse_skus(data):
+    """Return (SKUs, error) from a list of SKUs or a comma separated string."""
+    if isinstance(data, str):
+        data = data.split(',')
+    if not isinstance(data, list) or not data:
+        return None, 'Provide a list of SKUs.'
+    if not all(isinstance(sku, str) for sku in data):
+        return None, 'Every SKU must be a string.'
+    skus = [sku.strip() for sku in data if sku.strip()]
+    if not skus:
+        return None, 'Provide a list of SKUs.'
+    if len(skus) > MAX_BATCH_SIZE:
+        return None, f'At most {MAX_BATCH_SIZE} SKUs per request.'
+    return skus, None
+
+
+def fetch_items(skus):
+    """
+    Look up ``skus`` with one query per chunk and return a result per SKU in
+    the order given, with status ok and the item, or status not_found.
+    """
+    serializer = ItemRowSerializer()
+    found = {}
+    for chunk in chunked(dict.fromkeys(skus)):
+        for row in serializer.project(Item.objects.filter(SKU__in=chunk)):
+            found[row.SKU] = serializer.to_dict(row)
+    return [
+        {'SKU': sku, 'status': 'ok', 'item': found[sku]} if sku in found else {'SKU': sku, 'status': 'not_found'}
+        for sku in skus
+    ]
+
+
+def validate_changes(row):
+    """Return (SKU, changes, expected version, errors) for one partial update."""
+    if not isinstance(row, dict):
+        return None, {}, None, {'row': ['Expected an object with SKU and the fields to change.']}
+    errors, changes = {}, {}
+    sku = row.get('SKU')
+    if not isinstance(sku, str) or not sku.strip():
+        errors['SKU'] = ['This field is required.']
+        sku = None
+    unknown = set(row) - set(UPDATE_FIELDS) - {'SKU', 'expected_version'}
+    if unknown:
+        errors['non_field_errors'] = [f'Unknown fields: {", ".join(sorted(unknown))}.']
+    for field in ('name', 'category'):
+        if field in row:
+            value = str(row[field] or '').strip()
+            if not value:
+                errors[field] = ['This field may not be blank.']
+            changes[field] = value
+    if 'tags' in row:
+        changes['tags'] = str(row['tags']) if row['tags'] not in (None, '') else None
+    for field, limit in MAX_LENGTHS.items():
+        if changes.get(field) and len(changes[field]) > limit:
+            errors[field] = [f'Ensure this field has no more than {limit} characters.']
+    if 'stock_status' in row:
+        if row['stock_status'] not in STOCK_STATUSES:
+            errors['stock_status'] = [f'"{row["stock_status"]}" is not a valid choice.']
+        changes['stock_status'] = row['stock_status']
+    if 'available_stock' in row:
+        value = row['available_stock']
+        if isinstance(value, bool) or not isinstance(value, int):
+            errors['available_stock'] = ['A valid integer is required.']
+        changes['available_stock'] = value
+    expected = row.get('expected_version')
+    if expected is not None and (isinstance(expected, bool) or not isinstance(expected, int)):
+        errors['expected_version'] = ['A valid integer is required.']
+    if not changes and not errors:
+        errors['non_field_errors'] = ['No fields to change.']
+    return sku, changes, expected, errors
+
+
+def _add_contribution(deltas, item, sign):
+    for index, value in enumerate(contribution(item.available_stock)):
+        deltas[(item.category_id, item.stock_status)][index] += sign * value
+
+
+def _rollup_deltas(deltas):
+    return {key: tuple(delta) for key, delta in deltas.items() if any(delta)}
+
+
+def update_items(rows):
+    """
+    Apply a list of partial updates keyed on SKU and return a result per row.
+
+    Each chunk is read, validated and written with one bulk_update in its own
+    transaction, then announced with items_bulk_saved.
+    """
+    results = [None] * len(rows)
+    parsed = []
+    for position, row in enumerate(rows):
+        sku, changes, expected, errors = validate_changes(row)
+        if errors:
+            results[position] = {'SKU': sku, 'status': 'invalid', 'errors': errors}
+        else:
+            parsed.append((position, sku, changes, expected))
+    for chunk in chunked(parsed):
+        _update_chunk(chunk, results)
+    return results
+
+
+def _update_chunk(chunk, results):
+    with transaction.atomic():
+        items = {item.SKU: item for item in Item.objects.select_for_update().filter(
+            SKU__in={sku for _, sku, _, _ in chunk})}
+        known = set(Category.objects.filter(
+            name__in={changes['category'] for _, _, changes, _ in chunk if 'category' in changes}
+        ).values_list('name', flat=True))
+        deltas = defaultdict(lambda: [0, 0, 0])
+        categories, fields, changed = set(), set(), {}
+        for position, sku, changes, expected in chunk:
+            item = items.get(sku)
+            if item is None:
+                results[position] = {'SKU': sku, 'status': 'not_found'}
+                continue
+            if expected is not None and expected != item.version:
+                results[position] = {'SKU': sku, 'status': 'conflict', 'version': item.version}
+                continue
+            if 'category' in changes and changes['category'] not in known:
+                results[position] = {'SKU': sku, 'status': 'invalid', 'errors': {
+                    'category': [f'Invalid pk "{changes["category"]}" - object does not exist.']}}
+                continue
+            categories.add(item.category_id)
+            _add_contribution(deltas, item, -1)
+            for field, value in changes.items():
+                setattr(item, 'category_id' if field == 'category' else field, value)
+            item.version += 1
+            _add_contribution(deltas, item, 1)
+            categories.add(item.category_id)
+            fields.update(changes)
+            changed[item.id] = item
+            results[position] = {'SKU': sku, 'status': 'ok', 'version': item.version}
+        if not changed:
+            return
+        update_fields = sorted(fields) + ['version']
+        Item.objects.bulk_update(changed.values(), update_fields)
+        items_bulk_saved.send(
+            sender=Item,
+            items=list(changed.values()),
+            categories=categories,
+            created_categories=set(),
+            update_fields=update_fields,
+            rollup_deltas=_rollup_deltas(deltas),
+        )
+
+
+def delete_chunk(queryset):
+    """
+    Delete the items in ``queryset`` with a fixed number of queries and
+    announce it with items_bulk_deleted. Returns the deleted items.
+    """
+    items = list(queryset.only('id', 'SKU', 'category_id', 'stock_status', 'available_stock'))
+    if not items:
+        return []
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for item in items:
+        _add_contribution(deltas, item, -1)
+    with bulk_item_writes():
+        Item.objects.filter(id__in=[item.id for item in items]).delete()
+    items_bulk_deleted.send(
+        sender=Item,
+        ids=[item.id for item in items],
+        items=items,
+        categories={item.category_id for item in items},
+        rollup_deltas=_rollup_deltas(deltas),
+    )
+    return items
+
+
+def delete_items(skus):
+    """Delete items by SKU, a chunk per transaction, and return a result per SKU."""
+    deleted = set()
+    for chunk in chunked(dict.fromkeys(skus)):
+        with transaction.atomic():
+            deleted.update(item.SKU for item in delete_chunk(Item.objects.filter(SKU__in=chunk)))
+    return [{'SKU': sku, 'status': 'ok' if sku in deleted else 'not_found'} for sku in skus]
@@ -0,0 +1,105 @@
+import math
+import os
+import random
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .models import Category, Item
+from .rollups import rebuild
+from .tags import sync_tags
+
+
+@contextmanager
+def benchmark_database(keep=False):
+    """
+    Run against a throwaway migrated copy of the default database.
+
+    On SQLite the copy is a real file rather than Django's in-memory test
+    database, so several threads can open their own connections to it.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    original_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and not original_name:
+        handle, path = tempfile.mkstemp(prefix='bench-', suffix='.sqlite3')
+        os.close(handle)
+        os.unlink(path)
+        test_settings['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keep)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+        test_settings['NAME'] = original_name
+
+
+def seed_catalog(items, categories=50, seed=0, batch_size=5000):
+    """Bulk insert a synthetic catalog; returns the category names."""
+    rng = random.Random(seed)
+    names = [f'category-{i:04}' for i in range(categories)]
+    Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+    statuses = ['In Stock', 'Out of Stock', 'Backordered']
+    tags = ['cotton', 'wool', 'summer', 'winter', 'sale', 'new', 'kids', 'outdoor']
+    for start in range(0, items, batch_size):
+        created = Item.objects.bulk_create([
+            Item(
+                SKU=f'SKU-{i:08}',
+                name=f'Item {rng.randrange(items):08} {rng.choice(tags)}',
+                category_id=rng.choice(names),
+                tags=','.join(rng.sample(tags, 2)),
+                stock_status=rng.choice(statuses),
+                available_stock=rng.randrange(500),
+            )
+            for i in range(start, min(start + batch_size, items))
+        ])
+        if not all(item.id for item in created):
+            created = list(Item.objects.filter(SKU__in=[item.SKU for item in created]))
+        sync_tags(created)
+    # bulk_create skips the tag and rollup signals
+    rebuild()
+    return names
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * percent / 100) - 1))]
+
+
+def summarize(latencies, elapsed, queries):
+    """Throughput and latency figures, in ms, for one benchmarked scenario."""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'queries': queries,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare two result sets keyed by scenario. Returns a row per scenario in
+    both, with how much slower p50 got and whether that is over ``threshold``
+    (a fraction, 0.1 for 10%) or the query count went up.
+    """
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0
+        more_queries = (result.get('queries') or 0) > (before.get('queries') or 0)
+        rows.append({
+            'scenario': name,
+            'baseline_p50_ms': before['p50_ms'],
+            'p50_ms': result['p50_ms'],
+            'change': round(change, 4),
+            'queries': (before.get('queries'), result.get('queries')),
+            'regression': change > threshold or more_queries,
+        })
+    return rows
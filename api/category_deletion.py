@@ -0,0 +1,140 @@
+"""
+Background category deletion.
+
+Deleting a category used to cascade through all of its items in one
+transaction. Instead, start_deletion() records a CategoryDeletion job and
+run_deletion() removes the items a batch at a time, each batch in its own
+short transaction with a pause in between, so other writers get the database
+between batches. The category row goes last, once it has no items left.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .batch import delete_chunk
+from .db import retry_on_lock
+from .models import Category, CategoryDeletion, Item
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    # seconds to sleep between batches, leaving the write lock to others
+    'PAUSE': 0.05,
+    # a running job not heard from for this many seconds is picked up again
+    'STALE_AFTER': 300,
+    # start deleting in a thread of the web process as soon as the job commits;
+    # turn off to leave jobs to manage.py run_category_deletions
+    'RUN_IN_THREAD': True,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATEGORY_DELETION', {})}
+
+
+def job_status(job):
+    return {
+        'job': job.id,
+        'category': job.category,
+        'status': job.status,
+        'total_items': job.total_items,
+        'deleted_items': job.deleted_items,
+        'error': job.error or None,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def start_deletion(category):
+    """Queue the deletion of ``category``, or return the job already deleting it."""
+    with transaction.atomic():
+        job = CategoryDeletion.objects.filter(
+            category=category.pk, status__in=CategoryDeletion.ACTIVE).first()
+        if job is not None:
+            return job
+        job = CategoryDeletion.objects.create(
+            category=category.pk, total_items=Item.objects.filter(category=category).count(),
+        )
+        if get_config()['RUN_IN_THREAD']:
+            transaction.on_commit(lambda: run_in_thread(job.id))
+    return job
+
+
+def cancel_deletion(job):
+    """
+    Stop ``job`` after the batch in flight. Items already deleted stay deleted.
+    Returns False when the job had already finished.
+    """
+    cancelled = CategoryDeletion.objects.filter(pk=job.pk, status__in=CategoryDeletion.ACTIVE).update(
+        status=CategoryDeletion.CANCELLED, finished_at=timezone.now(), updated_at=timezone.now(),
+    )
+    return bool(cancelled)
+
+
+def run_in_thread(job_id):
+    def target():
+        try:
+            run_deletion(job_id)
+        finally:
+            connection.close()
+    threading.Thread(target=target, daemon=True, name=f'category-deletion-{job_id}').start()
+
+
+def claim(job_id, config):
+    now = timezone.now()
+    stale = now - timedelta(seconds=config['STALE_AFTER'])
+    return bool(CategoryDeletion.objects.filter(
+        Q(status=CategoryDeletion.QUEUED) | Q(status=CategoryDeletion.RUNNING, updated_at__lt=stale),
+        pk=job_id,
+    ).update(status=CategoryDeletion.RUNNING, updated_at=now))
+
+
+def run_deletion(job_id, config=None):
+    """Delete the job's category batch by batch. Returns False if another worker owns the job."""
+    config = config or get_config()
+    if not claim(job_id, config):
+        return False
+    job = CategoryDeletion.objects.get(pk=job_id)
+    running = CategoryDeletion.objects.filter(pk=job_id, status=CategoryDeletion.RUNNING)
+    try:
+        while retry_on_lock(delete_batch, job, running, config['BATCH_SIZE']):
+            time.sleep(config['PAUSE'])
+    except Exception as exc:
+        logger.exception('Deleting category %r failed', job.category)
+        running.update(status=CategoryDeletion.FAILED, error=f'{type(exc).__name__}: {exc}',
+                       finished_at=timezone.now(), updated_at=timezone.now())
+    return True
+
+
+@transaction.atomic
+def delete_batch(job, running, batch_size):
+    """Delete one batch of the job's items. Returns False once there is nothing left to do."""
+    # write first: the batch takes the write lock before reading anything, which
+    # SQLite can't always upgrade to later; no row means the job was cancelled
+    if not running.update(updated_at=timezone.now()):
+        return False
+    batch = Item.objects.filter(category_id=job.category).order_by('id')[:batch_size]
+    deleted = len(delete_chunk(batch))
+    if not deleted:
+        # no items left: take the category (and its rollups) with it
+        running.update(status=CategoryDeletion.DONE, finished_at=timezone.now(), updated_at=timezone.now())
+        Category.objects.filter(pk=job.category).delete()
+        return False
+    running.update(deleted_items=F('deleted_items') + deleted)
+    return True
+
+
+def pending_jobs(config=None):
+    """Ids of queued jobs and of running jobs whose worker went quiet."""
+    config = config or get_config()
+    stale = timezone.now() - timedelta(seconds=config['STALE_AFTER'])
+    return list(CategoryDeletion.objects.filter(
+        Q(status=CategoryDeletion.QUEUED) | Q(status=CategoryDeletion.RUNNING, updated_at__lt=stale),
+    ).order_by('created_at').values_list('id', flat=True))
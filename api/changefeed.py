@@ -0,0 +1,279 @@
+"""
+Change feed.
+
+Item and category writes are published, once their transaction commits, to
+a hub that keeps the last BUFFER_SIZE events and fans new ones out to
+subscribers. async_views.changeStream serves them as Server-Sent Events, so
+dashboards can be pushed stock changes instead of polling item-list.
+
+Event ids are ``<epoch>:<seq>``: seq counts up from 1 in each hub, and epoch
+changes whenever a hub starts, so a client resuming with an id from a
+restarted process, or one too old for the buffer, is told to reset.
+
+LocalHub only sees the writes of its own process, so the feed is complete
+only when one process serves both the writes and the stream. Deployments
+running several workers point HUB at a hub backed by a shared broker (Redis
+pub/sub, a channel layer) implementing publish() and subscribe() the same way.
+
+Browsers' EventSource can't send an Authorization header: clients trade
+their API token for a stream token, valid for STREAM_TOKEN_TTL seconds and
+only on the change stream, and pass it as ?stream_token=.
+"""
+import asyncio
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .renderers import FastJSONRenderer
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HUB': 'api.changefeed.LocalHub',
+    # events kept for clients resuming after a disconnect
+    'BUFFER_SIZE': 1000,
+    # events queued for one slow client before its stream is closed; it
+    # reconnects and resumes from the buffer
+    'QUEUE_SIZE': 500,
+    # seconds between keep-alive comments on idle streams
+    'HEARTBEAT': 15,
+    # seconds a stream token can open a stream for; an open stream outlives it
+    'STREAM_TOKEN_TTL': 60,
+}
+
+STREAM_TOKEN_SALT = 'api.changefeed.stream'
+
+ITEM_CREATED = 'item.created'
+ITEM_UPDATED = 'item.updated'
+ITEM_DELETED = 'item.deleted'
+CATEGORY_CREATED = 'category.created'
+CATEGORY_DELETED = 'category.deleted'
+EVENT_TYPES = (ITEM_CREATED, ITEM_UPDATED, ITEM_DELETED, CATEGORY_CREATED, CATEGORY_DELETED)
+# sent first to a client whose resume id can't be honoured: refetch, then follow
+RESET = 'reset'
+
+ITEM_FIELDS = ('SKU', 'name', 'category', 'tags', 'stock_status', 'available_stock', 'version')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHANGE_FEED', {})}
+
+
+class Event:
+    __slots__ = ('seq', 'type', 'data', 'categories', 'sku')
+
+    def __init__(self, seq, type, data, categories):
+        self.seq = seq
+        self.type = type
+        self.data = data
+        # every category the change touched: an item moving out of a
+        # category matters to that category's subscribers too
+        self.categories = categories
+        self.sku = data.get('SKU')
+
+    def encode(self, epoch):
+        return (
+            f'id: {epoch}:{self.seq}\nevent: {self.type}\ndata: '.encode()
+            + FastJSONRenderer().render(self.data) + b'\n\n'
+        )
+
+
+class EventFilter:
+    """Categories, SKUs and event types a subscriber wants; empty means all of them."""
+
+    def __init__(self, categories=(), skus=(), types=()):
+        self.categories = set(categories)
+        self.skus = set(skus)
+        self.types = set(types)
+
+    def __call__(self, event):
+        if self.types and event.type not in self.types:
+            return False
+        if self.categories and not self.categories & event.categories:
+            return False
+        if self.skus and event.sku not in self.skus:
+            return False
+        return True
+
+
+def parse_event_id(value):
+    """(epoch, seq) from an event id, or None when it is missing or malformed."""
+    epoch, _, seq = (value or '').strip().partition(':')
+    if not epoch or not seq.isdigit():
+        return None
+    return epoch, int(seq)
+
+
+class Subscription:
+    """
+    One client's view of a hub. Events are handed over from any thread and
+    read by the client's event loop with next_batch().
+    """
+
+    def __init__(self, hub, event_filter, queue_size, loop):
+        self.hub = hub
+        self.filter = event_filter
+        self.queue_size = queue_size
+        self.loop = loop
+        self.pending = deque()
+        self.overflowed = False
+        self.wakeup = asyncio.Event()
+        # the last event published before this client subscribed
+        self.start_seq = 0
+
+    def deliver(self, event):
+        # publisher side, on any thread
+        if not self.filter(event):
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._append, event)
+        except RuntimeError:
+            # the client's loop is gone
+            self.hub.unsubscribe(self)
+
+    def _append(self, event):
+        if len(self.pending) >= self.queue_size:
+            self.overflowed = True
+        else:
+            self.pending.append(event)
+        self.wakeup.set()
+
+    async def next_batch(self, timeout):
+        """Events received since the last call; empty after ``timeout`` seconds without any."""
+        if not self.pending and not self.overflowed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.wakeup.clear()
+        batch = list(self.pending)
+        self.pending.clear()
+        return batch
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalHub:
+    """In-process hub: subscribers see the writes made by this process."""
+
+    def __init__(self, config=None):
+        config = config or get_config()
+        self.queue_size = config['QUEUE_SIZE']
+        self.epoch = secrets.token_hex(4)
+        self._seq = 0
+        self._buffer = deque(maxlen=config['BUFFER_SIZE'])
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, type, data, categories=()):
+        with self._lock:
+            self._seq += 1
+            event = Event(self._seq, type, data, set(categories))
+            self._buffer.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, event_filter, last_event_id=None):
+        """
+        Register a subscriber, from inside its event loop. Returns the
+        subscription, the buffered events after ``last_event_id`` that it
+        missed, and whether it must reset because those are not all known.
+        """
+        subscription = Subscription(self, event_filter, self.queue_size, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+            subscription.start_seq = self._seq
+            backlog, reset = [], False
+            if last_event_id is not None:
+                epoch, seq = last_event_id
+                oldest = self._buffer[0].seq if self._buffer else self._seq + 1
+                if epoch != self.epoch or seq > self._seq or seq < oldest - 1:
+                    reset = True
+                else:
+                    backlog = [event for event in self._buffer if event.seq > seq and event_filter(event)]
+        return subscription, backlog, reset
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = import_string(get_config()['HUB'])()
+    return _hub
+
+
+def reset_hub():
+    global _hub
+    _hub = None
+
+
+def issue_stream_token(user):
+    return signing.dumps(user.pk, salt=STREAM_TOKEN_SALT)
+
+
+def stream_token_user_id(value):
+    """The id of the user a stream token was issued to, None when it is forged or expired."""
+    try:
+        return signing.loads(value, salt=STREAM_TOKEN_SALT, max_age=get_config()['STREAM_TOKEN_TTL'])
+    except signing.BadSignature:
+        return None
+
+
+def publish(type, data, categories=()):
+    """Publish an event once the current transaction, if any, commits."""
+    categories = {category for category in categories if category is not None}
+    transaction.on_commit(lambda: get_hub().publish(type, data, categories))
+
+
+def item_data(item):
+    """The loaded item fields, in item-detail names."""
+    deferred = item.get_deferred_fields()
+    data = {}
+    for field in ITEM_FIELDS:
+        attname = 'category_id' if field == 'category' else field
+        if attname not in deferred:
+            data[field] = getattr(item, attname)
+    return data
+
+
+async def stream(subscription, backlog, reset, heartbeat):
+    """The SSE body of ``subscription``: a reset or the backlog, then live events."""
+    epoch = subscription.hub.epoch
+    try:
+        yield f'retry: 3000\n: connected {time.time():.0f}\n\n'.encode()
+        if reset:
+            yield f'id: {epoch}:{subscription.start_seq}\nevent: {RESET}\ndata: {{}}\n\n'.encode()
+        for event in backlog:
+            yield event.encode(epoch)
+        while True:
+            batch = await subscription.next_batch(heartbeat)
+            if batch:
+                yield b''.join(event.encode(epoch) for event in batch)
+            elif not subscription.overflowed:
+                yield b': keep-alive\n\n'
+            if subscription.overflowed:
+                # the client resumes from its last id, and the buffer, on reconnect
+                logger.info('Closing a change stream that fell %d events behind', subscription.queue_size)
+                return
+    finally:
+        subscription.close()
@@ -0,0 +1,133 @@
+"""
+Change log and delta sync.
+
+Every item and category write appends ChangeLog rows in its own
+transaction (see signals.connect_changelog_signals). Offline clients keep
+the id of the last row they synced as a watermark and ask item-sync for
+what changed after it: the answer is the current state of every key
+touched since, a batch at a time, so reconnecting costs as much as the
+churn, not the catalog.
+
+compact() keeps the log small: it drops rows superseded by a newer row for
+the same key, which no client needs, and rows older than RETENTION_DAYS,
+after which clients with an older watermark are told to download the
+catalog again.
+
+Watermarks rely on log ids committing in order: a client that synced
+while a lower id was still uncommitted would skip it for good. SQLite's
+single writer guarantees the order. On PostgreSQL ids come from a sequence
+and commit in any order, so record() takes a transaction-scoped advisory
+lock first: writers append to the log one transaction at a time, from
+their first log row to their commit.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Category, ChangeLog, ChangeLogCompaction, Item
+from .serializers import ItemRowSerializer
+
+DEFAULTS = {
+    # log rows read per sync request, unless the client asks for fewer
+    'BATCH_SIZE': 500,
+    'MAX_BATCH_SIZE': 5000,
+    # compact() drops rows older than this; None keeps them forever
+    'RETENTION_DAYS': 30,
+}
+
+# pg_advisory_xact_lock key serializing change log writers
+ADVISORY_LOCK_KEY = 0x6368616e6765
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHANGE_LOG', {})}
+
+
+def record(kind, action, keys):
+    if not keys:
+        return
+    # a failed log row fails the write, no savepoint needed
+    with transaction.atomic(savepoint=False):
+        if connection.vendor == 'postgresql':
+            # held until the outermost transaction ends, so ids commit in order
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [ADVISORY_LOCK_KEY])
+        ChangeLog.objects.bulk_create([ChangeLog(kind=kind, key=key, action=action) for key in keys])
+
+
+def current_watermark():
+    return ChangeLog.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def horizon():
+    """Clients whose watermark is below this missed rows compaction dropped."""
+    return ChangeLogCompaction.objects.aggregate(last=Max('compacted_through'))['last'] or 0
+
+
+def changes_since(since, limit):
+    """
+    The sync payload for a client at watermark ``since`` (None for a client
+    with no data yet): either a reset, or the state of everything changed in
+    the next ``limit`` log rows, each key once.
+    """
+    if since is None or since < horizon():
+        # download the catalog, then sync from this watermark
+        return {'reset': True, 'watermark': current_watermark(), 'more': False}
+
+    rows = list(ChangeLog.objects.filter(id__gt=since).order_by('id').values_list('id', 'kind', 'key')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    keys = {ChangeLog.ITEM: set(), ChangeLog.CATEGORY: set()}
+    for _, kind, key in rows:
+        keys[kind].add(key)
+
+    # read the current state rather than replaying actions: whatever the
+    # log says happened, a key that no longer exists is a delete
+    # batch imports the signals, which import this module
+    from .batch import chunked
+
+    serializer = ItemRowSerializer()
+    items = []
+    for skus in chunked(sorted(keys[ChangeLog.ITEM])):
+        items += serializer.serialize(serializer.project(Item.objects.filter(SKU__in=skus)))
+    items.sort(key=lambda item: item['SKU'])
+    categories = []
+    for names in chunked(sorted(keys[ChangeLog.CATEGORY])):
+        categories += Category.objects.filter(name__in=names).values_list('name', flat=True)
+    categories.sort()
+    return {
+        'reset': False,
+        'watermark': rows[-1][0] if rows else since,
+        'more': more,
+        'items': {
+            'upserted': items,
+            'deleted': sorted(keys[ChangeLog.ITEM] - {item['SKU'] for item in items}),
+        },
+        'categories': {
+            'upserted': categories,
+            'deleted': sorted(keys[ChangeLog.CATEGORY] - set(categories)),
+        },
+    }
+
+
+def compact(retention_days=None, now=None):
+    """
+    Drop superseded log rows, then rows older than the retention period.
+    Returns (superseded rows deleted, expired rows deleted).
+    """
+    if retention_days is None:
+        retention_days = get_config()['RETENTION_DAYS']
+    newest = ChangeLog.objects.values('kind', 'key').annotate(last=Max('id')).values('last')
+    superseded, _ = ChangeLog.objects.exclude(id__in=newest).delete()
+    expired = 0
+    if retention_days is not None:
+        cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+        through = ChangeLog.objects.filter(created_at__lt=cutoff).aggregate(last=Max('id'))['last']
+        if through is not None:
+            # record the horizon before the rows go, so no sync sees a gap unannounced
+            ChangeLogCompaction.objects.create(compacted_through=through)
+            expired, _ = ChangeLog.objects.filter(id__lte=through).delete()
+    return superseded, expired
@@ -0,0 +1,95 @@
+"""
+Database connection setup.
+
+configure_connection() runs on every new connection and applies the
+DATABASE_TUNING settings: on SQLite, cache, mmap and lock wait PRAGMAs.
+Connections are kept open between requests (CONN_MAX_AGE on SQLite, a
+psycopg pool on PostgreSQL, see settings.DATABASES), so this runs once per
+connection, not per request.
+
+The journal mode is different: WAL, so readers no longer wait for writers,
+is stored in the database file itself. Setting it on connect would rewrite
+the file whenever anything, even manage.py check, opened a database still
+in another mode, so set_journal_mode() applies it once, from migration
+0014. After changing it in DATABASE_TUNING, set it with
+``PRAGMA journal_mode`` in manage.py dbshell.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # applied in this order to every new SQLite connection; None skips one
+    'SQLITE_PRAGMAS': {
+        # readers see the last commit instead of blocking behind a writer;
+        # kept in the database file, so only set by set_journal_mode()
+        'journal_mode': 'WAL',
+        # with WAL, only a power loss can drop the last commits, never corrupt the file
+        'synchronous': 'NORMAL',
+        # negative: KiB, so 64 MiB of page cache per connection
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        # ms a connection waits for a lock before "database is locked"
+        'busy_timeout': 5000,
+        # truncate the WAL file back to this size after checkpoints
+        'journal_size_limit': 67108864,
+    },
+}
+
+# SQLite refuses to upgrade a read transaction to a write one while another
+# writer holds the lock, without waiting for busy_timeout, so whole
+# transactions are retried with a short backoff. Transactions started BEGIN
+# IMMEDIATE (OPTIONS transaction_mode) take the write lock up front and wait
+# instead; this still covers connections configured without it.
+MAX_LOCK_RETRIES = 10
+LOCK_BACKOFF = 0.01
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_TUNING', {})}
+
+# PRAGMAs stored in the database file rather than set per connection
+PERSISTENT_PRAGMAS = ('journal_mode',)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver: tune ``connection`` for concurrent use."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in get_config()['SQLITE_PRAGMAS'].items():
+            if value is None or pragma in PERSISTENT_PRAGMAS:
+                continue
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def set_journal_mode(connection):
+    """Switch ``connection``'s SQLite database to the configured journal mode, unless it is in it already."""
+    value = get_config()['SQLITE_PRAGMAS'].get('journal_mode')
+    if connection.vendor != 'sqlite' or value is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        if cursor.fetchone()[0].lower() == str(value).lower():
+            return
+        cursor.execute(f'PRAGMA journal_mode = {value}')
+        mode = cursor.fetchone()[0]
+    # in-memory databases (the test database) stay in memory mode
+    if mode.lower() not in (str(value).lower(), 'memory'):
+        logger.warning('SQLite kept journal_mode %s instead of %s', mode, value)
+
+
+def retry_on_lock(func, *args, **kwargs):
+    """Call ``func``, which must run its own transaction, again while the database reports it locked."""
+    for attempt in range(MAX_LOCK_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if 'locked' not in str(exc) or attempt == MAX_LOCK_RETRIES - 1:
+                raise
+            time.sleep(LOCK_BACKOFF * (2 ** attempt))
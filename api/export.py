@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional, only needed for the arrow format
+    pyarrow = None
+
+# column order and names of ItemSerializer
+EXPORT_FIELDS = ('SKU', 'name', 'category', 'tags', 'stock_status', 'available_stock')
+QUERY_FIELDS = ('SKU', 'name', 'category_id', 'tags', 'stock_status', 'available_stock')
+CHUNK_SIZE = 2000
+
+
+def export_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Plain tuples straight from the cursor, never model instances."""
+    return queryset.values_list(*QUERY_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_csv(rows, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows, chunk_size=CHUNK_SIZE):
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(encode(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in chunk)
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_arrow(rows, chunk_size=CHUNK_SIZE):
+    """Arrow IPC stream, one record batch per chunk."""
+    schema = pyarrow.schema([
+        ('SKU', pyarrow.string()),
+        ('name', pyarrow.string()),
+        ('category', pyarrow.string()),
+        ('tags', pyarrow.string()),
+        ('stock_status', pyarrow.string()),
+        ('available_stock', pyarrow.int64()),
+    ])
+    sink = _ByteSink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    yield sink.drain()
+    for chunk in _chunks(rows, chunk_size):
+        columns = zip(*chunk)
+        writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8', 'csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+if pyarrow is not None:
+    EXPORT_FORMATS['arrow'] = (stream_arrow, 'application/vnd.apache.arrow.stream', 'arrows')
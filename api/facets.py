@@ -0,0 +1,65 @@
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
+
+from .models import InventoryRollup, ItemTag
+from .queries import rollup_filters
+
+FACETS = ('category', 'stock_status', 'tag')
+# the tag facet lists the most used tags only
+MAX_TAG_VALUES = 50
+
+
+def parse_facets(value):
+    """Facet names asked for with ?facets=category,tag, or ?facets=true for all of them."""
+    if value is None:
+        return []
+    if value.strip().lower() in ('true', '1', 'all'):
+        return list(FACETS)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValidationError({'facets': f'Unknown facets: {", ".join(unknown)}. Choose from {", ".join(FACETS)}.'})
+    return list(dict.fromkeys(names))
+
+
+def _ranked(counts):
+    return dict(sorted(counts.items(), key=lambda pair: (-pair[1], pair[0])))
+
+
+def facet_counts(request, queryset):
+    """
+    Item counts per value of each facet in ?facets= under the current filters,
+    or None when no facets were asked for.
+
+    Category and stock status come from one GROUP BY over the matching items,
+    or straight from the rollup table when the only filters are category and
+    stock status. Tags take one grouped query over the item-tag links, of the
+    matching items only when there are filters.
+    """
+    names = parse_facets(request.GET.get('facets'))
+    if not names:
+        return None
+    facets = {}
+    filters = rollup_filters(request.GET)
+    if 'category' in names or 'stock_status' in names:
+        if filters is None:
+            rows = queryset.order_by().values_list('category_id', 'stock_status').annotate(items=Count('id'))
+        else:
+            rows = InventoryRollup.objects.filter(item_count__gt=0, **filters).values_list(
+                'category_id', 'stock_status', 'item_count')
+        by_category, by_status = {}, {}
+        for category, stock_status, items in rows:
+            by_category[category] = by_category.get(category, 0) + items
+            by_status[stock_status] = by_status.get(stock_status, 0) + items
+        if 'category' in names:
+            facets['category'] = _ranked(by_category)
+        if 'stock_status' in names:
+            facets['stock_status'] = _ranked(by_status)
+    if 'tag' in names:
+        links = ItemTag.objects.all()
+        if filters is None or filters:
+            links = links.filter(item__in=queryset.order_by().values('id'))
+        rows = links.values_list('tag__name').annotate(items=Count('id')).order_by(
+            '-items', 'tag__name')[:MAX_TAG_VALUES]
+        facets['tag'] = dict(rows)
+    return facets
@@ -0,0 +1,194 @@
+import codecs
+import csv
+import json
+from collections import defaultdict
+
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from .models import Category, Item
+from .rollups import contribution
+from .signals import items_bulk_saved
+
+IMPORT_FIELDS = ('SKU', 'name', 'category', 'tags', 'stock_status', 'available_stock')
+UPDATE_FIELDS = ['name', 'category', 'tags', 'stock_status', 'available_stock']
+STOCK_STATUSES = {choice for choice, _ in Item._meta.get_field('stock_status').choices}
+MAX_LENGTHS = {'SKU': 100, 'name': 255, 'category': 100, 'tags': 255}
+# keep the report readable for a feed that is wrong on every line
+MAX_REPORTED_ERRORS = 1000
+
+
+def text_stream(stream, encoding='utf-8'):
+    """Decode a binary file-like object lazily, one line at a time."""
+    return codecs.getreader(encoding)(stream)
+
+
+def read_csv(stream):
+    for line_number, row in enumerate(csv.DictReader(stream), start=2):
+        yield line_number, row
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None
+            continue
+        yield line_number, row
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'ndjson': read_jsonl}
+
+
+def validate_row(row):
+    """Return (cleaned row, errors) using the same rules as ItemSerializer."""
+    if not isinstance(row, dict):
+        return None, {'row': ['Expected an object with item fields.']}
+    cleaned, errors = {}, {}
+    for field in ('SKU', 'name', 'category'):
+        value = str(row.get(field) or '').strip()
+        if not value:
+            errors[field] = ['This field is required.']
+        cleaned[field] = value
+    tags = row.get('tags')
+    cleaned['tags'] = str(tags) if tags not in (None, '') else None
+    for field, limit in MAX_LENGTHS.items():
+        if cleaned[field] and len(cleaned[field]) > limit:
+            errors[field] = [f'Ensure this field has no more than {limit} characters.']
+
+    stock_status = row.get('stock_status')
+    if stock_status not in STOCK_STATUSES:
+        errors['stock_status'] = [f'"{stock_status}" is not a valid choice.']
+    cleaned['stock_status'] = stock_status
+
+    available_stock = row.get('available_stock')
+    if available_stock in (None, ''):
+        cleaned['available_stock'] = 0
+    else:
+        try:
+            cleaned['available_stock'] = int(available_stock)
+        except (TypeError, ValueError):
+            errors['available_stock'] = ['A valid integer is required.']
+    return cleaned, errors
+
+
+def rollup_deltas(before, after):
+    """The rollup deltas of replacing the ``before`` rows with the ``after`` rows."""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for items, sign in ((before, -1), (after, 1)):
+        for item in items:
+            for index, value in enumerate(contribution(item.available_stock)):
+                deltas[(item.category_id, item.stock_status)][index] += sign * value
+    return {key: tuple(delta) for key, delta in deltas.items() if any(delta)}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, sku, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'SKU': sku, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+
+class ItemImporter:
+    """
+    Upsert items on SKU from an iterator of (line number, row) pairs.
+
+    Rows are validated and written a batch at a time, each batch in its own
+    transaction, so one bad row or batch never throws away the rest.
+    """
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def run(self, rows):
+        result = ImportResult()
+        batch = []
+        for line, row in rows:
+            cleaned, errors = validate_row(row)
+            if errors:
+                result.add_error(line, (cleaned or {}).get('SKU') or None, errors)
+                continue
+            batch.append((line, cleaned))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch, result)
+                batch = []
+        if batch:
+            self.write_batch(batch, result)
+        return result
+
+    def write_batch(self, batch, result):
+        # a SKU repeated inside a batch: the last row wins
+        rows = {cleaned['SKU']: (line, cleaned) for line, cleaned in batch}
+        # batch imports this module
+        from .batch import chunked
+
+        try:
+            with transaction.atomic():
+                # locked, so the rollup deltas below stay exact
+                existing = {}
+                for skus in chunked(rows):
+                    existing.update((item.SKU, item) for item in Item.objects.select_for_update().filter(
+                        SKU__in=skus).only('SKU', 'category_id', 'stock_status', 'available_stock'))
+                names = {cleaned['category'] for _, cleaned in rows.values()}
+                known = set()
+                for chunk in chunked(names):
+                    known.update(Category.objects.filter(name__in=chunk).values_list('name', flat=True))
+                missing = names - known
+                Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+                Item.objects.bulk_create(
+                    [
+                        Item(
+                            SKU=cleaned['SKU'],
+                            name=cleaned['name'],
+                            category_id=cleaned['category'],
+                            tags=cleaned['tags'],
+                            stock_status=cleaned['stock_status'],
+                            available_stock=cleaned['available_stock'],
+                        )
+                        for _, cleaned in rows.values()
+                    ],
+                    update_conflicts=True,
+                    unique_fields=['SKU'],
+                    update_fields=UPDATE_FIELDS,
+                )
+                # the upsert can't express version + 1: bump the rows it updated
+                for skus in chunked(existing):
+                    Item.objects.filter(SKU__in=skus).update(version=F('version') + 1)
+                items = []
+                for skus in chunked(rows):
+                    items += Item.objects.filter(SKU__in=skus)
+                items_bulk_saved.send(
+                    sender=Item,
+                    items=items,
+                    categories=names | {item.category_id for item in existing.values()},
+                    created_categories=missing,
+                    created_skus=set(rows) - set(existing),
+                    rollup_deltas=rollup_deltas(existing.values(), items),
+                )
+        except DatabaseError as exc:
+            for sku, (line, _) in rows.items():
+                result.add_error(line, sku, {'non_field_errors': [f'Database error: {exc}']})
+            return
+        result.updated += len(existing)
+        result.created += len(rows) - len(existing)
+
+
+def import_items(stream, file_format, batch_size=1000):
+    """Import a text stream of CSV or JSON lines and return an ImportResult."""
+    return ItemImporter(batch_size).run(READERS[file_format](stream))
@@ -0,0 +1,167 @@
+"""
+Outbound mail queue.
+
+Views call enqueue(), which only inserts an OutboundEmail row. The
+send_queued_mail command delivers due messages in batches over one SMTP
+connection per batch, retrying failures with exponential backoff and keeping
+under MAIL_QUEUE['RATE_LIMIT'] messages per second.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    # seconds before the first retry, doubled on every further failure
+    'BACKOFF': 30,
+    'MAX_BACKOFF': 3600,
+    # messages per second per worker process, 0 for no limit
+    'RATE_LIMIT': 5,
+    # a message claimed longer ago than this is assumed lost with its worker
+    'CLAIM_TIMEOUT': 600,
+    'POLL_INTERVAL': 5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'MAIL_QUEUE', {})}
+
+
+def enqueue(subject, body, from_email, recipients):
+    """Queue a plain text message and return its OutboundEmail."""
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=','.join(recipients),
+        next_attempt_at=timezone.now(),
+    )
+
+
+def retry_delay(attempts, config):
+    return min(config['BACKOFF'] * 2 ** (attempts - 1), config['MAX_BACKOFF'])
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads."""
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MailQueue:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.limiter = RateLimiter(self.config['RATE_LIMIT'])
+
+    def claim(self):
+        """Mark up to BATCH_SIZE due messages as ours and return them."""
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        due = OutboundEmail.objects.filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+        abandoned = OutboundEmail.objects.filter(
+            status=OutboundEmail.SENDING,
+            claimed_at__lt=now - timedelta(seconds=self.config['CLAIM_TIMEOUT']),
+        )
+        with transaction.atomic():
+            ids = list((due | abandoned).order_by('next_attempt_at', 'id')
+                       .values_list('id', flat=True)[:self.config['BATCH_SIZE']])
+            # another worker may have claimed some of these since the select
+            (due | abandoned).filter(id__in=ids).update(
+                status=OutboundEmail.SENDING, claim_token=token, claimed_at=now,
+            )
+        return list(OutboundEmail.objects.filter(claim_token=token, status=OutboundEmail.SENDING).order_by('id'))
+
+    def process_batch(self):
+        """Deliver one batch of due messages. Returns (sent, failed) counts."""
+        batch = self.claim()
+        if not batch:
+            return 0, 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as exc:
+            # the server is unreachable: every message in the batch waits for a retry
+            for message in batch:
+                self.failed(message, exc)
+            return 0, len(batch)
+        sent = failed = 0
+        try:
+            for message in batch:
+                self.limiter.wait()
+                email = EmailMessage(message.subject, message.body, message.from_email,
+                                     message.to.split(','), connection=connection)
+                try:
+                    email.send()
+                except Exception as exc:
+                    self.failed(message, exc)
+                    failed += 1
+                else:
+                    self.sent(message)
+                    sent += 1
+        finally:
+            connection.close()
+        return sent, failed
+
+    def _release(self, message, **fields):
+        """
+        Record the outcome of ``message`` if our claim on it still holds. A
+        claim that timed out may have passed to another worker, which now
+        owns the row: leave it alone and return False.
+        """
+        updated = OutboundEmail.objects.filter(
+            pk=message.pk, status=OutboundEmail.SENDING, claim_token=message.claim_token,
+        ).update(claim_token='', **fields)
+        if not updated:
+            logger.warning('Lost the claim on outbound email %s before recording its outcome', message.pk)
+        return bool(updated)
+
+    def sent(self, message):
+        return self._release(
+            message, status=OutboundEmail.SENT, attempts=message.attempts + 1, sent_at=timezone.now(), last_error='',
+        )
+
+    def failed(self, message, exc):
+        attempts = message.attempts + 1
+        if attempts >= self.config['MAX_ATTEMPTS']:
+            status, next_attempt_at = OutboundEmail.FAILED, message.next_attempt_at
+        else:
+            status = OutboundEmail.PENDING
+            next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(attempts, self.config))
+        return self._release(
+            message, status=status, attempts=attempts, next_attempt_at=next_attempt_at,
+            last_error=f'{type(exc).__name__}: {exc}',
+        )
+
+    def drain(self):
+        """Deliver batches until nothing is due. Returns (sent, failed) counts."""
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = self.process_batch()
+            if not batch_sent and not batch_failed:
+                return sent, failed
+            sent += batch_sent
+            failed += batch_failed
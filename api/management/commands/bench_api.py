@@ -0,0 +1,186 @@
+import json
+import logging
+import platform
+import random
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.benchmarking import benchmark_database, compare, seed_catalog, summarize
+
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API hot paths end to end (URL routing, middleware, auth, '
+        'views, rendering) on throwaway synthetic catalogs, and report '
+        'throughput, p50/p99 latency and query counts per scenario. Write the '
+        'results to JSON with --output and fail on regressions against a stored '
+        '--baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000],
+                            help='Catalog sizes to seed, e.g. 10000 100000 1000000.')
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--only', nargs='+', help='Only run scenarios whose name contains one of these.')
+        parser.add_argument('--response-cache', action='store_true',
+                            help='Leave the response cache on. Off by default so every request reaches the database.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare with results previously written by --output.')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Fail when a scenario p50 is this fraction slower than the baseline.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)['results']
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+                     'INSTRUMENTATION': {**getattr(settings, 'INSTRUMENTATION', {}), 'SLOW_REQUEST_MS': None},
+                     # one user sends every request: measure the views, not the rate limit
+                     'THROTTLING': {**getattr(settings, 'THROTTLING', {}), 'ENABLED': False}}
+        if not options['response_cache']:
+            overrides['CACHES'] = {**settings.CACHES, 'bench-off': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            overrides['RESPONSE_CACHE_ALIAS'] = 'bench-off'
+
+        # scenarios such as an empty category page answer 404 on purpose
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(**overrides):
+                results = self.run(options)
+        finally:
+            request_logger.setLevel(level)
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump({'meta': self.meta(options), 'results': results}, handle, indent=2)
+        if baseline is not None:
+            self.report(compare(results, baseline, options['threshold']), options['threshold'])
+
+    def run(self, options):
+        results = {}
+        for size in options['sizes']:
+            with benchmark_database():
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{size} items'))
+                start = time.perf_counter()
+                categories = seed_catalog(size, options['categories'])
+                self.stdout.write(f'seeded in {time.perf_counter() - start:.1f} s')
+                for name, result in self.run_size(size, categories, options):
+                    results[f'{size}/{name}'] = result
+                    self.stdout.write(
+                        f'{name:32} {result["throughput_rps"]:>9} req/s  p50 {result["p50_ms"]:>8.2f} ms  '
+                        f'p99 {result["p99_ms"]:>8.2f} ms  {result["queries"]} queries'
+                    )
+        return results
+
+    def meta(self, options):
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'response_cache': options['response_cache'],
+        }
+
+    def report(self, rows, threshold):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Against baseline (threshold {threshold:.0%})'))
+        for row in rows:
+            line = (f'{row["scenario"]:40} {row["baseline_p50_ms"]:>8.2f} -> {row["p50_ms"]:>8.2f} ms '
+                    f'({row["change"]:+.1%}), queries {row["queries"][0]} -> {row["queries"][1]}')
+            self.stdout.write(self.style.ERROR(line) if row['regression'] else line)
+        regressions = [row['scenario'] for row in rows if row['regression']]
+        if regressions:
+            raise CommandError(f'{len(regressions)} scenarios regressed: {", ".join(regressions)}')
+
+    def scenarios(self, size, categories, rng):
+        """(name, request count factor, function returning (method, path, data))."""
+        sku = lambda: f'SKU-{rng.randrange(size):08}'
+        category = lambda: rng.choice(categories)
+        created = iter(range(10 ** 9))
+
+        def update():
+            target = sku()
+            return 'post', f'/api/item-update/?SKU={target}', {
+                'SKU': target, 'name': 'Updated', 'category': category(),
+                'stock_status': 'Out of Stock', 'available_stock': 0}
+
+        return [
+            ('item-list', 1, lambda: ('get', '/api/item-list/', {})),
+            ('item-list page=last', 1, lambda: ('get', '/api/item-list/', {'page': 'last'})),
+            ('item-list category', 1, lambda: ('get', '/api/item-list/', {'category': category()})),
+            ('item-list stock_status', 1, lambda: ('get', '/api/item-list/', {'stock_status': 'Backordered'})),
+            ('item-list category+status', 1, lambda: (
+                'get', '/api/item-list/', {'category': category(), 'stock_status': 'In Stock'})),
+            ('item-list order_by=name', 1, lambda: ('get', '/api/item-list/', {'order_by': 'name'})),
+            ('item-list order_by=-stock', 1, lambda: (
+                'get', '/api/item-list/', {'stock_status': 'In Stock', 'order_by': '-available_stock'})),
+            ('item-list tag', 1, lambda: ('get', '/api/item-list/', {'tag': 'sale'})),
+            ('item-list search', 1, lambda: ('get', '/api/item-list/', {'search': 'summer'})),
+            ('item-list facets', 1, lambda: ('get', '/api/item-list/', {'facets': 'true'})),
+            ('item-list search+facets', 1, lambda: (
+                'get', '/api/item-list/', {'search': 'summer', 'facets': 'true'})),
+            ('item-list sku', 1, lambda: ('get', '/api/item-list/', {'sku': sku()[:9]})),
+            ('item-list cursor', 1, lambda: (
+                'get', '/api/item-list/', {'pagination': 'cursor', 'order_by': 'name', 'count': 'false'})),
+            ('item-list cursor fields', 1, lambda: ('get', '/api/item-list/', {
+                'pagination': 'cursor', 'order_by': 'name', 'count': 'false', 'page_size': 100,
+                'fields': 'SKU,available_stock'})),
+            ('item-detail', 1, lambda: ('get', '/api/item-detail/', {'SKU': sku()})),
+            ('item-create', 1, lambda: ('post', '/api/item-create/', {
+                'SKU': f'BENCH-NEW-{next(created):08}', 'name': 'Bench item', 'category': category(),
+                'stock_status': 'In Stock', 'available_stock': 5})),
+            ('item-update', 1, update),
+            ('auth testtoken', 1, lambda: ('get', '/api/authentication/testtoken', {})),
+            # password hashing dominates, and is meant to be slow
+            ('auth login', 0.05, lambda: ('post', '/api/authentication/login', {
+                'username': 'bench', 'password': PASSWORD})),
+        ]
+
+    def run_size(self, size, categories, options):
+        user = User.objects.create_user('bench', password=PASSWORD)
+        token = Token.objects.create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        rng = random.Random(size)
+        for name, factor, make in self.scenarios(size, categories, rng):
+            if options['only'] and not any(part in name for part in options['only']):
+                continue
+            count = max(3, int(options['requests'] * factor))
+
+            def send():
+                method, path, data = make()
+                if method == 'post':
+                    return client.post(path, data, content_type='application/json')
+                return client.get(path, data)
+
+            for _ in range(max(1, int(options['warmup'] * factor))):
+                send()
+            queries = []
+            with connection.execute_wrapper(lambda execute, *args: queries.append(args[0]) or execute(*args)):
+                response = send()
+            if response.status_code >= 500:
+                raise CommandError(f'{name} answered {response.status_code}')
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(count):
+                request_start = time.perf_counter()
+                send()
+                latencies.append(time.perf_counter() - request_start)
+            result = summarize(latencies, time.perf_counter() - start, len(queries))
+            result['status'] = response.status_code
+            yield name, result
@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.test import override_settings
+
+from api.benchmarking import benchmark_database, percentile, seed_catalog
+from api.models import Item
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how read and write throughput scale with concurrent readers and '
+        'writers on a throwaway database, with the DATABASE_TUNING setup and, '
+        'with --compare-defaults, with Django\'s default SQLite setup too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=20000)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--readers', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--writers', type=int, nargs='+', default=[0, 1, 4])
+        parser.add_argument('--duration', type=float, default=3.0, help='Seconds per reader/writer mix.')
+        parser.add_argument('--compare-defaults', action='store_true',
+                            help='Also run with a rollback journal, no PRAGMAs and deferred transactions.')
+
+    def handle(self, *args, **options):
+        setups = [('tuned', True)]
+        if options['compare_defaults']:
+            setups.append(('defaults', False))
+        for label, tuned in setups:
+            with self.database_setup(tuned), benchmark_database():
+                categories = seed_catalog(options['items'], options['categories'])
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    mode = cursor.fetchone()[0]
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{label} ({connection.vendor}, journal {mode})'))
+                self.stdout.write(f'{"readers":>7} {"writers":>7} {"reads/s":>9} {"read p99":>10} '
+                                  f'{"writes/s":>9} {"write p99":>10} {"locked":>7}')
+                for writers in options['writers']:
+                    for readers in options['readers']:
+                        stats = self.run_mix(readers, writers, categories, options)
+                        self.stdout.write(
+                            f'{readers:>7} {writers:>7} {stats["reads"]:>9.0f} {stats["read_p99"]:>8.1f}ms '
+                            f'{stats["writes"]:>9.0f} {stats["write_p99"]:>8.1f}ms {stats["locked"]:>7}'
+                        )
+
+    @contextmanager
+    def database_setup(self, tuned):
+        if tuned:
+            yield
+            return
+        options = connection.settings_dict.setdefault('OPTIONS', {})
+        mode = options.pop('transaction_mode', None)
+        connection.close()
+        try:
+            with override_settings(DATABASE_TUNING={'SQLITE_PRAGMAS': {}}):
+                yield
+        finally:
+            connection.close()
+            if mode is not None:
+                options['transaction_mode'] = mode
+
+    def run_mix(self, readers, writers, categories, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies = {'read': [], 'write': []}
+        locked = [0]
+
+        def reader(seed):
+            rng = random.Random(seed)
+            own = []
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    # the item-list shape: a count and a page
+                    items = Item.objects.filter(category_id=rng.choice(categories))
+                    items.count()
+                    list(items.order_by('name')[:50])
+                    own.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    latencies['read'].extend(own)
+
+        def writer(seed):
+            rng = random.Random(seed)
+            own, failed = [], 0
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        # read then write, as item-update does
+                        with transaction.atomic():
+                            item = Item.objects.get(SKU=f'SKU-{rng.randrange(options["items"]):08}')
+                            item.available_stock = rng.randrange(500)
+                            item.save()
+                    except OperationalError:
+                        failed += 1
+                        continue
+                    own.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    latencies['write'].extend(own)
+                    locked[0] += failed
+
+        threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(readers)]
+        threads += [threading.Thread(target=writer, args=(1000 + seed,)) for seed in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        reads, writes = sorted(latencies['read']), sorted(latencies['write'])
+        return {
+            'reads': len(reads) / options['duration'],
+            'read_p99': (percentile(reads, 99) or 0) * 1000,
+            'writes': len(writes) / options['duration'],
+            'write_p99': (percentile(writes, 99) or 0) * 1000,
+            'locked': locked[0],
+        }
@@ -0,0 +1,75 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from api.benchmarking import benchmark_database, seed_catalog
+from api.models import Item
+from api.rollups import rebuild
+from api.stock import adjust_stock
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure item-stock-adjust throughput with several concurrent writers on '
+        'a throwaway database, and check that no update was lost.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--hot-items', type=int, default=20,
+                            help='Adjustments only touch this many SKUs, to force contention.')
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--batches', type=int, default=50, help='Batches per writer.')
+        parser.add_argument('--batch-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_catalog(options['items'])
+            hot = [f'SKU-{i:08}' for i in range(options['hot_items'])]
+            before = dict(Item.objects.filter(SKU__in=hot).values_list('SKU', 'available_stock'))
+            totals = {sku: 0 for sku in hot}
+            stats = {'ok': 0, 'conflict': 0, 'not_found': 0, 'locked': 0}
+            lock = threading.Lock()
+
+            def writer(seed):
+                rng = random.Random(seed)
+                try:
+                    for _ in range(options['batches']):
+                        batch = [(i, rng.choice(hot), rng.randint(-5, 5), None) for i in range(options['batch_size'])]
+                        try:
+                            results = adjust_stock(batch)
+                        except OperationalError:
+                            with lock:
+                                stats['locked'] += 1
+                            continue
+                        with lock:
+                            for position, sku, delta, _ in batch:
+                                status = results[position]['status']
+                                stats[status] += 1
+                                if status == 'ok':
+                                    totals[sku] += delta
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(options['writers'])]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            after = dict(Item.objects.filter(SKU__in=hot).values_list('SKU', 'available_stock'))
+            lost = [sku for sku in hot if after[sku] != before[sku] + totals[sku]]
+            drift = rebuild(dry_run=True)
+
+        self.stdout.write(
+            f"{options['writers']} writers: {stats['ok']} adjustments in {elapsed:.2f}s "
+            f"({stats['ok'] / elapsed:.0f}/s, {stats['ok'] / options['batch_size'] / elapsed:.0f} batches/s)"
+        )
+        self.stdout.write(f"conflicts: {stats['conflict']}, batches failed on lock: {stats['locked']}")
+        style = self.style.SUCCESS if not lost and not drift else self.style.ERROR
+        self.stdout.write(style(f'lost updates: {len(lost)}, rollup drift: {len(drift)}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.changelog import compact
+
+
+class Command(BaseCommand):
+    help = (
+        'Compact the change log: drop rows superseded by a newer change to the '
+        'same item or category, then rows older than the retention period. '
+        'Clients whose watermark predates the dropped rows are told to resync.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            help='Drop rows older than this many days. Defaults to CHANGE_LOG RETENTION_DAYS.')
+
+    def handle(self, *args, **options):
+        superseded, expired = compact(retention_days=options['retention_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Dropped {superseded} superseded and {expired} expired change log rows'))
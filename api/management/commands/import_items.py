@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import READERS, import_items, text_stream
+
+
+class Command(BaseCommand):
+    help = 'Upsert items on SKU from a CSV or JSONL file, streaming it in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=sorted(READERS))
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError('Cannot tell the file format, pass --format csv or --format jsonl')
+        with open(path, 'rb') as stream:
+            result = import_items(text_stream(stream), file_format, options['batch_size'])
+        self.stdout.write(json.dumps(result.as_dict(), indent=2))
+        style = self.style.SUCCESS if not result.failed else self.style.WARNING
+        self.stdout.write(style(f'{result.created} created, {result.updated} updated, {result.failed} failed'))
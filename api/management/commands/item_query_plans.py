@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.benchmarking import benchmark_database, seed_catalog
+from api.models import Item, ItemTag
+
+INDEXED_MODELS = (Item, ItemTag)
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a catalog in a throwaway database and show the query plan and '
+        'timing of the item-list filters with and without the Item indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=20000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            category = seed_catalog(options['items'], options['categories'])[0]
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            queries = self.queries(category)
+
+            self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+            self.report(queries, options['repeat'])
+
+            self.drop_indexes()
+            # the driver caches prepared statements, and a cached EXPLAIN
+            # keeps the plan it was prepared with
+            connection.close()
+            self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+            self.report(queries, options['repeat'])
+
+    def queries(self, category):
+        items = Item.objects.all()
+        return [
+            ('category + stock_status', items.filter(category_id=category, stock_status='In Stock')),
+            ('stock_status order by available_stock',
+             items.filter(stock_status='Backordered').order_by('available_stock')),
+            ('order by name', items.order_by('name')),
+            ('tag', items.filter(tag_links__tag__name='sale')),
+        ]
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def report(self, queries, repeat):
+        for label, queryset in queries:
+            page = queryset[:5]
+            start = time.perf_counter()
+            for _ in range(repeat):
+                # what item-list runs for a page: the count and the rows
+                queryset.count()
+                list(page)
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+            self.stdout.write(f'{label}: {elapsed:.2f} ms per page')
+            for line in page.explain().splitlines():
+                self.stdout.write(f'    {line}')
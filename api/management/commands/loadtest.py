@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Client:
+    """Minimal HTTP/1.1 keep-alive client, one connection per worker."""
+    def __init__(self, host, port, token):
+        self.host = host
+        self.port = port
+        self.headers = f'Host: {host}:{port}\r\nConnection: keep-alive\r\n'
+        if token:
+            self.headers += f'Authorization: Token {token}\r\n'
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\n{self.headers}\r\n'.encode())
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        length, chunked, close = 0, False, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                close = value == 'close'
+        if chunked:
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.readexactly(length)
+        if close:
+            await self.close()
+        return int(status_line.split()[1])
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test a running server with many concurrent keep-alive connections '
+        'and report throughput and latency percentiles. Run it against the same '
+        'paths served by a WSGI server (gunicorn dashboard.wsgi) and an ASGI one '
+        '(uvicorn dashboard.asgi:application), comparing /api/... with /api/async/.... '
+        'Requests share one token and so one throttle bucket: start the server with '
+        'API_THROTTLING=off, or set THROTTLING[\'ENABLED\'] to False, or the run measures the throttle.'
+    )
+
+    # above this share of 429 responses the figures describe the throttle, not the views
+    MAX_THROTTLED = 0.5
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--paths', nargs='+', default=['/api/item-list/'],
+                            help='Paths requested round robin.')
+        parser.add_argument('--token', help='API token sent as "Authorization: Token <key>".')
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--duration', type=float,
+                            help='Run for this many seconds instead of a fixed number of requests.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url must be a plain http:// URL.')
+        latencies, statuses, errors, elapsed = asyncio.run(self.run(
+            url.hostname, url.port or 80, options['token'], options['paths'],
+            options['concurrency'], options['requests'], options['duration'],
+        ))
+        if not latencies:
+            raise CommandError(f'No request succeeded ({errors} errors).')
+        latencies.sort()
+        self.stdout.write(f'requests: {len(latencies)} in {elapsed:.2f} s, {errors} errors')
+        self.stdout.write(f'throughput: {len(latencies) / elapsed:.0f} req/s')
+        self.stdout.write(
+            f'latency: p50 {self.percentile(latencies, 50):.1f} ms, '
+            f'p99 {self.percentile(latencies, 99):.1f} ms, mean {statistics.fmean(latencies):.1f} ms'
+        )
+        self.stdout.write('statuses: ' + ', '.join(f'{code}: {count}' for code, count in sorted(statuses.items())))
+        throttled = statuses.get(429, 0)
+        if throttled > len(latencies) * self.MAX_THROTTLED:
+            raise CommandError(
+                f'{throttled} of {len(latencies)} responses were 429 Too Many Requests, so these '
+                'figures measure the throttle. Restart the server with API_THROTTLING=off.'
+            )
+
+    async def run(self, host, port, token, paths, concurrency, total, duration):
+        latencies, statuses = [], {}
+        errors = 0
+        paths = itertools.cycle(paths)
+        sent = itertools.count()
+        deadline = time.perf_counter() + duration if duration else None
+
+        def more():
+            if deadline is not None:
+                return time.perf_counter() < deadline
+            return next(sent) < total
+
+        async def worker():
+            nonlocal errors
+            client = Client(host, port, token)
+            try:
+                while more():
+                    start = time.perf_counter()
+                    try:
+                        code = await client.get(next(paths))
+                    except (OSError, ValueError, asyncio.IncompleteReadError):
+                        errors += 1
+                        await client.close()
+                        continue
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[code] = statuses.get(code, 0) + 1
+            finally:
+                await client.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, statuses, errors, time.perf_counter() - start
+
+    @staticmethod
+    def percentile(ordered, percent):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the inventory rollups from Item and report any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not fix it.')
+
+    def handle(self, *args, **options):
+        drift = rebuild(dry_run=options['dry_run'])
+        for row in drift:
+            self.stdout.write(json.dumps(row))
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Rollups match the item table'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} rollup rows have drifted'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Fixed {len(drift)} drifted rollup rows'))
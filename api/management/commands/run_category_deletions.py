@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.category_deletion import get_config, pending_jobs, run_deletion
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued category deletions, and resume ones whose worker stopped. '
+        'Polls for new jobs until stopped, unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs pending now, then exit.')
+        parser.add_argument('--poll-interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        config = get_config()
+        while True:
+            for job_id in pending_jobs(config):
+                if run_deletion(job_id, config):
+                    self.stdout.write(f'finished category deletion job {job_id}')
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.mailqueue import MailQueue
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver queued outbound email. Runs until stopped, polling for due '
+        'messages, unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver what is due now, then exit.')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Worker threads, each with its own SMTP connection. They share the rate limit.')
+
+    def handle(self, *args, **options):
+        queue = MailQueue()
+        totals = {'sent': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    sent, failed = queue.drain()
+                    with lock:
+                        totals['sent'] += sent
+                        totals['failed'] += failed
+                    if options['once']:
+                        return
+                    time.sleep(queue.config['POLL_INTERVAL'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'sent: {totals["sent"]}, failed attempts: {totals["failed"]}')
@@ -0,0 +1,231 @@
+"""
+Request instrumentation.
+
+InstrumentationMiddleware times every request and collects, per endpoint,
+histograms of latency, SQL query count and time, render time and response
+size. SQL is seen through an execute wrapper installed on every database
+connection, which reports to the request in flight through a context
+variable, so queries run by async views in worker threads are counted too.
+
+The histograms live in this process only: each worker exposes its own on
+the metrics endpoint, in the Prometheus text format.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('api.slow_requests')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # requests slower than this are logged with their queries, None to never log
+    'SLOW_REQUEST_MS': 500,
+    # queries kept per request for the slow request log
+    'MAX_LOGGED_QUERIES': 200,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        # bucket counts are kept per bucket and summed when exposed
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: ([*counts], total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in sorted(self.snapshot().items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_LABELS = ('endpoint', 'method')
+
+request_duration = Histogram(
+    'api_request_duration_seconds', 'Time to answer a request.', LATENCY_BUCKETS, ('endpoint', 'method', 'status'))
+db_queries = Histogram(
+    'api_request_db_queries', 'SQL queries run by a request.', QUERY_COUNT_BUCKETS, REQUEST_LABELS)
+db_duration = Histogram(
+    'api_request_db_seconds', 'Time a request spent in SQL queries.', LATENCY_BUCKETS, REQUEST_LABELS)
+render_duration = Histogram(
+    'api_request_render_seconds', 'Time a request spent serializing its response.', LATENCY_BUCKETS, REQUEST_LABELS)
+response_size = Histogram(
+    'api_response_size_bytes', 'Size of response bodies, streaming responses excluded.', SIZE_BUCKETS, REQUEST_LABELS)
+
+HISTOGRAMS = (request_duration, db_queries, db_duration, render_duration, response_size)
+
+
+def expose():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_count', 'query_seconds', 'render_seconds', 'max_queries')
+
+    def __init__(self, max_queries):
+        self.queries = []
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+        self.max_queries = max_queries
+
+
+_current = ContextVar('api_request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        current.query_count += 1
+        current.query_seconds += elapsed
+        if len(current.queries) < current.max_queries:
+            current.queries.append((sql, elapsed))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: time every query run on ``connection``."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def rendering():
+    """Count the enclosed block as render time of the request in flight."""
+    current = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            current.render_seconds += time.perf_counter() - start
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+        current = RequestMetrics(self.config['MAX_LOGGED_QUERIES'])
+        token = _current.set(current)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.config['ENABLED']:
+            return await self.get_response(request)
+        current = RequestMetrics(self.config['MAX_LOGGED_QUERIES'])
+        token = _current.set(current)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render right after this hook: time it up to the post-render callback
+        current = _current.get()
+        if current is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                current.render_seconds += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, current, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.route if match is not None else 'unmatched'
+        labels = (endpoint, request.method)
+        request_duration.observe((endpoint, request.method, str(response.status_code)), elapsed)
+        db_queries.observe(labels, current.query_count)
+        db_duration.observe(labels, current.query_seconds)
+        render_duration.observe(labels, current.render_seconds)
+        if not response.streaming:
+            response_size.observe(labels, len(response.content))
+        slow = self.config['SLOW_REQUEST_MS']
+        if slow is not None and elapsed * 1000 >= slow:
+            logger.warning(
+                'Slow request: %s %s took %.0f ms, %d queries in %.0f ms, render %.0f ms\n%s',
+                request.method, request.get_full_path(), elapsed * 1000, current.query_count,
+                current.query_seconds * 1000, current.render_seconds * 1000,
+                '\n'.join(f'  {seconds * 1000:.1f} ms  {sql}' for sql, seconds in current.queries),
+            )
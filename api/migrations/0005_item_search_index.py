@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from api.search import SQLiteFTSBackend
+    backend = SQLiteFTSBackend()
+    backend.install(schema_editor.connection.alias)
+    backend.rebuild(schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from api.search import SQLiteFTSBackend
+    SQLiteFTSBackend().uninstall(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_remove_category_id_alter_category_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_item_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ItemTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='api.item')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_links', to='api.tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='tag_set',
+            field=models.ManyToManyField(blank=True, related_name='items', through='api.ItemTag', to='api.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'stock_status'], name='item_category_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['stock_status', 'available_stock'], name='item_status_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['name'], name='item_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemtag',
+            index=models.Index(fields=['tag', 'item'], name='itemtag_tag_item_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='itemtag',
+            constraint=models.UniqueConstraint(fields=('item', 'tag'), name='unique_item_tag'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def populate_item_tags(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    Tag = apps.get_model('api', 'Tag')
+    ItemTag = apps.get_model('api', 'ItemTag')
+    from api.tags import parse_tags
+
+    tag_ids = {}
+    links = []
+    items = Item.objects.exclude(tags__isnull=True).exclude(tags='').values_list('id', 'tags')
+    for item_id, tags in items.iterator(chunk_size=2000):
+        for name in parse_tags(tags):
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.get_or_create(name=name)[0].id
+            links.append(ItemTag(item_id=item_id, tag_id=tag_ids[name]))
+        if len(links) >= 2000:
+            ItemTag.objects.bulk_create(links, ignore_conflicts=True)
+            links = []
+    ItemTag.objects.bulk_create(links, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_item_indexes_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_item_tags, migrations.RunPython.noop),
+    ]
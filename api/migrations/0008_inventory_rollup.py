@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_rollups(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    InventoryRollup = apps.get_model('api', 'InventoryRollup')
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+    rows = Item.objects.values('category_id', 'stock_status').annotate(
+        items=Count('id'),
+        stock=Sum('available_stock'),
+        low=Count('id', filter=Q(available_stock__lte=threshold)),
+    )
+    InventoryRollup.objects.bulk_create([
+        InventoryRollup(
+            category_id=row['category_id'], stock_status=row['stock_status'],
+            item_count=row['items'], stock_total=row['stock'] or 0, low_stock_count=row['low'],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_populate_item_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_status', models.CharField(max_length=20)),
+                ('item_count', models.IntegerField(default=0)),
+                ('stock_total', models.BigIntegerField(default=0)),
+                ('low_stock_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='api.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'stock_status'), name='unique_rollup_category_status')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSearchIndex',
+            fields=[
+                ('item', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='api.item')),
+                ('document', models.TextField(db_column='api_item_fts')),
+            ],
+            options={
+                'db_table': 'api_item_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def set_journal_mode(apps, schema_editor):
+    from api.db import set_journal_mode
+    set_journal_mode(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # SQLite can't change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0013_item_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,20 @@
-from django.db import models
+from django.db import models, transaction
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True, primary_key=True)
 
+    def save(self, *args, **kwargs):
+        # post_save handlers (the change log) commit or roll back with the row
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
     def __str__(self):
         return self.name
 
@@ -13,13 +25,199 @@ class Item(models.Model):
     name = models.CharField(max_length=255)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     # category = models.CharField(max_length=255) 
+    # comma separated, mirrored into tag_set so tag filters can use an index
     tags = models.CharField(max_length=255, blank=True, null=True)
+    tag_set = models.ManyToManyField(Tag, through='ItemTag', related_name='items', blank=True)
     stock_status = models.CharField(max_length=20, choices=[
         ('In Stock', 'In Stock'),
         ('Out of Stock', 'Out of Stock'),
         ('Backordered', 'Backordered'),
     ])
     available_stock = models.IntegerField(default=0)
+    # bumped on every write, for optimistic concurrency checks: by save() and
+    # by the bulk paths (stock adjustments, imports, bulk updates) that bypass it
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # match the filter and sort combinations item-list supports
+        indexes = [
+            models.Index(fields=['category', 'stock_status'], name='item_category_status_idx'),
+            models.Index(fields=['stock_status', 'available_stock'], name='item_status_stock_idx'),
+            models.Index(fields=['name'], name='item_name_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what was loaded so signal handlers can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        # post_save handlers (the change log) commit or roll back with the row
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+        # post_save handlers have seen the old values, the saved ones are current now
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class ItemTag(models.Model):
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='item_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'tag'], name='unique_item_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'item'], name='itemtag_tag_item_idx'),
+        ]
+
+
+class ItemSearchIndex(models.Model):
+    """
+    The FTS5 table api.search.SQLiteFTSBackend keeps over api_item, one row
+    per item under its id. Only mapped so ranked searches can join it.
+    """
+    item = models.OneToOneField(Item, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                db_constraint=False, related_name='search_index')
+    # FTS5's hidden column named after the table: MATCH queries and bm25() take it
+    document = models.TextField(db_column='api_item_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'api_item_fts'
+
+
+class InventoryRollup(models.Model):
+    """
+    Item count, summed stock and low-stock count per category and stock status,
+    kept up to date on every item write so stats never scan Item.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='rollups')
+    stock_status = models.CharField(max_length=20)
+    item_count = models.IntegerField(default=0)
+    stock_total = models.BigIntegerField(default=0)
+    low_stock_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'stock_status'], name='unique_rollup_category_status'),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """
+    A message waiting for, or done with, delivery by the mail queue worker.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    # comma separated
+    to = models.TextField()
+    status = models.CharField(max_length=10, default=PENDING, choices=[
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ])
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    # set while a worker owns the message, so a crashed worker's claim can expire
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
+
+
+class CategoryDeletion(models.Model):
+    """
+    A category being deleted in the background, a batch of items at a time.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    CANCELLED = 'cancelled'
+    DONE = 'done'
+    FAILED = 'failed'
+    ACTIVE = (QUEUED, RUNNING)
+
+    # a name rather than a key: the category is gone once the job is done
+    category = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, default=QUEUED, choices=[
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (CANCELLED, 'Cancelled'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ])
+    total_items = models.PositiveIntegerField(default=0)
+    deleted_items = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # touched after every batch, so a job whose worker died can be picked up again
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='category_deletion_status_idx'),
+        ]
+
+
+class ChangeLog(models.Model):
+    """
+    One row per item or category write, appended in the write's transaction.
+    The id is the sync watermark: clients ask for everything after the last
+    id they saw. Rows hold keys only; the synced state is read when asked.
+    """
+    ITEM = 'item'
+    CATEGORY = 'category'
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+
+    kind = models.CharField(max_length=10, choices=[(ITEM, 'Item'), (CATEGORY, 'Category')])
+    # SKU or category name
+    key = models.CharField(max_length=100)
+    action = models.CharField(max_length=10, choices=[(UPSERT, 'Upsert'), (DELETE, 'Delete')])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # compaction keeps the newest row per key
+            models.Index(fields=['kind', 'key', 'id'], name='changelog_key_idx'),
+            models.Index(fields=['created_at'], name='changelog_created_idx'),
+        ]
+
+
+class ChangeLogCompaction(models.Model):
+    """
+    A compaction that dropped change log rows up to ``compacted_through``:
+    clients with an older watermark must download the catalog again.
+    """
+    compacted_through = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
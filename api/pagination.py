@@ -0,0 +1,148 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .queries import count_items
+
+# columns item-list is allowed to order by in cursor mode
+ITEM_ORDER_FIELDS = ('SKU', 'name', 'category', 'stock_status', 'available_stock', 'id')
+
+
+class ItemPagePagination(PageNumberPagination):
+    """Page number pagination over a count the view already has, from count_items()."""
+    page_size = 5
+
+    def __init__(self, count=None):
+        self.count = count
+
+    def django_paginator_class(self, object_list, per_page):
+        paginator = DjangoPaginator(object_list, per_page)
+        if self.count is not None:
+            # skips the paginator's own COUNT
+            paginator.count = self.count
+        return paginator
+
+
+class ItemCursorPagination(BasePagination):
+    """
+    Keyset pagination for item-list.
+
+    The cursor is an opaque token holding the order_by value and the id of the
+    row at the edge of the current page, so every page is a single indexed
+    range scan no matter how deep the client goes.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    page_size = 5
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.order_field, self.descending = self.get_ordering(request)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor['r'])
+        # counting is the expensive part on big catalogs, so clients can opt
+        # out, or settle for an estimate
+        self.count = None
+        count_mode = request.GET.get(self.count_query_param, 'true').lower()
+        if count_mode not in ('false', '0', 'no'):
+            self.count = count_items(request.GET, queryset, estimate=count_mode == 'estimate')
+
+        descending = self.descending != self.reverse
+        if cursor:
+            queryset = queryset.filter(self.keyset_filter(cursor['v'], cursor['id'], descending))
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.order_field, prefix + 'id')
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        if self.reverse:
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_page_size(self, request):
+        raw = request.GET.get(self.page_size_query_param)
+        if raw is None:
+            return self.page_size
+        try:
+            size = int(raw)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'must be an integer'})
+        if size < 1:
+            raise ValidationError({self.page_size_query_param: 'must be positive'})
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request):
+        order_by = request.GET.get('order_by') or 'id'
+        descending = order_by.startswith('-')
+        field = order_by.lstrip('-')
+        if field not in ITEM_ORDER_FIELDS:
+            raise ValidationError({'order_by': f'cannot order by {field}'})
+        if field == 'category':
+            field = 'category_id'
+        return field, descending
+
+    def keyset_filter(self, value, last_id, descending):
+        op = 'lt' if descending else 'gt'
+        if self.order_field == 'id':
+            return Q(**{f'id__{op}': last_id})
+        return Q(**{f'{self.order_field}__{op}': value}) | Q(**{self.order_field: value, f'id__{op}': last_id})
+
+    def decode_cursor(self, request):
+        token = request.GET.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            cursor = json.loads(urlsafe_b64decode(padded.encode()))
+            if cursor['o'] != self.order_key():
+                raise ValueError('cursor belongs to another ordering')
+            return {'v': cursor['v'], 'id': int(cursor['id']), 'r': bool(cursor['r'])}
+        except (ValueError, KeyError, TypeError):
+            raise ValidationError({self.cursor_query_param: 'invalid cursor'})
+
+    def encode_cursor(self, row, reverse):
+        value = getattr(row, self.order_field)
+        cursor = {'o': self.order_key(), 'v': value, 'id': row.id, 'r': reverse}
+        token = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, token.rstrip('='))
+
+    def order_key(self):
+        return ('-' if self.descending else '') + self.order_field
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
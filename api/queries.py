@@ -0,0 +1,104 @@
+"""
+Item read queries.
+
+item_queryset() compiles the item-list query parameters into a single lazy
+queryset, shared by every endpoint that accepts them. count_items() counts
+its rows exactly, unless the client asked for an estimate: then a sum over
+the rollup table when the filters only involve category and stock status,
+or the planner's estimate where the database gives one. The rollups are
+denormalized and may drift (see rollups.rebuild), so they never decide an
+exact count.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Sum
+
+from .models import InventoryRollup, Item
+from .search import get_search_backend
+
+# item-list filters the rollup table can answer on its own; any other filter
+# means counting the matching items
+ROLLUP_FILTERS = {'category': 'category_id', 'stock_status': 'stock_status'}
+ITEM_FILTERS = ('search', 'sku', 'name', 'tag')
+# planner estimates below this are too rough to show: count instead
+EXACT_COUNT_BELOW = 1000
+
+
+def item_queryset(params, ordered=True):
+    """
+    Items matching the item-list filters in ``params``. Unless ``ordered`` is
+    false they come in order_by order, or by search rank.
+    """
+    queryset = Item.objects.all()
+    search = get_search_backend()
+    search_param = params.get('search')
+    order_by_param = params.get('order_by')
+    if search_param:
+        # ranking costs a join on the index: only pay for it when it orders the result
+        ranked = ordered and not order_by_param
+        queryset = search.search(queryset, search_param, rank=ranked)
+        if ranked:
+            queryset = queryset.order_by('search_rank', 'id')
+    if ordered and order_by_param:
+        queryset = queryset.order_by(order_by_param)
+
+    if params.get('sku'):
+        queryset = search.search(queryset, params['sku'], fields=['SKU'], rank=False)
+    if params.get('name'):
+        queryset = search.search(queryset, params['name'], fields=['name'], rank=False)
+    if params.get('category'):
+        # filter on the key directly: no category lookup, and it stays lazy for async views
+        queryset = queryset.filter(category_id=params['category'])
+    if params.get('stock_status'):
+        queryset = queryset.filter(stock_status=params['stock_status'])
+    for tag in params.getlist('tag'):
+        queryset = queryset.filter(tag_links__tag__name=tag.strip().lower())
+    return queryset
+
+
+def rollup_filters(params):
+    """The rollup table filters equivalent to ``params``, or None when it can't answer them."""
+    if any(params.get(param) for param in ITEM_FILTERS):
+        return None
+    return {field: params[param] for param, field in ROLLUP_FILTERS.items() if params.get(param)}
+
+
+def estimate_count(queryset):
+    """The planner's row estimate for ``queryset``, None where the database has none."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, sql_params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', sql_params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_items(params, queryset, estimate=False):
+    """Rows of ``queryset``, built from ``params``; estimated only when asked to."""
+    if estimate:
+        filters = rollup_filters(params)
+        if filters is not None:
+            return InventoryRollup.objects.filter(**filters).aggregate(items=Sum('item_count'))['items'] or 0
+        estimated = estimate_count(queryset)
+        if estimated is not None and estimated >= EXACT_COUNT_BELOW:
+            return estimated
+    return queryset.count()
+
+
+async def acount_items(params, queryset, estimate=False):
+    if estimate:
+        filters = rollup_filters(params)
+        if filters is not None:
+            totals = await InventoryRollup.objects.filter(**filters).aaggregate(items=Sum('item_count'))
+            return totals['items'] or 0
+        if connections[queryset.db].vendor == 'postgresql':
+            estimated = await sync_to_async(estimate_count)(queryset)
+            if estimated >= EXACT_COUNT_BELOW:
+                return estimated
+    return await queryset.acount()
@@ -0,0 +1,55 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Output is byte for byte what JSONRenderer produces for compact responses:
+    datetimes and other non-JSON types still go through DRF's encoder, and
+    anything orjson cannot take falls back to the stdlib path.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # same escaping JSONRenderer applies for JavaScript consumers
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class PassthroughRenderer(JSONRenderer):
+    """
+    Matches any Accept header, for views that build their own HttpResponse
+    (streaming exports), so content negotiation never answers 406. Whatever
+    DRF still renders itself, such as errors, comes out as JSON.
+    """
+    media_type = '*/*'
+    format = None
+
+
+class PrometheusRenderer(BaseRenderer):
+    """Text exposition format for the metrics endpoint."""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # errors such as a failed authentication
+        return JSONRenderer().render(data)
@@ -0,0 +1,261 @@
+"""
+Read replica routing.
+
+Views decorated with replica_reads run their queries on one of the
+READ_REPLICAS aliases; everything else, and every write, stays on
+``default``. A user who wrote something reads from the primary for
+STICKY_SECONDS afterwards, so they see their own writes. A replica further
+behind than MAX_LAG seconds, or one that can't be reached, is skipped, and
+with no replica left the view reads from the primary.
+
+The sticky markers live in CACHE_ALIAS. Every worker has to see them, so
+with a process-local cache (LocMemCache) there, the default, views read from
+the primary unless SINGLE_PROCESS says one process serves every request;
+the api.W002 check warns about it.
+
+ReplicaRouter does the routing from a per-request context variable, set by
+ReplicaMiddleware (which also notices writes) and by replica_reads.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # database aliases serving reads; empty to read everything from default
+    'ALIASES': [],
+    # seconds a user keeps reading from the primary after a write
+    'STICKY_SECONDS': 10,
+    # replicas further behind than this many seconds are skipped
+    'MAX_LAG': 5,
+    # seconds a lag measurement is reused for
+    'LAG_CHECK_INTERVAL': 2,
+    # callable(alias) returning the replica's lag in seconds
+    'LAG_FUNCTION': 'api.replicas.database_lag',
+    # cache alias for the sticky markers; every worker must see the same one
+    'CACHE_ALIAS': 'default',
+    # a process-local CACHE_ALIAS is enough: one process serves every request
+    'SINGLE_PROCESS': False,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class RequestRouting:
+    __slots__ = ('replica_reads', 'alias', 'wrote')
+
+    def __init__(self):
+        self.replica_reads = False
+        # the replica picked for this request, chosen on its first query
+        self.alias = None
+        self.wrote = False
+
+
+_current = ContextVar('api_request_routing', default=None)
+
+
+def _sticky_key(user_id):
+    return f'replica-sticky:{user_id}'
+
+
+def mark_sticky(user_id, config=None):
+    config = config or get_config()
+    caches[config['CACHE_ALIAS']].set(_sticky_key(user_id), True, config['STICKY_SECONDS'])
+
+
+def is_sticky(user_id, config=None):
+    config = config or get_config()
+    return caches[config['CACHE_ALIAS']].get(_sticky_key(user_id)) is not None
+
+
+def sticky_markers_shared(config=None):
+    """Whether a marker set by one worker is seen by the worker serving the user's next read."""
+    config = config or get_config()
+    if config['SINGLE_PROCESS']:
+        return True
+    return not isinstance(caches[config['CACHE_ALIAS']], (LocMemCache, DummyCache))
+
+
+def check_sticky_cache(app_configs=None, **kwargs):
+    config = get_config()
+    if not config['ALIASES'] or sticky_markers_shared(config):
+        return []
+    return [checks.Warning(
+        f"READ_REPLICAS CACHE_ALIAS {config['CACHE_ALIAS']!r} is local to each process: "
+        'reads stay on the primary.',
+        hint='Point it at a shared cache (redis, memcached), or set READ_REPLICAS '
+             'SINGLE_PROCESS when one process serves every request.',
+        id='api.W002',
+    )]
+
+
+def database_lag(alias):
+    """Replication lag of ``alias`` in seconds, 0 for databases without a replication stream."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+        )
+        lag = cursor.fetchone()[0]
+    # NULL when the server is not replicating at all
+    return float(lag or 0)
+
+
+_lag_lock = threading.Lock()
+_lags = {}
+
+
+def replica_lag(alias, config):
+    """Cached lag of ``alias``, None when it can't be measured (counted as unavailable)."""
+    now = time.monotonic()
+    checked = _lags.get(alias)
+    if checked is not None and now - checked[0] < config['LAG_CHECK_INTERVAL']:
+        return checked[1]
+    try:
+        lag = import_string(config['LAG_FUNCTION'])(alias)
+    except Exception:
+        logger.warning('Could not measure the lag of replica %s', alias, exc_info=True)
+        lag = None
+    with _lag_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def reset_lags():
+    with _lag_lock:
+        _lags.clear()
+
+
+def choose_replica(config=None):
+    """A replica within MAX_LAG, or None to read from the primary."""
+    config = config or get_config()
+    healthy = []
+    for alias in config['ALIASES']:
+        lag = replica_lag(alias, config)
+        if lag is not None and lag <= config['MAX_LAG']:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else None
+
+
+def reading_from_replicas():
+    """Whether the request in flight may read from a replica."""
+    routing = _current.get()
+    return routing is not None and routing.replica_reads
+
+
+def replica_reads(view):
+    """
+    Mark a read-only view: its queries go to a replica unless the user wrote
+    recently. Place it below the DRF decorators, so the user is known, and
+    above cached_response, which keys and expires replica responses apart.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        config = get_config()
+        if not config['ALIASES'] or request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        if not sticky_markers_shared(config):
+            # a write through another worker would go unnoticed
+            return view(request, *args, **kwargs)
+        user = getattr(request, 'user', None)
+        sticky = user is not None and user.is_authenticated and is_sticky(user.pk, config)
+        routing = _current.get()
+        token = None
+        if routing is None:
+            # called without ReplicaMiddleware, e.g. straight from a test
+            routing = RequestRouting()
+            token = _current.set(routing)
+        previous = routing.replica_reads
+        routing.replica_reads = not sticky
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            routing.replica_reads = previous
+            if token is not None:
+                _current.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Reads of replica_reads views go to a replica, everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not routing.replica_reads or routing.wrote:
+            return None
+        if routing.alias is None:
+            routing.alias = choose_replica() or DEFAULT_DB_ALIAS
+        return routing.alias
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Track writes per request and keep users who wrote on the primary for a while."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = RequestRouting()
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.remember_write(request, routing)
+        return response
+
+    async def __acall__(self, request):
+        routing = RequestRouting()
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.remember_write(request, routing)
+        return response
+
+    def remember_write(self, request, routing):
+        if not routing.wrote:
+            return
+        config = get_config()
+        user = getattr(request, 'user', None)
+        if config['ALIASES'] and user is not None and user.is_authenticated:
+            mark_sticky(user.pk, config)
@@ -0,0 +1,200 @@
+import hashlib
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import replicas
+
+# version scopes: every catalog change bumps 'global', item and category
+# changes also bump 'category:<name>', category changes bump 'categories'.
+# Item detail pages only depend on 'sku:<SKU>', bumped by writes to that item,
+# and 'items', bumped by bulk and category writes that may touch any item.
+GLOBAL = 'global'
+CATEGORIES = 'categories'
+ITEMS = 'items'
+
+# only these outcomes are worth replaying
+CACHEABLE_STATUSES = (status.HTTP_200_OK, status.HTTP_404_NOT_FOUND)
+
+
+def category_scope(name):
+    return f'category:{name}'
+
+
+def sku_scope(sku):
+    return f'sku:{sku}'
+
+
+def item_scopes(skus):
+    return [ITEMS, *(sku_scope(sku) for sku in skus)]
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def is_process_local(cache):
+    # each worker would keep its own version counters and never see the
+    # bumps of writes served by the others
+    return isinstance(cache, LocMemCache)
+
+
+def enabled():
+    """
+    Whether responses are cached: not in a dummy cache, whose versions never
+    move, nor in a process-local one unless RESPONSE_CACHE_SINGLE_PROCESS
+    says a single process serves every request.
+    """
+    if getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default') is None:
+        return False
+    cache = get_cache()
+    if isinstance(cache, DummyCache):
+        return False
+    return not is_process_local(cache) or getattr(settings, 'RESPONSE_CACHE_SINGLE_PROCESS', False)
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    alias = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+    if alias is None or getattr(settings, 'RESPONSE_CACHE_SINGLE_PROCESS', False):
+        return []
+    if not is_process_local(caches[alias]):
+        return []
+    return [checks.Warning(
+        f'RESPONSE_CACHE_ALIAS {alias!r} is local to each process: the response cache is off.',
+        hint='Point it at a shared cache (redis, memcached), or set '
+             'RESPONSE_CACHE_SINGLE_PROCESS when one process serves every request.',
+        id='api.W001',
+    )]
+
+
+def _scope_hash(scope):
+    # category names may contain spaces or characters memcached rejects
+    return hashlib.md5(scope.encode()).hexdigest()
+
+
+def _version_key(scope):
+    return f'catalog-version:{_scope_hash(scope)}'
+
+
+def _mtime_key(scope):
+    return f'catalog-mtime:{_scope_hash(scope)}'
+
+
+def get_versions(scopes):
+    """Return ([(scope, version)], last modified timestamp) for ``scopes``."""
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes] + [_mtime_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    versions = [(scope, values.get(_version_key(scope), 0)) for scope in scopes]
+    mtimes = [values.get(_mtime_key(scope)) for scope in scopes]
+    known = [mtime for mtime in mtimes if mtime is not None]
+    if len(known) < len(mtimes):
+        # never bumped in this cache: start the clock now so Last-Modified stays stable
+        now = int(time.time())
+        for scope, mtime in zip(scopes, mtimes):
+            if mtime is None:
+                cache.add(_mtime_key(scope), now, None)
+        known.append(now)
+    return versions, max(known)
+
+
+def bump_versions(scopes):
+    cache = get_cache()
+    now = int(time.time())
+    for scope in set(scopes):
+        key = _version_key(scope)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(key, 1, None)
+        cache.set(_mtime_key(scope), now, None)
+
+
+def invalidate(*scopes):
+    """
+    Bump the version of ``scopes`` so cached responses built on them are ignored.
+
+    Inside a transaction the bump is repeated on commit: a reader that slipped
+    in between the first bump and the commit may have cached the old rows under
+    the new version.
+    """
+    scopes = set(scopes)
+    bump_versions(scopes)
+    if connection.in_atomic_block:
+        transaction.on_commit(partial(bump_versions, scopes))
+
+
+def request_cache_key(request, versions, replica=False):
+    params = sorted((key, sorted(values)) for key, values in request.GET.lists())
+    raw = '|'.join([
+        request.method,
+        request.build_absolute_uri(request.path),
+        repr(params),
+        repr(versions),
+        # replicas may miss the latest writes: users reading their own writes
+        # must not be answered from those
+        'replica' if replica else 'primary',
+    ])
+    return 'response:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def cached_response(scopes):
+    """
+    Read-through cache for GET views.
+
+    ``scopes`` maps the request to the version scopes its response depends on.
+    Responses are keyed on the normalized query string plus those versions, and
+    carry ETag/Last-Modified so clients can revalidate for a body-less 304.
+    Place it below the DRF decorators so authentication runs first. Without
+    a usable cache (see enabled()) the view runs as is.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or not enabled():
+                return view(request, *args, **kwargs)
+            versions, last_modified = get_versions(scopes(request))
+            replica = replicas.reading_from_replicas()
+            key = request_cache_key(request, versions, replica)
+            etag = quote_etag(key.split(':', 1)[1])
+            headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+            if not_modified(request, etag, last_modified):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            cache = get_cache()
+            cached = cache.get(key)
+            if cached is not None:
+                data, status_code = cached
+                return Response(data, status=status_code, headers=headers)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code in CACHEABLE_STATUSES:
+                ttl = getattr(settings, 'RESPONSE_CACHE_TTL', 300)
+                if replica:
+                    # a lagging replica's rows may predate the current versions
+                    ttl = min(ttl, replicas.get_config()['MAX_LAG'])
+                cache.set(key, (response.data, response.status_code), ttl)
+                for header, value in headers.items():
+                    response[header] = value
+            return response
+        return wrapper
+    return decorator
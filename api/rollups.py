@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import InventoryRollup, Item
+
+
+def low_stock_threshold():
+    return getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+
+
+def contribution(available_stock):
+    """(items, stock, low stock items) a single item adds to its rollup row."""
+    return 1, available_stock, int(available_stock <= low_stock_threshold())
+
+
+def apply_delta(category_id, stock_status, items, stock, low):
+    if not (items or stock or low):
+        return
+    updated = InventoryRollup.objects.filter(category_id=category_id, stock_status=stock_status).update(
+        item_count=F('item_count') + items,
+        stock_total=F('stock_total') + stock,
+        low_stock_count=F('low_stock_count') + low,
+    )
+    # only additions create rows: a removal from a missing row means the
+    # category itself is being deleted and its rollups go with it
+    if updated or items <= 0:
+        return
+    try:
+        with transaction.atomic():
+            InventoryRollup.objects.create(
+                category_id=category_id, stock_status=stock_status,
+                item_count=items, stock_total=stock, low_stock_count=low,
+            )
+    except IntegrityError:
+        # another writer created the row first
+        apply_delta(category_id, stock_status, items, stock, low)
+
+
+def item_saved(instance, created):
+    new = (instance.category_id, instance.stock_status)
+    items, stock, low = contribution(instance.available_stock)
+    if created:
+        apply_delta(*new, items, stock, low)
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if not {'category_id', 'stock_status', 'available_stock'} <= loaded.keys():
+        recompute_categories([instance.category_id])
+        return
+    old = (loaded['category_id'], loaded['stock_status'])
+    _, old_stock, old_low = contribution(loaded['available_stock'])
+    if old == new:
+        apply_delta(*new, 0, stock - old_stock, low - old_low)
+    else:
+        apply_delta(*old, -1, -old_stock, -old_low)
+        apply_delta(*new, items, stock, low)
+
+
+def item_deleted(instance):
+    items, stock, low = contribution(instance.available_stock)
+    apply_delta(instance.category_id, instance.stock_status, -items, -stock, -low)
+
+
+def aggregate_items(queryset):
+    """Recount rollups from Item with a GROUP BY, as {(category, status): (items, stock, low)}."""
+    rows = queryset.values('category_id', 'stock_status').annotate(
+        items=Count('id'),
+        stock=Sum('available_stock'),
+        low=Count('id', filter=Q(available_stock__lte=low_stock_threshold())),
+    )
+    return {
+        (row['category_id'], row['stock_status']): (row['items'], row['stock'] or 0, row['low'])
+        for row in rows
+    }
+
+
+def stored_rollups(queryset):
+    return {
+        (row.category_id, row.stock_status): (row.item_count, row.stock_total, row.low_stock_count)
+        for row in queryset
+    }
+
+
+def write_rollups(expected, stored):
+    InventoryRollup.objects.filter(
+        pk__in=[row.pk for row in stored if (row.category_id, row.stock_status) not in expected]
+    ).delete()
+    InventoryRollup.objects.bulk_create(
+        [
+            InventoryRollup(category_id=category_id, stock_status=stock_status,
+                            item_count=items, stock_total=stock, low_stock_count=low)
+            for (category_id, stock_status), (items, stock, low) in expected.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['category', 'stock_status'],
+        update_fields=['item_count', 'stock_total', 'low_stock_count'],
+    )
+
+
+def recompute_categories(category_ids):
+    """Recount the rollups of a few categories, for writes that skip post_save."""
+    category_ids = set(category_ids)
+    with transaction.atomic():
+        stored = list(InventoryRollup.objects.select_for_update().filter(category_id__in=category_ids))
+        expected = aggregate_items(Item.objects.filter(category_id__in=category_ids))
+        write_rollups(expected, stored)
+
+
+def rebuild(dry_run=False):
+    """Recount every rollup from Item and return the rows that had drifted."""
+    with transaction.atomic():
+        stored_rows = list(InventoryRollup.objects.select_for_update())
+        stored = stored_rollups(stored_rows)
+        expected = aggregate_items(Item.objects.all())
+        drift = []
+        for key in sorted(stored.keys() | expected.keys()):
+            before = stored.get(key, (0, 0, 0))
+            after = expected.get(key, (0, 0, 0))
+            if before != after:
+                drift.append({
+                    'category': key[0], 'stock_status': key[1],
+                    'stored': dict(zip(('items', 'stock', 'low_stock'), before)),
+                    'actual': dict(zip(('items', 'stock', 'low_stock'), after)),
+                })
+        if not dry_run:
+            write_rollups(expected, stored_rows)
+    return drift
+
+
+def inventory_stats():
+    """Totals per category and per stock status, read from the rollup table only."""
+    by_category, by_status = {}, {}
+    total = {'items': 0, 'available_stock': 0, 'low_stock': 0}
+    rows = InventoryRollup.objects.filter(item_count__gt=0).order_by('category_id', 'stock_status')
+    for row in rows:
+        values = {'items': row.item_count, 'available_stock': row.stock_total, 'low_stock': row.low_stock_count}
+        for bucket, key in ((by_category, row.category_id), (by_status, row.stock_status)):
+            counts = bucket.setdefault(key, {'items': 0, 'available_stock': 0, 'low_stock': 0})
+            for name, value in values.items():
+                counts[name] += value
+        for name, value in values.items():
+            total[name] += value
+    return {
+        'low_stock_threshold': low_stock_threshold(),
+        'total': total,
+        'by_category': [{'category': key, **counts} for key, counts in by_category.items()],
+        'by_stock_status': [{'stock_status': key, **counts} for key, counts in by_status.items()],
+    }
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Case, F, FloatField, Func, Lookup, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import ItemSearchIndex
+
+# item columns covered by the search index
+SEARCH_FIELDS = ('name', 'SKU', 'tags')
+
+
+class BaseSearchBackend(ABC):
+    """
+    Search over item name, SKU and tags.
+
+    Backends filter an Item queryset and, when asked to rank, annotate it
+    with ``search_rank`` (lower is better). ``index``/``remove`` are called on every item write;
+    backends that keep themselves in sync inside the database set
+    ``syncs_in_database`` and are never called.
+    """
+    syncs_in_database = False
+
+    def install(self, using=DEFAULT_DB_ALIAS):
+        pass
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        pass
+
+    def index(self, items):
+        pass
+
+    def remove(self, item_ids):
+        pass
+
+    @abstractmethod
+    def search(self, queryset, query, fields=SEARCH_FIELDS, rank=True):
+        """Items of ``queryset`` matching ``query`` in ``fields``, annotated with search_rank if ``rank``."""
+
+    def suggest(self, queryset, query, limit=10):
+        # names starting with the query first, then by relevance
+        queryset = self.search(queryset, query).annotate(
+            search_prefix=Case(When(name__istartswith=query, then=Value(0)), default=Value(1))
+        )
+        return queryset.order_by('search_prefix', 'search_rank', 'name', 'id')[:limit]
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Unindexed fallback that works on every database: plain icontains filters.
+    """
+    syncs_in_database = True
+    def search(self, queryset, query, fields=SEARCH_FIELDS, rank=True):
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': query})
+        queryset = queryset.filter(condition)
+        return queryset.annotate(search_rank=Value(0.0)) if rank else queryset
+
+
+class Match(Lookup):
+    """``document__match=query``: an FTS5 full-text match."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+ItemSearchIndex._meta.get_field('document').register_lookup(Match)
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 index using the trigram tokenizer.
+
+    The index is an external-content table over api_item, kept in sync by
+    triggers so bulk writes and raw updates are covered too. Trigrams give
+    substring matches like icontains did, but through the index.
+    """
+    table = 'api_item_fts'
+    # the trigram tokenizer cannot match anything shorter than this
+    min_query_length = 3
+    syncs_in_database = True
+
+    def install(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "name, SKU, tags, content='api_item', content_rowid='id', tokenize='trigram')"
+            )
+            # table rebuilds during migrations drop triggers, so always recreate them
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {self.table}_{suffix}")
+            cursor.execute(
+                f"CREATE TRIGGER {self.table}_ai AFTER INSERT ON api_item BEGIN "
+                f"INSERT INTO {self.table}(rowid, name, SKU, tags) VALUES (new.id, new.name, new.SKU, new.tags); "
+                "END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {self.table}_ad AFTER DELETE ON api_item BEGIN "
+                f"INSERT INTO {self.table}({self.table}, rowid, name, SKU, tags) "
+                "VALUES ('delete', old.id, old.name, old.SKU, old.tags); "
+                "END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {self.table}_au AFTER UPDATE OF name, SKU, tags ON api_item BEGIN "
+                f"INSERT INTO {self.table}({self.table}, rowid, name, SKU, tags) "
+                "VALUES ('delete', old.id, old.name, old.SKU, old.tags); "
+                f"INSERT INTO {self.table}(rowid, name, SKU, tags) VALUES (new.id, new.name, new.SKU, new.tags); "
+                "END"
+            )
+
+    def uninstall(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {self.table}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def match_expression(self, query, fields):
+        phrase = '"' + query.replace('"', '""') + '"'
+        return '{' + ' '.join(fields) + '} : ' + phrase
+
+    def search(self, queryset, query, fields=SEARCH_FIELDS, rank=True):
+        if len(query) < self.min_query_length:
+            return DatabaseSearchBackend().search(queryset, query, fields, rank)
+        match = self.match_expression(query, fields)
+        if not rank:
+            return queryset.filter(
+                id__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match])
+            )
+        # bm25() only works on the row being matched, so join the index once
+        # instead of running a MATCH per item in a correlated subquery
+        return queryset.filter(search_index__document__match=match).annotate(
+            search_rank=Func(F('search_index__document'), function='bm25', output_field=FloatField())
+        )
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'ITEM_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'sqlite':
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = DatabaseSearchBackend()
+    return _backend
@@ -1,4 +1,8 @@
+from functools import lru_cache
+
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueValidator
 from .models import Item, Category
 from django.contrib.auth.models import User
 
@@ -7,14 +11,101 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
+class LoadedRelatedField(serializers.PrimaryKeyRelatedField):
+    # an update keeping the related object the instance already loaded skips the lookup
+    def to_internal_value(self, data):
+        instance = self.parent.instance
+        field = instance._meta.get_field(self.source) if isinstance(instance, Item) else None
+        if field is not None and field.is_cached(instance) and str(data) == str(getattr(instance, field.attname)):
+            return getattr(instance, self.source)
+        return super().to_internal_value(data)
+
+class UnchangedOrUniqueValidator(UniqueValidator):
+    # an update keeping its value can't collide with another row: skip the query
+    def __call__(self, value, serializer_field):
+        instance = getattr(serializer_field.parent, 'instance', None)
+        if instance is not None and getattr(instance, serializer_field.source) == value:
+            return
+        super().__call__(value, serializer_field)
+
 class ItemSerializer(serializers.ModelSerializer):
     # category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    serializer_related_field = LoadedRelatedField
+
     class Meta:
         model = Item
         # SKU, name, category, tags, stock status, and available stock 
         fields = ('SKU', 'name', 'category', 'tags', 'stock_status', 'available_stock')
+        extra_kwargs = {'SKU': {'validators': [UnchangedOrUniqueValidator(queryset=Item.objects.all())]}}
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['id', 'username', 'password', 'email']
\ No newline at end of file
+        fields = ['id', 'username', 'password', 'email']
+
+@lru_cache(maxsize=256)
+def compile_row_function(fields):
+    """
+    Build ``row -> dict`` for rows shaped like ``fields`` (name, index) pairs.
+
+    A generated dict literal is noticeably faster than dict(zip(...)) or a
+    Serializer walking its fields for every row.
+    """
+    items = ', '.join(f'{name!r}: row[{index}]' for name, index in fields)
+    namespace = {}
+    exec(f'def to_dict(row):\n    return {{{items}}}', namespace)
+    return namespace['to_dict']
+
+
+class RowSerializer:
+    """
+    Read-only fast path producing the same output as a ModelSerializer.
+
+    Querysets are projected to ``values_list`` rows and turned into dicts by a
+    precompiled function, skipping model instances and field objects.
+    ``sources`` maps each output field to the column it is read from.
+
+    ``fields`` narrows the output, and the columns read, to a subset of the
+    declared fields, see parse_fields().
+    """
+    fields = ()
+    sources = {}
+    # always selected, e.g. for cursor pagination, but not part of the output
+    extra_columns = ()
+
+    def __init__(self, fields=None, extra_columns=()):
+        if fields is not None:
+            self.fields = tuple(field for field in self.fields if field in fields)
+        self.columns = [self.sources.get(field, field) for field in self.fields]
+        for column in (*self.extra_columns, *extra_columns):
+            if column not in self.columns:
+                self.columns.append(column)
+        self.to_dict = compile_row_function(tuple((field, index) for index, field in enumerate(self.fields)))
+
+    @classmethod
+    def parse_fields(cls, value):
+        """The fields asked for with ?fields=SKU,available_stock, or None for all of them."""
+        names = [name.strip() for name in (value or '').split(',') if name.strip()]
+        if not names:
+            return None
+        unknown = [name for name in names if name not in cls.fields]
+        if unknown:
+            raise ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}. Choose from {", ".join(cls.fields)}.'})
+        return names
+
+    def project(self, queryset):
+        return queryset.values_list(*self.columns, named=True)
+
+    def serialize(self, rows):
+        to_dict = self.to_dict
+        return [to_dict(row) for row in rows]
+
+
+class ItemRowSerializer(RowSerializer):
+    fields = ItemSerializer.Meta.fields
+    sources = {'category': 'category_id'}
+    extra_columns = ('id',)
+
+
+class CategoryRowSerializer(RowSerializer):
+    fields = ('name',)
@@ -0,0 +1,300 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+from rest_framework.authtoken.models import Token
+
+from . import changefeed, changelog, db, metrics, response_cache, rollups
+from .authentication import invalidate_token, invalidate_user
+from .models import Category, ChangeLog, Item
+from .search import get_search_backend
+from .tags import sync_tags
+
+# Sent by bulk writers (bulk_create/update) that bypass post_save, with
+# ``items`` (saved rows, at least id/SKU/tags/category loaded), ``categories``
+# (names of every category the rows were in before or after the write),
+# ``created_categories`` (names of categories the write created), optionally
+# ``update_fields`` (the only columns written, None for all of them),
+# ``rollup_deltas`` ({(category, stock_status): (items, stock, low stock)}
+# when the sender already knows how the rollups changed) and ``created_skus``
+# (SKUs of the rows the write created, when it may have created any).
+items_bulk_saved = Signal()
+
+# Sent by bulk deletes with ``ids`` (deleted item ids), optionally ``items``
+# (the deleted rows, id/SKU/category loaded), ``categories`` (names of the
+# categories they were in) and ``rollup_deltas`` as for items_bulk_saved.
+items_bulk_deleted = Signal()
+
+# columns that feed other tables
+TAG_FIELDS = {'tags'}
+ROLLUP_FIELDS = {'category', 'stock_status', 'available_stock'}
+
+
+def _touches(update_fields, fields):
+    return update_fields is None or bool(fields.intersection(update_fields))
+
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_item_writes():
+    """
+    Silence the per-row Item handlers, e.g. around a queryset delete() whose
+    effects the caller announces with one bulk signal instead.
+    """
+    previous = getattr(_bulk, 'active', False)
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        # a nested block must leave the outer one silenced
+        _bulk.active = previous
+
+
+def per_row(handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not getattr(_bulk, 'active', False):
+            handler(*args, **kwargs)
+    return wrapper
+
+
+@per_row
+def index_item(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+
+@per_row
+def unindex_item(sender, instance, **kwargs):
+    get_search_backend().remove([instance.id])
+
+
+@per_row
+def update_item_tags(sender, instance, created, **kwargs):
+    if created:
+        changed = bool(instance.tags)
+    else:
+        loaded = getattr(instance, '_loaded_values', {})
+        changed = 'tags' not in loaded or loaded['tags'] != instance.tags
+    if changed:
+        sync_tags([instance])
+
+
+def forget_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def forget_user_tokens(sender, instance, created, **kwargs):
+    # password resets, deactivation and other user changes must not be served stale
+    if not created:
+        invalidate_user(instance)
+
+
+@per_row
+def invalidate_item_responses(sender, instance, **kwargs):
+    scopes = {
+        response_cache.GLOBAL,
+        response_cache.category_scope(instance.category_id),
+        response_cache.sku_scope(instance.SKU),
+    }
+    loaded = getattr(instance, '_loaded_values', {})
+    if loaded.get('category_id') is not None:
+        # an item moved out of a category changes that category's listings too
+        scopes.add(response_cache.category_scope(loaded['category_id']))
+    if loaded.get('SKU') is not None:
+        # and a renamed SKU no longer answers on its old one
+        scopes.add(response_cache.sku_scope(loaded['SKU']))
+    response_cache.invalidate(*scopes)
+
+
+def invalidate_category_responses(sender, instance, **kwargs):
+    response_cache.invalidate(
+        response_cache.GLOBAL, response_cache.CATEGORIES, response_cache.ITEMS,
+        response_cache.category_scope(instance.pk),
+    )
+
+
+def bulk_index_items(sender, items, **kwargs):
+    get_search_backend().index(items)
+
+
+def bulk_update_item_tags(sender, items, update_fields=None, **kwargs):
+    if _touches(update_fields, TAG_FIELDS):
+        sync_tags(items)
+
+
+def bulk_invalidate_responses(sender, categories, created_categories=(), **kwargs):
+    # one counter for every item page, rather than one per written row
+    scopes = {response_cache.GLOBAL, response_cache.ITEMS}
+    scopes.update(response_cache.category_scope(name) for name in categories)
+    if created_categories:
+        scopes.add(response_cache.CATEGORIES)
+    response_cache.invalidate(*scopes)
+
+
+def bulk_unindex_items(sender, ids, **kwargs):
+    get_search_backend().remove(ids)
+
+
+@per_row
+def update_rollups_on_save(sender, instance, created, **kwargs):
+    rollups.item_saved(instance, created)
+
+
+@per_row
+def update_rollups_on_delete(sender, instance, **kwargs):
+    rollups.item_deleted(instance)
+
+
+def bulk_update_rollups(sender, categories, update_fields=None, rollup_deltas=None, **kwargs):
+    if rollup_deltas is not None:
+        for (category_id, stock_status), delta in rollup_deltas.items():
+            rollups.apply_delta(category_id, stock_status, *delta)
+    elif _touches(update_fields, ROLLUP_FIELDS):
+        rollups.recompute_categories(categories)
+
+
+@per_row
+def publish_item_saved(sender, instance, created, **kwargs):
+    # an item moved out of a category is news to that category too
+    previous = getattr(instance, '_loaded_values', {}).get('category_id')
+    changefeed.publish(
+        changefeed.ITEM_CREATED if created else changefeed.ITEM_UPDATED,
+        changefeed.item_data(instance), {instance.category_id, previous},
+    )
+
+
+@per_row
+def publish_item_deleted(sender, instance, **kwargs):
+    changefeed.publish(changefeed.ITEM_DELETED, {'SKU': instance.SKU, 'category': instance.category_id},
+                       {instance.category_id})
+
+
+def publish_category_saved(sender, instance, created, **kwargs):
+    if created:
+        changefeed.publish(changefeed.CATEGORY_CREATED, {'category': instance.pk}, {instance.pk})
+
+
+def publish_category_deleted(sender, instance, **kwargs):
+    changefeed.publish(changefeed.CATEGORY_DELETED, {'category': instance.pk}, {instance.pk})
+
+
+def publish_items_bulk_saved(sender, items, created_categories=(), created_skus=(), **kwargs):
+    for name in created_categories:
+        changefeed.publish(changefeed.CATEGORY_CREATED, {'category': name}, {name})
+    created_skus = set(created_skus)
+    for item in items:
+        changefeed.publish(
+            changefeed.ITEM_CREATED if item.SKU in created_skus else changefeed.ITEM_UPDATED,
+            changefeed.item_data(item), {item.category_id},
+        )
+
+
+def publish_items_bulk_deleted(sender, items=(), **kwargs):
+    for item in items:
+        changefeed.publish(changefeed.ITEM_DELETED, {'SKU': item.SKU, 'category': item.category_id},
+                           {item.category_id})
+
+
+@per_row
+def log_item_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_values', {}).get('SKU')
+    if previous is not None and previous != instance.SKU:
+        changelog.record(ChangeLog.ITEM, ChangeLog.DELETE, [previous])
+    changelog.record(ChangeLog.ITEM, ChangeLog.UPSERT, [instance.SKU])
+
+
+@per_row
+def log_item_deleted(sender, instance, **kwargs):
+    changelog.record(ChangeLog.ITEM, ChangeLog.DELETE, [instance.SKU])
+
+
+def log_category_saved(sender, instance, created, **kwargs):
+    if created:
+        changelog.record(ChangeLog.CATEGORY, ChangeLog.UPSERT, [instance.pk])
+
+
+def log_category_deleted(sender, instance, **kwargs):
+    changelog.record(ChangeLog.CATEGORY, ChangeLog.DELETE, [instance.pk])
+
+
+def log_items_bulk_saved(sender, items, created_categories=(), **kwargs):
+    changelog.record(ChangeLog.CATEGORY, ChangeLog.UPSERT, sorted(created_categories))
+    changelog.record(ChangeLog.ITEM, ChangeLog.UPSERT, [item.SKU for item in items])
+
+
+def log_items_bulk_deleted(sender, items=(), **kwargs):
+    changelog.record(ChangeLog.ITEM, ChangeLog.DELETE, [item.SKU for item in items])
+
+
+def install_search_index(sender, using, **kwargs):
+    # migrations that rebuild api_item drop the index triggers with it
+    if 'api_item' in connections[using].introspection.table_names():
+        get_search_backend().install(using)
+
+
+def connect_search_signals():
+    # backends synced by database triggers don't need per-row hooks
+    if get_search_backend().syncs_in_database:
+        return
+    post_save.connect(index_item, sender=Item, dispatch_uid='api_index_item')
+    items_bulk_saved.connect(bulk_index_items, dispatch_uid='api_bulk_index_items')
+    post_delete.connect(unindex_item, sender=Item, dispatch_uid='api_unindex_item')
+    items_bulk_deleted.connect(bulk_unindex_items, dispatch_uid='api_bulk_unindex_items')
+
+
+def connect_tag_signals():
+    post_save.connect(update_item_tags, sender=Item, dispatch_uid='api_update_item_tags')
+    items_bulk_saved.connect(bulk_update_item_tags, dispatch_uid='api_bulk_update_item_tags')
+
+
+def connect_auth_signals():
+    post_delete.connect(forget_token, sender=Token, dispatch_uid='api_forget_token')
+    post_save.connect(forget_user_tokens, sender=User, dispatch_uid='api_forget_user_tokens')
+
+
+def connect_cache_signals():
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_item_responses, sender=Item, dispatch_uid='api_invalidate_item_responses')
+        signal.connect(invalidate_category_responses, sender=Category, dispatch_uid='api_invalidate_category_responses')
+    items_bulk_saved.connect(bulk_invalidate_responses, dispatch_uid='api_bulk_invalidate_responses')
+    items_bulk_deleted.connect(bulk_invalidate_responses, dispatch_uid='api_bulk_delete_invalidate_responses')
+
+
+def connect_rollup_signals():
+    post_save.connect(update_rollups_on_save, sender=Item, dispatch_uid='api_update_rollups_on_save')
+    post_delete.connect(update_rollups_on_delete, sender=Item, dispatch_uid='api_update_rollups_on_delete')
+    items_bulk_saved.connect(bulk_update_rollups, dispatch_uid='api_bulk_update_rollups')
+    items_bulk_deleted.connect(bulk_update_rollups, dispatch_uid='api_bulk_delete_update_rollups')
+
+
+def connect_changelog_signals():
+    post_save.connect(log_item_saved, sender=Item, dispatch_uid='api_log_item_saved')
+    post_delete.connect(log_item_deleted, sender=Item, dispatch_uid='api_log_item_deleted')
+    post_save.connect(log_category_saved, sender=Category, dispatch_uid='api_log_category_saved')
+    post_delete.connect(log_category_deleted, sender=Category, dispatch_uid='api_log_category_deleted')
+    items_bulk_saved.connect(log_items_bulk_saved, dispatch_uid='api_log_items_bulk_saved')
+    items_bulk_deleted.connect(log_items_bulk_deleted, dispatch_uid='api_log_items_bulk_deleted')
+
+
+def connect_changefeed_signals():
+    post_save.connect(publish_item_saved, sender=Item, dispatch_uid='api_publish_item_saved')
+    post_delete.connect(publish_item_deleted, sender=Item, dispatch_uid='api_publish_item_deleted')
+    post_save.connect(publish_category_saved, sender=Category, dispatch_uid='api_publish_category_saved')
+    post_delete.connect(publish_category_deleted, sender=Category, dispatch_uid='api_publish_category_deleted')
+    items_bulk_saved.connect(publish_items_bulk_saved, dispatch_uid='api_publish_items_bulk_saved')
+    items_bulk_deleted.connect(publish_items_bulk_deleted, dispatch_uid='api_publish_items_bulk_deleted')
+
+
+def connect_database_signals():
+    connection_created.connect(db.configure_connection, dispatch_uid='api_configure_connection')
+
+
+def connect_metrics_signals():
+    connection_created.connect(metrics.install_query_recorder, dispatch_uid='api_install_query_recorder')
@@ -0,0 +1,141 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .batch import MAX_BATCH_SIZE, chunked
+from .db import retry_on_lock
+from .models import Item
+from .rollups import contribution
+from .signals import items_bulk_saved
+
+IN_STOCK = 'In Stock'
+OUT_OF_STOCK = 'Out of Stock'
+BACKORDERED = 'Backordered'
+# a stale read is retried this many times before the adjustment gives up
+MAX_RETRIES = 5
+
+
+def stock_status_for(quantity):
+    if quantity > 0:
+        return IN_STOCK
+    if quantity == 0:
+        return OUT_OF_STOCK
+    return BACKORDERED
+
+
+def stock_status_after(delta):
+    """SQL for the stock status of ``available_stock + delta``, evaluated in the UPDATE itself."""
+    return Case(
+        When(available_stock__gt=-delta, then=Value(IN_STOCK)),
+        When(available_stock=-delta, then=Value(OUT_OF_STOCK)),
+        default=Value(BACKORDERED),
+    )
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_adjustments(data):
+    """Validate ``[{SKU, delta, expected_version?}]`` and return (adjustments, errors by position)."""
+    adjustments, errors = [], {}
+    if not isinstance(data, list):
+        return [], {None: 'Expected a list of {"SKU", "delta"} objects.'}
+    if len(data) > MAX_BATCH_SIZE:
+        return [], {None: f'At most {MAX_BATCH_SIZE} adjustments per request.'}
+    for position, entry in enumerate(data):
+        if not isinstance(entry, dict) or not entry.get('SKU'):
+            errors[position] = 'SKU is required.'
+            continue
+        delta = entry.get('delta')
+        expected = entry.get('expected_version')
+        # JSON integers only: no 2.9, true or "5"
+        if not _is_int(delta) or not (expected is None or _is_int(expected)):
+            errors[position] = 'delta and expected_version must be integers.'
+            continue
+        adjustments.append((position, str(entry['SKU']), delta, expected))
+    return adjustments, errors
+
+
+def _read(skus):
+    current = {}
+    for chunk in chunked(skus):
+        rows = Item.objects.filter(SKU__in=chunk).values_list(
+            'SKU', 'id', 'category_id', 'stock_status', 'available_stock', 'version'
+        )
+        current.update((row[0], row[1:]) for row in rows)
+    return current
+
+
+def adjust_stock(adjustments):
+    """
+    Apply ``(position, SKU, delta, expected_version)`` adjustments in one transaction.
+
+    Each row is written with a single UPDATE that adds the delta with F(),
+    derives stock_status from the new quantity and bumps the version, guarded
+    by the version that was read. A guard miss means another writer got there
+    first: the row is re-read and retried, unless the client pinned
+    expected_version, in which case it is reported as a conflict.
+    """
+    return retry_on_lock(_adjust_stock, adjustments)
+
+
+def _adjust_stock(adjustments):
+    results = {}
+    rollup_deltas = defaultdict(lambda: [0, 0, 0])
+    categories = set()
+    touched = []
+    with transaction.atomic():
+        current = _read({sku for _, sku, _, _ in adjustments})
+        for position, sku, delta, expected in adjustments:
+            for _ in range(MAX_RETRIES):
+                row = current.get(sku)
+                if row is None:
+                    results[position] = {'SKU': sku, 'status': 'not_found'}
+                    break
+                item_id, category_id, old_status, old_stock, version = row
+                if expected is not None and expected != version:
+                    results[position] = {'SKU': sku, 'status': 'conflict', 'version': version}
+                    break
+                updated = Item.objects.filter(id=item_id, version=version).update(
+                    available_stock=F('available_stock') + delta,
+                    stock_status=stock_status_after(delta),
+                    version=F('version') + 1,
+                )
+                if not updated:
+                    # changed or deleted since it was read
+                    current.pop(sku)
+                    current.update(_read([sku]))
+                    continue
+                new_stock = old_stock + delta
+                new_status = stock_status_for(new_stock)
+                current[sku] = (item_id, category_id, new_status, new_stock, version + 1)
+                for key, sign, stock in (((category_id, old_status), -1, old_stock), ((category_id, new_status), 1, new_stock)):
+                    for index, value in enumerate(contribution(stock)):
+                        rollup_deltas[key][index] += sign * value
+                categories.add(category_id)
+                touched.append(item_id)
+                results[position] = {
+                    'SKU': sku, 'status': 'ok', 'available_stock': new_stock,
+                    'stock_status': new_status, 'version': version + 1,
+                }
+                break
+            else:
+                row = current.get(sku)
+                if row is None:
+                    results[position] = {'SKU': sku, 'status': 'not_found'}
+                else:
+                    results[position] = {'SKU': sku, 'status': 'conflict', 'version': row[4]}
+
+        if touched:
+            items_bulk_saved.send(
+                sender=Item,
+                items=list(Item.objects.filter(id__in=set(touched)).only(
+                    'id', 'SKU', 'tags', 'category_id', 'stock_status', 'available_stock', 'version')),
+                categories=categories,
+                created_categories=set(),
+                update_fields=['available_stock', 'stock_status', 'version'],
+                rollup_deltas={key: tuple(delta) for key, delta in rollup_deltas.items()},
+            )
+    return results
@@ -0,0 +1,29 @@
+from .models import ItemTag, Tag
+
+
+def parse_tags(value):
+    """Split a comma separated tags string into unique, lower-cased tag names."""
+    names = []
+    for part in (value or '').split(','):
+        name = part.strip().lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_tags(items):
+    """Rewrite the ItemTag rows of ``items`` to match their ``tags`` strings."""
+    wanted = {item.id: parse_tags(item.tags) for item in items}
+    if not wanted:
+        return
+    names = {name for item_names in wanted.values() for name in item_names}
+    tag_ids = {}
+    if names:
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    ItemTag.objects.filter(item_id__in=wanted).delete()
+    ItemTag.objects.bulk_create([
+        ItemTag(item_id=item_id, tag_id=tag_ids[name])
+        for item_id, item_names in wanted.items()
+        for name in item_names
+    ])
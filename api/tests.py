@@ -1,11 +1,63 @@
-from django.test import TestCase
+import csv
+import io
+import asyncio
+import json
+import os
+import tempfile
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from rest_framework.test import APIRequestFactory, force_authenticate
 from rest_framework import status
-from api.serializers import CategorySerializer
-from .models import Item, Category
-from .views import createCategory, createItem, getAllCategories, getAllItems, getItem
+from rest_framework.exceptions import AuthenticationFailed
+from api.authentication import CachedTokenAuthentication, get_token_cache
+from api.search import BaseSearchBackend, get_search_backend
+from api import export
+from api.serializers import CategorySerializer, CategoryRowSerializer, ItemRowSerializer, ItemSerializer
+from api.renderers import FastJSONRenderer
+from rest_framework.renderers import JSONRenderer
+from .models import ChangeLog, ChangeLogCompaction, InventoryRollup, Item, Category, CategoryDeletion, OutboundEmail, Tag
+from api import batch, benchmarking, category_deletion, changefeed, changelog, db, mailqueue, metrics, replicas, response_cache, rollups, signals, stock, throttling
+from api.mailqueue import MailQueue
+from api.management.commands.loadtest import Command as LoadTestCommand
+from .views import adjustStock, bulkDeleteItems, bulkUpdateItems, cancelCategoryDeletion, categoryDeletionStatus, createCategory, delete_category, createItem, exportItems, forgot_password, inventoryStats, getAllCategories, getAllItems, getItem, getItems, importItems, searchItems, syncItems, updateItem
+
+class AuthenticatedAPITestMixin:
+    """A user with an API token, and helpers calling function views as that user."""
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='test_user')
+        self.token = Token.objects.create(user=self.user)
+
+    def call_view(self, view, method, path, *args, user=None, **kwargs):
+        """``view``'s response to a ``method`` request for ``path``, by ``user`` or the test user."""
+        request = getattr(self.factory, method)(path, *args, **kwargs)
+        if user is None:
+            force_authenticate(request, user=self.user, token=self.token)
+        else:
+            force_authenticate(request, user=user)
+        return view(request)
+
+    def get_view(self, view, path, params=None, **kwargs):
+        return self.call_view(view, 'get', path, params, **kwargs)
+
+    def post_view(self, view, path, data=None, **kwargs):
+        if 'content_type' not in kwargs:
+            kwargs.setdefault('format', 'json')
+        return self.call_view(view, 'post', path, data, **kwargs)
+
 
 class GetAllItemsAPITest(TestCase):
     def setUp(self):
@@ -228,3 +280,1475 @@ class CreateItemAPITest(TestCase):
 
 
 
+class ItemFacetsAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        shirts = Category.objects.create(name='Shirts')
+        hats = Category.objects.create(name='Hats')
+        Item.objects.create(SKU='SKU1', name='Summer shirt', category=shirts, tags='cotton, sale',
+                            stock_status='In Stock', available_stock=10)
+        Item.objects.create(SKU='SKU2', name='Winter shirt', category=shirts, tags='wool',
+                            stock_status='Out of Stock', available_stock=0)
+        Item.objects.create(SKU='SKU3', name='Summer hat', category=hats, tags='cotton',
+                            stock_status='In Stock', available_stock=3)
+
+    def get(self, params):
+        return self.get_view(getAllItems, '/api/item-list/', params)
+
+    def test_no_facets_unless_asked(self):
+        self.assertNotIn('facets', self.get({}).data)
+
+    def test_counts_from_rollups_without_scanning_items(self):
+        # the count, the page, the category and status facets from the rollup
+        # table and the tag counts
+        with self.assertNumQueries(4):
+            response = self.get({'facets': 'true'})
+        self.assertEqual(response.data['facets'], {
+            'category': {'Shirts': 2, 'Hats': 1},
+            'stock_status': {'In Stock': 2, 'Out of Stock': 1},
+            'tag': {'cotton': 2, 'sale': 1, 'wool': 1},
+        })
+        response = self.get({'facets': 'category,stock_status', 'category': 'Shirts'})
+        self.assertEqual(response.data['facets'], {
+            'category': {'Shirts': 2}, 'stock_status': {'In Stock': 1, 'Out of Stock': 1}})
+
+    def test_counts_follow_the_search(self):
+        with self.assertNumQueries(4):
+            response = self.get({'search': 'summer', 'facets': 'all'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['facets'], {
+            'category': {'Hats': 1, 'Shirts': 1},
+            'stock_status': {'In Stock': 2},
+            'tag': {'cotton': 2, 'sale': 1},
+        })
+        response = self.get({'tag': 'cotton', 'pagination': 'cursor', 'facets': 'category'})
+        self.assertEqual(response.data['facets'], {'category': {'Hats': 1, 'Shirts': 1}})
+
+    def test_unknown_facet(self):
+        response = self.get({'facets': 'category,colour'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', str(response.data['facets']))
+
+    def test_async_item_list_matches(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        params = {'search': 'shirt', 'facets': 'true'}
+        sync = self.client.get('/api/item-list/', params, **auth)
+        async_ = self.client.get('/api/async/item-list/', params, **auth)
+        self.assertEqual(async_.status_code, 200)
+        self.assertEqual(async_.json()['facets'], sync.json()['facets'])
+
+
+class CursorPaginationAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        for i in range(12):
+            Item.objects.create(SKU=f'SKU{i:03}', name=f'Item {i % 4}', category=category,
+                                stock_status='In Stock', available_stock=i)
+
+    def get(self, url, params=None):
+        return self.get_view(getAllItems, url, params)
+
+    def walk(self, params):
+        # follow next links until the last page and collect every SKU
+        skus = []
+        response = self.get('/api/item-list/', params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            skus += [item['SKU'] for item in response.data['results']]
+            if not response.data['next']:
+                return skus, response
+            response = self.get(response.data['next'])
+
+    def test_walks_every_item_once(self):
+        skus, _ = self.walk({'pagination': 'cursor', 'page_size': 5})
+        self.assertEqual(skus, [f'SKU{i:03}' for i in range(12)])
+
+    def test_order_by_uses_id_tiebreaker(self):
+        skus, _ = self.walk({'pagination': 'cursor', 'page_size': 3, 'order_by': '-name'})
+        expected = sorted(Item.objects.all(), key=lambda item: (item.name, item.id), reverse=True)
+        self.assertEqual(skus, [item.SKU for item in expected])
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.get('/api/item-list/', {'pagination': 'cursor', 'page_size': 4, 'order_by': 'available_stock'})
+        second = self.get(first.data['next'])
+        back = self.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_page_size_is_capped_and_count_skippable(self):
+        response = self.get('/api/item-list/', {'pagination': 'cursor', 'page_size': 1000, 'count': 'false'})
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor_and_order_by(self):
+        response = self.get('/api/item-list/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        response = self.get('/api/item-list/', {'pagination': 'cursor', 'order_by': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ItemSearchAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        Item.objects.create(SKU='TS-RED-01', name='Red T-Shirt', category=category, tags='cotton,summer', stock_status='In Stock', available_stock=3)
+        Item.objects.create(SKU='TS-BLU-01', name='Blue T-Shirt', category=category, tags='cotton', stock_status='In Stock', available_stock=3)
+        Item.objects.create(SKU='HAT-01', name='Shirtless Hat', category=category, tags='wool', stock_status='In Stock', available_stock=3)
+
+    def list_skus(self, params, view=getAllItems):
+        response = self.get_view(view, '/api/item-list/', params)
+        if response.status_code != 200:
+            return response, []
+        data = response.data['results'] if view is getAllItems else response.data
+        return response, [item['SKU'] for item in data]
+
+    def test_search_matches_name_sku_and_tags(self):
+        _, skus = self.list_skus({'search': 'shirt'})
+        self.assertCountEqual(skus, ['TS-RED-01', 'TS-BLU-01', 'HAT-01'])
+        _, skus = self.list_skus({'search': 'blu-0'})
+        self.assertEqual(skus, ['TS-BLU-01'])
+        _, skus = self.list_skus({'search': 'summer'})
+        self.assertEqual(skus, ['TS-RED-01'])
+
+    def test_sku_and_name_filters(self):
+        _, skus = self.list_skus({'sku': 'TS-', 'name': 'red'})
+        self.assertEqual(skus, ['TS-RED-01'])
+        response, _ = self.list_skus({'sku': 'nothing-like-this'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_follows_updates_and_deletes(self):
+        item = Item.objects.get(SKU='HAT-01')
+        item.name = 'Wool Beanie'
+        item.save()
+        Item.objects.filter(SKU='TS-RED-01').delete()
+        _, skus = self.list_skus({'search': 'shirt'})
+        self.assertEqual(skus, ['TS-BLU-01'])
+        _, skus = self.list_skus({'search': 'beanie'})
+        self.assertEqual(skus, ['HAT-01'])
+
+    def test_suggest_ranks_prefix_matches_first(self):
+        response, skus = self.list_skus({'q': 'shirt'}, view=searchItems)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(skus[0], 'HAT-01')
+        _, skus = self.list_skus({'q': 'bl'}, view=searchItems)
+        self.assertEqual(skus, ['TS-BLU-01'])
+
+    def test_ranked_search_composes(self):
+        backend = get_search_backend()
+        ranked = backend.search(Item.objects.filter(tag_links__tag__name='cotton'), 'shirt').order_by('search_rank', 'id')
+        self.assertCountEqual(ranked.values_list('SKU', flat=True), ['TS-RED-01', 'TS-BLU-01'])
+        # as a subquery of another table every table is aliased: the rank must follow
+        tags = Tag.objects.filter(item_links__item__in=ranked.values('id')).distinct()
+        self.assertCountEqual(tags.values_list('name', flat=True), ['cotton', 'summer'])
+
+    def test_ranked_search_matches_once(self):
+        ranked = get_search_backend().search(Item.objects.all(), 'shirt')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertCountEqual(ranked.values_list('SKU', flat=True), ['TS-RED-01', 'TS-BLU-01', 'HAT-01'])
+        # one join on the index, not a MATCH re-run per matched item to rank it
+        self.assertEqual(queries.captured_queries[0]['sql'].count('MATCH'), 1)
+
+    def test_backends_must_search(self):
+        class IndexOnlyBackend(BaseSearchBackend):
+            def index(self, items):
+                pass
+        with self.assertRaises(TypeError):
+            IndexOnlyBackend()
+
+    def test_suggest_requires_query(self):
+        response, _ = self.list_skus({}, view=searchItems)
+        self.assertEqual(response.status_code, 400)
+
+
+class ItemTagAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Category1')
+
+    def list_skus(self, params):
+        response = self.get_view(getAllItems, '/api/item-list/', params)
+        if response.status_code != 200:
+            return []
+        return sorted(item['SKU'] for item in response.data['results'])
+
+    def test_tags_string_is_normalized(self):
+        item = Item.objects.create(SKU='SKU1', name='Item 1', category=self.category, tags=' Cotton, summer,cotton ', stock_status='In Stock')
+        self.assertEqual(sorted(item.tag_set.values_list('name', flat=True)), ['cotton', 'summer'])
+
+        item = Item.objects.get(SKU='SKU1')
+        item.tags = 'wool'
+        item.save()
+        self.assertEqual(list(item.tag_set.values_list('name', flat=True)), ['wool'])
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_filter_by_tags(self):
+        Item.objects.create(SKU='SKU1', name='Item 1', category=self.category, tags='cotton,summer', stock_status='In Stock')
+        Item.objects.create(SKU='SKU2', name='Item 2', category=self.category, tags='cotton', stock_status='In Stock')
+        Item.objects.create(SKU='SKU3', name='Item 3', category=self.category, stock_status='In Stock')
+        self.assertEqual(self.list_skus({'tag': 'Cotton'}), ['SKU1', 'SKU2'])
+        self.assertEqual(self.list_skus({'tag': ['cotton', 'summer']}), ['SKU1'])
+        self.assertEqual(self.list_skus({'tag': 'wool'}), [])
+
+
+class CachedTokenAuthenticationTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.auth = CachedTokenAuthentication()
+        get_token_cache().clear_local()
+
+    def test_second_lookup_skips_database(self):
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_header_authentication_uses_cache(self):
+        Category.objects.create(name='Category1')
+        for _ in range(2):
+            request = self.factory.get('/api/category-list/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            response = getAllCategories(request)
+            self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(get_token_cache().get(self.token.key))
+
+    def test_deleted_token_is_rejected(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_password_change_invalidates(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.set_password('n3w-Passw0rd!')
+        self.user.save()
+        self.assertIsNone(get_token_cache().get(self.token.key))
+        with self.assertNumQueries(1):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertTrue(user.check_password('n3w-Passw0rd!'))
+
+
+class ResponseCacheTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category1 = Category.objects.create(name='Category1')
+        self.category2 = Category.objects.create(name='Category2')
+        Item.objects.create(SKU='SKU1', name='Item 1', category=self.category1, stock_status='In Stock', available_stock=1)
+        Item.objects.create(SKU='SKU2', name='Item 2', category=self.category2, stock_status='In Stock', available_stock=2)
+
+    def get(self, view, params=None, **headers):
+        return self.get_view(view, '/api/item-list/', params, **headers)
+
+    def test_repeated_read_is_served_from_cache(self):
+        first = self.get(getAllItems, {'order_by': 'SKU'})
+        with self.assertNumQueries(0):
+            second = self.get(getAllItems, {'order_by': 'SKU'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_write_invalidates(self):
+        self.get(getItem, {'SKU': 'SKU1'})
+        item = Item.objects.get(SKU='SKU1')
+        item.available_stock = 7
+        item.save()
+        response = self.get(getItem, {'SKU': 'SKU1'})
+        self.assertEqual(response.data['available_stock'], 7)
+
+    def test_category_scoped_invalidation(self):
+        self.get(getAllItems, {'category': 'Category1'})
+        Item.objects.filter(SKU='SKU2').get().save()
+        with self.assertNumQueries(0):
+            self.get(getAllItems, {'category': 'Category1'})
+        Item.objects.create(SKU='SKU3', name='Item 3', category=self.category1, stock_status='In Stock')
+        response = self.get(getAllItems, {'category': 'Category1'})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_item_detail_scoped_by_sku(self):
+        self.get(getItem, {'SKU': 'SKU1'})
+        Item.objects.filter(SKU='SKU2').get().save()
+        with self.assertNumQueries(0):
+            self.get(getItem, {'SKU': 'SKU1'})
+        # bulk writes don't name every SKU: they bump all item pages
+        batch.update_items([{'SKU': 'SKU1', 'name': 'Renamed'}])
+        self.assertEqual(self.get(getItem, {'SKU': 'SKU1'}).data['name'], 'Renamed')
+
+    def test_process_local_cache_is_off_across_workers(self):
+        with override_settings(RESPONSE_CACHE_SINGLE_PROCESS=False):
+            self.get(getAllCategories)
+            with self.assertNumQueries(1):
+                response = self.get(getAllCategories)
+            self.assertNotIn('ETag', response)
+            self.assertEqual([error.id for error in response_cache.check_shared_cache()], ['api.W001'])
+        self.assertEqual(response_cache.check_shared_cache(), [])
+
+    def test_category_list_invalidated_by_new_category(self):
+        self.get(getAllCategories)
+        Category.objects.create(name='Category3')
+        self.assertEqual(len(self.get(getAllCategories).data), 3)
+
+    def test_conditional_requests(self):
+        first = self.get(getAllCategories)
+        response = self.get(getAllCategories, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.get(getAllCategories, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        Category.objects.create(name='Category3')
+        response = self.get(getAllCategories, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class ImportItemsAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        # imports and category deletes cost half a bucket each
+        throttling.reset_backend()
+        super().setUp()
+        Category.objects.create(name='Category1')
+        Item.objects.create(SKU='SKU1', name='Old name', category_id='Category1', stock_status='In Stock', available_stock=1)
+
+    def post(self, body, content_type, params=''):
+        return self.post_view(importItems, '/api/item-import/' + params, body, content_type=content_type)
+
+    def test_csv_upsert_with_row_errors(self):
+        body = (
+            'SKU,name,category,tags,stock_status,available_stock\n'
+            'SKU1,New name,Category1,,In Stock,5\n'
+            'SKU2,Item 2,Category2,"cotton,summer",Backordered,0\n'
+            'SKU3,Item 3,Category2,,Lost,1\n'
+            ',Item 4,Category2,,In Stock,x\n'
+        )
+        response = self.post(body, 'text/csv', '?batch_size=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [4, 5])
+        self.assertIn('stock_status', response.data['errors'][0]['errors'])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'SKU', 'available_stock'})
+
+        self.assertEqual(Item.objects.get(SKU='SKU1').name, 'New name')
+        self.assertEqual(list(get_search_backend().search(Item.objects.all(), 'new name').values_list('SKU', flat=True)), ['SKU1'])
+        item = Item.objects.get(SKU='SKU2')
+        self.assertEqual(item.category_id, 'Category2')
+        self.assertEqual(sorted(item.tag_set.values_list('name', flat=True)), ['cotton', 'summer'])
+
+    def test_jsonl(self):
+        body = (
+            '{"SKU": "SKU2", "name": "Item 2", "category": "Category1", "stock_status": "In Stock", "available_stock": 3}\n'
+            'not json\n'
+        )
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+        self.assertEqual(Item.objects.get(SKU='SKU2').available_stock, 3)
+
+    def test_upsert_bumps_versions_and_rollups(self):
+        body = (
+            'SKU,name,category,stock_status,available_stock\n'
+            'SKU1,Moved,Category2,Backordered,0\n'
+            'SKU2,Item 2,Category1,In Stock,4\n'
+        )
+        with mock.patch('api.rollups.recompute_categories') as recompute:
+            self.post(body, 'text/csv')
+        recompute.assert_not_called()
+        self.assertEqual(dict(Item.objects.values_list('SKU', 'version')), {'SKU1': 1, 'SKU2': 0})
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+
+    def test_lookups_are_chunked(self):
+        Item.objects.create(SKU='SKU2', name='Item 2', category_id='Category1', stock_status='In Stock', available_stock=2)
+        body = 'SKU,name,category,stock_status,available_stock\n' + ''.join(
+            f'SKU{i},Item {i},Category{i % 2 + 1},In Stock,{i}\n' for i in range(1, 5))
+        with mock.patch('api.batch.chunk_size', return_value=2), CaptureQueriesContext(connection) as queries:
+            response = self.post(body, 'text/csv')
+        self.assertEqual((response.data['created'], response.data['updated']), (2, 2))
+        self.assertEqual(dict(Item.objects.values_list('SKU', 'version')), {'SKU1': 1, 'SKU2': 1, 'SKU3': 0, 'SKU4': 0})
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+        lookups = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith(('SELECT', 'UPDATE')) and '"api_item"."SKU" IN' in query['sql']]
+        self.assertTrue(lookups)
+        self.assertFalse([sql for sql in lookups if "'SKU1'" in sql and "'SKU3'" in sql])
+
+    def test_import_invalidates_cached_list(self):
+        self.assertEqual(self.get_view(getAllItems, '/api/item-list/').data['count'], 1)
+        self.post('SKU,name,category,stock_status\nSKU2,Item 2,Category1,In Stock\n', 'text/csv')
+        self.assertEqual(self.get_view(getAllItems, '/api/item-list/').data['count'], 2)
+
+    def test_missing_file(self):
+        response = self.post({}, 'multipart/form-data; boundary=BoUnDaRyStRiNg')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportItemsAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category1 = Category.objects.create(name='Category1')
+        category2 = Category.objects.create(name='Category2')
+        Item.objects.create(SKU='SKU1', name='Item, "one"', category=category1, tags='a,b', stock_status='In Stock', available_stock=1)
+        Item.objects.create(SKU='SKU2', name='Item 2', category=category2, stock_status='Backordered', available_stock=0)
+        Item.objects.create(SKU='SKU3', name='Item 3', category=category1, stock_status='In Stock', available_stock=3)
+
+    def download(self, params, **headers):
+        return self.get_view(exportItems, '/api/item-export/', params, **headers)
+
+    def test_csv_matches_filters(self):
+        response = self.download({'category': 'Category1', 'order_by': '-available_stock'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['SKU', 'name', 'category', 'tags', 'stock_status', 'available_stock'])
+        self.assertEqual([row[0] for row in rows[1:]], ['SKU3', 'SKU1'])
+        self.assertEqual(rows[2][1], 'Item, "one"')
+
+    def test_ndjson_matches_serializer(self):
+        response = self.download({'export_format': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        expected = ItemSerializer(Item.objects.order_by('id'), many=True).data
+        self.assertEqual([json.loads(line) for line in lines], [dict(row) for row in expected])
+
+    @skipUnless(export.pyarrow, 'pyarrow is not installed')
+    def test_arrow_stream(self):
+        response = self.download({'export_format': 'arrow', 'stock_status': 'In Stock'})
+        table = export.pyarrow.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.column('SKU').to_pylist(), ['SKU1', 'SKU3'])
+        self.assertEqual(table.column('available_stock').to_pylist(), [1, 3])
+
+    def test_unknown_format(self):
+        response = self.download({'export_format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FastSerializerTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Catégorie \u2028 1')
+        Item.objects.create(SKU='SKU1', name='Plain', category=category, stock_status='In Stock', available_stock=10)
+        Item.objects.create(SKU='SKU2', name='Ünïcode "quoted" \\ \u2029 😀', category=category, tags='a,b',
+                            stock_status='Backordered', available_stock=-2)
+        Item.objects.create(SKU='SKU3', name='', category=category, tags='', stock_status='Out of Stock', available_stock=0)
+
+    def test_rows_match_model_serializer(self):
+        items = Item.objects.order_by('id')
+        serializer = ItemRowSerializer()
+        self.assertEqual(serializer.serialize(serializer.project(items)), ItemSerializer(items, many=True).data)
+        categories = Category.objects.all()
+        serializer = CategoryRowSerializer()
+        self.assertEqual(serializer.serialize(serializer.project(categories)), CategorySerializer(categories, many=True).data)
+
+    def test_rendered_bytes_match(self):
+        items = Item.objects.order_by('id')
+        serializer = ItemRowSerializer()
+        fast = FastJSONRenderer().render(serializer.serialize(serializer.project(items)))
+        expected = JSONRenderer().render(ItemSerializer(items, many=True).data)
+        self.assertEqual(fast, expected)
+
+    def test_endpoints_are_byte_compatible(self):
+        response = self.get_view(getAllItems, '/api/item-list/', {'order_by': 'SKU'}).render()
+        expected = JSONRenderer().render({
+            'count': 3, 'next': None, 'previous': None,
+            'results': ItemSerializer(Item.objects.order_by('SKU'), many=True).data,
+        })
+        self.assertEqual(response.content, expected)
+
+        response = self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU2'}).render()
+        self.assertEqual(response.content, JSONRenderer().render(ItemSerializer(Item.objects.get(SKU='SKU2')).data))
+
+
+class InventoryStatsTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        throttling.reset_backend()
+        super().setUp()
+        self.category1 = Category.objects.create(name='Category1')
+        self.category2 = Category.objects.create(name='Category2')
+        Item.objects.create(SKU='SKU1', name='Item 1', category=self.category1, stock_status='In Stock', available_stock=10)
+        Item.objects.create(SKU='SKU2', name='Item 2', category=self.category1, stock_status='In Stock', available_stock=2)
+        Item.objects.create(SKU='SKU3', name='Item 3', category=self.category2, stock_status='Out of Stock', available_stock=0)
+
+    def stats(self):
+        response = self.get_view(inventoryStats, '/api/inventory-stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assertMatchesItems(self):
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+
+    def test_stats_from_rollups(self):
+        with self.assertNumQueries(1):
+            data = rollups.inventory_stats()
+        self.assertEqual(data['total'], {'items': 3, 'available_stock': 12, 'low_stock': 2})
+        self.assertEqual(data['by_category'], [
+            {'category': 'Category1', 'items': 2, 'available_stock': 12, 'low_stock': 1},
+            {'category': 'Category2', 'items': 1, 'available_stock': 0, 'low_stock': 1},
+        ])
+        self.assertEqual(self.stats()['by_stock_status'], [
+            {'stock_status': 'In Stock', 'items': 2, 'available_stock': 12, 'low_stock': 1},
+            {'stock_status': 'Out of Stock', 'items': 1, 'available_stock': 0, 'low_stock': 1},
+        ])
+
+    def test_rollups_follow_writes(self):
+        item = Item.objects.get(SKU='SKU1')
+        item.available_stock = 1
+        item.save()
+        item.category = self.category2
+        item.stock_status = 'Backordered'
+        item.save()
+        Item.objects.get(SKU='SKU2').delete()
+        self.assertMatchesItems()
+        self.assertEqual(self.stats()['total'], {'items': 2, 'available_stock': 1, 'low_stock': 2})
+
+    def test_bulk_import_and_category_delete(self):
+        self.post_view(importItems, '/api/item-import/', 'SKU,name,category,stock_status,available_stock\n'
+                       'SKU2,Item 2,Category2,In Stock,40\nSKU4,Item 4,Category3,In Stock,4\n',
+                       content_type='text/csv')
+        self.assertMatchesItems()
+        self.category1.delete()
+        self.assertMatchesItems()
+        self.assertEqual(self.stats()['total'], {'items': 3, 'available_stock': 44, 'low_stock': 2})
+
+    def test_rebuild_reports_and_fixes_drift(self):
+        InventoryRollup.objects.filter(category=self.category1).update(item_count=7)
+        drift = rollups.rebuild()
+        self.assertEqual(len(drift), 1)
+        self.assertEqual(drift[0]['stored']['items'], 7)
+        self.assertEqual(drift[0]['actual']['items'], 2)
+        self.assertMatchesItems()
+
+
+class AdjustStockAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        Item.objects.create(SKU='SKU1', name='Item 1', category=category, stock_status='In Stock', available_stock=3)
+        Item.objects.create(SKU='SKU2', name='Item 2', category=category, stock_status='Out of Stock', available_stock=0)
+
+    def adjust(self, data):
+        return self.post_view(adjustStock, '/api/item-stock-adjust/', data)
+
+    def test_applies_deltas_and_derives_status(self):
+        response = self.adjust({'adjustments': [
+            {'SKU': 'SKU1', 'delta': -3},
+            {'SKU': 'SKU2', 'delta': 5},
+            {'SKU': 'SKU2', 'delta': -7},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], 3)
+        self.assertEqual([result['stock_status'] for result in response.data['results']],
+                         ['Out of Stock', 'In Stock', 'Backordered'])
+        item = Item.objects.get(SKU='SKU2')
+        self.assertEqual((item.available_stock, item.stock_status, item.version), (-2, 'Backordered', 2))
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+
+    def test_expected_version_conflict(self):
+        response = self.adjust([
+            {'SKU': 'SKU1', 'delta': 1, 'expected_version': 0},
+            {'SKU': 'SKU1', 'delta': 1, 'expected_version': 0},
+        ])
+        self.assertEqual([result['status'] for result in response.data['results']], ['ok', 'conflict'])
+        self.assertEqual(response.data['results'][1]['version'], 1)
+        self.assertEqual(Item.objects.get(SKU='SKU1').available_stock, 4)
+
+    def test_unknown_and_invalid_entries(self):
+        response = self.adjust([{'SKU': 'NOPE', 'delta': 1}, {'SKU': 'SKU1', 'delta': 'lots'}, {'delta': 1}])
+        self.assertEqual([result['status'] for result in response.data['results']], ['not_found', 'invalid', 'invalid'])
+        self.assertEqual(self.adjust({'adjustments': 'SKU1'}).status_code, 400)
+
+    def test_only_integer_deltas_and_versions(self):
+        entries = [{'SKU': 'SKU1', 'delta': 2.9}, {'SKU': 'SKU1', 'delta': True}, {'SKU': 'SKU1', 'delta': '5'},
+                   {'SKU': 'SKU1', 'delta': 1, 'expected_version': 0.0}, {'SKU': 'SKU1', 'delta': 1, 'expected_version': False}]
+        response = self.adjust(entries)
+        self.assertEqual({result['status'] for result in response.data['results']}, {'invalid'})
+        self.assertEqual(Item.objects.get(SKU='SKU1').version, 0)
+
+    def test_batch_size_limit(self):
+        response = self.adjust([{'SKU': f'SKU{n}', 'delta': 1} for n in range(batch.MAX_BATCH_SIZE + 1)])
+        self.assertEqual(response.status_code, 400)
+
+    def test_row_deleted_before_the_write_is_not_found(self):
+        read = stock._read
+
+        def read_then_delete(skus):
+            rows = read(skus)
+            Item.objects.filter(SKU='SKU1').delete()
+            return rows
+
+        with mock.patch('api.stock._read', side_effect=read_then_delete):
+            response = self.adjust([{'SKU': 'SKU1', 'delta': 1}])
+        self.assertEqual(response.data['results'], [{'SKU': 'SKU1', 'status': 'not_found'}])
+
+    def test_save_bumps_the_version(self):
+        item = Item.objects.get(SKU='SKU1')
+        item.name = 'Renamed'
+        item.save()
+        item.save(update_fields=['name'])
+        self.assertEqual(Item.objects.get(SKU='SKU1').version, 2)
+
+    def test_invalidates_cached_detail(self):
+        self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'})
+        self.adjust([{'SKU': 'SKU1', 'delta': 2}])
+        self.assertEqual(self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).data['available_stock'], 5)
+
+class AsyncReadViewsTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        category1 = Category.objects.create(name='Category1')
+        category2 = Category.objects.create(name='Category2')
+        for i in range(7):
+            Item.objects.create(SKU=f'SKU{i:03}', name=f'Item {i}', category=category1 if i % 2 else category2,
+                                tags='sale' if i % 3 else None, stock_status='In Stock', available_stock=i)
+
+    def compare(self, path, params=None):
+        # the async endpoint answers with the same bytes, links aside
+        expected = self.client.get(f'/api/{path}', params, **self.auth)
+        response = self.client.get(f'/api/async/{path}', params, **self.auth)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), expected.content)
+        return response
+
+    def test_item_list_matches_sync_view(self):
+        self.compare('item-list/')
+        self.compare('item-list/', {'page': 2})
+        self.compare('item-list/', {'page': 'last', 'order_by': '-available_stock'})
+        self.compare('item-list/', {'category': 'Category1', 'tag': 'sale'})
+        self.compare('item-list/', {'search': 'Item'})
+        self.compare('item-list/', {'category': 'missing'})
+        self.compare('item-list/', {'page': 9})
+
+    def test_item_list_cursor_mode(self):
+        response = self.compare('item-list/', {'pagination': 'cursor', 'page_size': 3})
+        following = self.client.get(response.json()['next'], **self.auth)
+        self.assertEqual([item['SKU'] for item in following.json()['results']], ['SKU003', 'SKU004', 'SKU005'])
+        self.compare('item-list/', {'cursor': 'not-a-cursor'})
+
+    def test_item_detail_and_categories_match_sync_views(self):
+        self.compare('item-detail/', {'SKU': 'SKU003'})
+        self.compare('item-detail/', {'SKU': 'missing'})
+        self.compare('item-detail/')
+        self.compare('category-list/')
+
+    def test_authentication(self):
+        response = self.client.get('/api/async/item-list/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        response = self.client.get('/api/async/authentication/testtoken', HTTP_AUTHORIZATION='Token wrong')
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+        response = self.client.get('/api/async/authentication/testtoken', **self.auth)
+        self.assertEqual(response.json(), 'passed!')
+        response = self.client.post('/api/async/item-list/', **self.auth)
+        self.assertEqual(response.status_code, 405)
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise SMTPException('mailbox unavailable')
+
+
+@override_settings(MAIL_QUEUE={'BACKOFF': 60, 'MAX_ATTEMPTS': 2, 'RATE_LIMIT': 0})
+class MailQueueTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        User.objects.create(username='test_user', email='user@example.com')
+
+    def forgot_password(self, email):
+        request = self.factory.post('/api/authentication/forgot-password', {'email': email}, format='json')
+        return forgot_password(request)
+
+    def test_forgot_password_queues_instead_of_sending(self):
+        self.assertEqual(self.forgot_password('user@example.com').status_code, 200)
+        self.assertEqual(self.forgot_password('nobody@example.com').status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual((queued.to, queued.status), ('user@example.com', OutboundEmail.PENDING))
+
+        self.assertEqual(MailQueue().drain(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('reset-password', mail.outbox[0].body)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.SENT)
+
+    def test_failures_back_off_then_give_up(self):
+        mailqueue.enqueue('Subject', 'Body', 'from@example.com', ['user@example.com'])
+        queue = MailQueue()
+        with self.settings(EMAIL_BACKEND='api.tests.FailingEmailBackend'):
+            self.assertEqual(queue.drain(), (0, 1))
+            message = OutboundEmail.objects.get()
+            self.assertEqual((message.status, message.attempts), (OutboundEmail.PENDING, 1))
+            self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=50))
+            self.assertIn('mailbox unavailable', message.last_error)
+            # not due yet
+            self.assertEqual(queue.drain(), (0, 0))
+
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(queue.drain(), (0, 1))
+            self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.FAILED)
+
+    def test_reclaims_abandoned_messages_and_batches(self):
+        for i in range(3):
+            mailqueue.enqueue(f'Subject {i}', 'Body', 'from@example.com', ['user@example.com'])
+        OutboundEmail.objects.filter(subject='Subject 0').update(
+            status=OutboundEmail.SENDING, claimed_at=timezone.now() - timedelta(hours=1))
+        with self.settings(MAIL_QUEUE={'BATCH_SIZE': 2, 'RATE_LIMIT': 0}):
+            queue = MailQueue()
+            self.assertEqual(len(queue.claim()), 2)
+            self.assertEqual(len(queue.claim()), 1)
+            self.assertEqual(queue.claim(), [])
+
+    def test_outcome_needs_the_claim(self):
+        mailqueue.enqueue('Subject', 'Body', 'from@example.com', ['user@example.com'])
+        queue = MailQueue()
+        message, = queue.claim()
+        # the claim timed out and another worker took the message over
+        OutboundEmail.objects.update(claim_token='other-worker')
+        with self.assertLogs('api.mailqueue', 'WARNING'):
+            self.assertFalse(queue.sent(message))
+            self.assertFalse(queue.failed(message, OSError('mailbox unavailable')))
+        stored = OutboundEmail.objects.get()
+        self.assertEqual((stored.status, stored.claim_token, stored.attempts), (OutboundEmail.SENDING, 'other-worker', 0))
+
+class BatchItemFetchAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        for i in range(5):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Item {i}', category=category,
+                                stock_status='In Stock', available_stock=i)
+
+    def fetch(self, method, *args, **kwargs):
+        return self.call_view(getItems, method, '/api/item-batch/', *args, **kwargs)
+
+    def test_keeps_input_order_and_marks_missing(self):
+        response = self.fetch('post', {'SKUs': ['SKU3', 'NOPE', 'SKU0', 'SKU3']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['SKU'] for result in response.data['results']], ['SKU3', 'NOPE', 'SKU0', 'SKU3'])
+        self.assertEqual([result['status'] for result in response.data['results']], ['ok', 'not_found', 'ok', 'ok'])
+        self.assertEqual(response.data['results'][0]['item']['available_stock'], 3)
+        self.assertEqual((response.data['found'], response.data['missing']), (3, ['NOPE']))
+
+    def test_get_forms(self):
+        response = self.fetch('get', {'SKU': ['SKU1', 'SKU2']})
+        self.assertEqual([result['status'] for result in response.data['results']], ['ok', 'ok'])
+        response = self.fetch('get', {'SKUs': 'SKU4,SKU9'})
+        self.assertEqual(response.data['missing'], ['SKU9'])
+
+    def test_queries_in_chunks(self):
+        skus = [f'SKU{i}' for i in range(5)]
+        with mock.patch('api.batch.DEFAULT_CHUNK_SIZE', 2), self.assertNumQueries(3):
+            response = self.fetch('post', skus, format='json')
+        self.assertEqual(response.data['found'], 5)
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.fetch('get').status_code, 400)
+        self.assertEqual(self.fetch('post', {'SKUs': [1, 2]}, format='json').status_code, 400)
+        self.assertEqual(self.fetch('post', {'SKUs': ['A'] * 1001}, format='json').status_code, 400)
+
+class BulkItemWriteAPITest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category1 = Category.objects.create(name='Category1')
+        Category.objects.create(name='Category2')
+        for i in range(6):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Item {i}', category=self.category1, tags='cotton',
+                                stock_status='In Stock', available_stock=10 + i)
+
+    def list_items(self, **params):
+        return self.get_view(getAllItems, '/api/item-list/', params)
+
+    def test_bulk_update(self):
+        self.assertEqual(self.list_items(category='Category2').status_code, 404)
+        response = self.post_view(bulkUpdateItems, '/api/item-bulk-update/', {'items': [
+            {'SKU': 'SKU0', 'category': 'Category2', 'tags': 'wool,sale'},
+            {'SKU': 'SKU1', 'available_stock': 0, 'stock_status': 'Out of Stock', 'expected_version': 0},
+            {'SKU': 'SKU2', 'name': 'Renamed', 'expected_version': 3},
+            {'SKU': 'SKU3', 'category': 'Nope'},
+            {'SKU': 'NOPE', 'name': 'x'},
+            {'SKU': 'SKU4', 'available_stock': 'lots'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['ok', 'ok', 'conflict', 'invalid', 'not_found', 'invalid'])
+        self.assertEqual(response.data['updated'], 2)
+        item = Item.objects.get(SKU='SKU1')
+        self.assertEqual((item.available_stock, item.stock_status, item.version), (0, 'Out of Stock', 1))
+        self.assertEqual(Item.objects.get(SKU='SKU2').name, 'Item 2')
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+        self.assertEqual([row['SKU'] for row in self.list_items(tag='sale').data['results']], ['SKU0'])
+        self.assertEqual(self.list_items(category='Category2').data['count'], 1)
+
+    def test_bulk_delete(self):
+        self.assertEqual(self.list_items().data['count'], 6)
+        # one select, the cascade, the delete, one rollup update and one change
+        # log insert, however many rows
+        with self.assertNumQueries(8):
+            response = self.post_view(bulkDeleteItems, '/api/item-bulk-delete/', {'SKUs': ['SKU0', 'NOPE', 'SKU1', 'SKU2']})
+        self.assertEqual([result['status'] for result in response.data['results']], ['ok', 'not_found', 'ok', 'ok'])
+        self.assertEqual(response.data['deleted'], 3)
+        self.assertEqual(set(Item.objects.values_list('SKU', flat=True)), {'SKU3', 'SKU4', 'SKU5'})
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+        self.assertEqual(self.list_items().data['count'], 3)
+        self.assertEqual(self.list_items(search='Item').data['count'], 3)
+
+    def test_bulk_signal_handlers_run_inside_bulk_writes(self):
+        # bulk_item_writes only silences the per-row handlers
+        backend = mock.Mock()
+        with mock.patch('api.signals.get_search_backend', return_value=backend), signals.bulk_item_writes():
+            signals.bulk_unindex_items(sender=Item, ids=[1, 2])
+        backend.remove.assert_called_with([1, 2])
+
+    def test_nested_bulk_writes_stay_silenced(self):
+        backend = mock.Mock()
+        with mock.patch('api.signals.get_search_backend', return_value=backend), signals.bulk_item_writes():
+            with signals.bulk_item_writes():
+                pass
+            Item.objects.get(SKU='SKU1').save()
+        backend.index.assert_not_called()
+        self.assertEqual(ChangeLog.objects.filter(key='SKU1').count(), 1)
+
+    def test_rejects_bad_bodies(self):
+        self.assertEqual(self.post_view(bulkUpdateItems, '/api/item-bulk-update/', {'items': 'SKU1'}).status_code, 400)
+        self.assertEqual(self.post_view(bulkDeleteItems, '/api/item-bulk-delete/', {'SKUs': []}).status_code, 400)
+
+@override_settings(CATEGORY_DELETION={'BATCH_SIZE': 2, 'PAUSE': 0, 'RUN_IN_THREAD': False})
+class CategoryDeletionTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        throttling.reset_backend()
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        Category.objects.create(name='Category2')
+        for i in range(5):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Item {i}', category=category, tags='sale',
+                                stock_status='In Stock', available_stock=i)
+        Item.objects.create(SKU='OTHER', name='Other', category_id='Category2', stock_status='In Stock', available_stock=1)
+
+    def call(self, view, method, params):
+        return self.call_view(view, method, f'/api/{view.__name__}/?' + '&'.join(f'{k}={v}' for k, v in params.items()))
+
+    def test_deletes_in_the_background(self):
+        response = self.call(delete_category, 'delete', {'category': 'Category1'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['total_items']), ('queued', 5))
+        self.assertEqual(Item.objects.filter(category_id='Category1').count(), 5)
+        # asking again returns the same job
+        self.assertEqual(self.call(delete_category, 'delete', {'category': 'Category1'}).data['job'], response.data['job'])
+
+        self.assertTrue(category_deletion.run_deletion(response.data['job']))
+        status_response = self.call(categoryDeletionStatus, 'get', {'job': response.data['job']})
+        self.assertEqual((status_response.data['status'], status_response.data['deleted_items']), ('done', 5))
+        self.assertFalse(Category.objects.filter(name='Category1').exists())
+        self.assertEqual(list(Item.objects.values_list('SKU', flat=True)), ['OTHER'])
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+        self.assertEqual(self.call(cancelCategoryDeletion, 'post', {'job': response.data['job']}).status_code, 409)
+
+    def test_cancel_stops_between_batches(self):
+        job_id = self.call(delete_category, 'delete', {'category': 'Category1'}).data['job']
+
+        def cancel(seconds):
+            self.assertEqual(self.call(cancelCategoryDeletion, 'post', {'job': job_id}).data['status'], 'cancelled')
+
+        with mock.patch('api.category_deletion.time.sleep', side_effect=cancel):
+            category_deletion.run_deletion(job_id)
+        job = CategoryDeletion.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.deleted_items), ('cancelled', 2))
+        self.assertEqual(Item.objects.filter(category_id='Category1').count(), 3)
+        self.assertTrue(Category.objects.filter(name='Category1').exists())
+        self.assertEqual(rollups.rebuild(dry_run=True), [])
+        # a cancelled job is not picked up again
+        self.assertEqual(category_deletion.pending_jobs(), [])
+
+    def test_unknown_jobs_and_categories(self):
+        self.assertEqual(self.call(delete_category, 'delete', {'category': 'Nope'}).status_code, 404)
+        self.assertEqual(self.call(categoryDeletionStatus, 'get', {'job': 999}).status_code, 404)
+        self.assertEqual(self.call(categoryDeletionStatus, 'get', {'job': 'x'}).status_code, 404)
+
+class InstrumentationTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        metrics.reset()
+        super().setUp()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        category = Category.objects.create(name='Category1')
+        Item.objects.create(SKU='SKU1', name='Item 1', category=category, stock_status='In Stock', available_stock=1)
+
+    def series(self, histogram, *labels):
+        return histogram.snapshot().get(labels)
+
+    def test_records_latency_queries_render_and_size(self):
+        response = self.client.get('/api/item-list/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        _, total, count = self.series(metrics.request_duration, 'api/item-list/', 'GET', '200')
+        self.assertEqual(count, 1)
+        self.assertGreater(total, 0)
+        # the count and the page
+        self.assertGreaterEqual(self.series(metrics.db_queries, 'api/item-list/', 'GET')[1], 2)
+        self.assertGreater(self.series(metrics.render_duration, 'api/item-list/', 'GET')[1], 0)
+        self.assertEqual(self.series(metrics.response_size, 'api/item-list/', 'GET')[1], len(response.content))
+
+    def test_counts_queries_of_async_views(self):
+        self.client.get('/api/async/item-detail/', {'SKU': 'SKU1'}, **self.auth)
+        self.assertGreaterEqual(self.series(metrics.db_queries, 'api/async/item-detail/', 'GET')[1], 1)
+        self.assertGreater(self.series(metrics.render_duration, 'api/async/item-detail/', 'GET')[1], 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/item-detail/', {'SKU': 'SKU1'}, **self.auth)
+        response = self.client.get('/api/metrics/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE api_request_duration_seconds histogram', text)
+        self.assertIn('api_request_duration_seconds_count{endpoint="api/item-detail/",method="GET",status="200"} 1', text)
+        self.assertIn('api_request_db_queries_bucket{endpoint="api/item-detail/",method="GET",le="+Inf"} 1', text)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+
+    def test_logs_slow_requests_with_queries(self):
+        with self.settings(INSTRUMENTATION={'SLOW_REQUEST_MS': 0}), self.assertLogs('api.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/item-detail/', {'SKU': 'SKU1'}, **self.auth)
+        self.assertIn('GET /api/item-detail/?SKU=SKU1', logs.output[0])
+        self.assertIn('FROM "api_item"', logs.output[0])
+
+class BenchmarkComparisonTest(TestCase):
+    def test_summarize(self):
+        result = benchmarking.summarize([0.001 * i for i in range(1, 101)], 2.0, 3)
+        self.assertEqual((result['requests'], result['throughput_rps']), (100, 50.0))
+        self.assertEqual((result['p50_ms'], result['p99_ms'], result['queries']), (50.0, 99.0, 3))
+
+    def test_flags_slower_p50_and_extra_queries(self):
+        baseline = {
+            '10000/item-list': {'p50_ms': 4.0, 'queries': 2},
+            '10000/item-detail': {'p50_ms': 2.0, 'queries': 1},
+            '10000/item-create': {'p50_ms': 8.0, 'queries': 5},
+        }
+        results = {
+            '10000/item-list': {'p50_ms': 4.3, 'queries': 2},
+            '10000/item-detail': {'p50_ms': 2.0, 'queries': 2},
+            '10000/item-create': {'p50_ms': 9.0, 'queries': 5},
+            '10000/new-scenario': {'p50_ms': 1.0, 'queries': 1},
+        }
+        rows = {row['scenario']: row for row in benchmarking.compare(results, baseline, 0.10)}
+        self.assertEqual(set(rows), set(baseline))
+        self.assertFalse(rows['10000/item-list']['regression'])
+        self.assertTrue(rows['10000/item-detail']['regression'])
+        self.assertTrue(rows['10000/item-create']['regression'])
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite PRAGMAs')
+class DatabaseTuningTest(TestCase):
+    def open(self):
+        # a second connection to a file database, set up like any new connection
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        wrapper = connection.copy()
+        wrapper.settings_dict['NAME'] = path
+        self.addCleanup(lambda: [os.path.exists(name) and os.unlink(name)
+                                 for name in (path, path + '-wal', path + '-shm')])
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    @override_settings(DATABASE_TUNING={'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -2000, 'busy_timeout': 1234}})
+    def test_new_connections_are_tuned(self):
+        wrapper = self.open()
+        # stored in the file: opening a database must not rewrite it
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        db.set_journal_mode(wrapper)
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -2000)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 1234)
+
+    @override_settings(DATABASE_TUNING={'SQLITE_PRAGMAS': {'journal_mode': None}})
+    def test_pragmas_can_be_skipped(self):
+        self.assertEqual(self.pragma(self.open(), 'journal_mode'), 'delete')
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'copies the primary with VACUUM INTO')
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 60, 'MAX_LAG': 5,
+                                  'LAG_FUNCTION': 'api.tests.replica_lag', 'SINGLE_PROCESS': True})
+class ReplicaRoutingTest(TransactionTestCase):
+    """Two SQLite files: the test database as primary and a stale copy of it as replica."""
+
+    def setUp(self):
+        replicas.reset_lags()
+        REPLICA_LAG['replica'] = 0
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(username='reader')
+        self.other = User.objects.create(username='other')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.user).key}'}
+        self.other_auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.other).key}'}
+        category = Category.objects.create(name='Category1')
+        Item.objects.create(SKU='SKU1', name='Item 1', category=category, stock_status='In Stock', available_stock=1)
+
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        os.unlink(path)
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [path])
+        replica = connection.copy('replica')
+        replica.settings_dict['NAME'] = path
+        connections['replica'] = replica
+        self.addCleanup(self.drop_replica, path)
+        # the replica falls behind: it never sees this item
+        Item.objects.create(SKU='SKU2', name='Item 2', category=category, stock_status='In Stock', available_stock=2)
+
+    def drop_replica(self, path):
+        connections['replica'].close()
+        del connections['replica']
+        for name in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(name):
+                os.unlink(name)
+
+    def count(self, auth):
+        response = self.client.get('/api/item-list/', **auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['count']
+
+    def test_list_endpoints_read_from_the_replica(self):
+        self.assertEqual(self.count(self.auth), 1)
+        # not marked: reads the primary
+        self.assertEqual(self.client.get('/api/item-detail/', {'SKU': 'SKU2'}, **self.auth).status_code, 200)
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        response = self.client.post('/api/item-create/', {
+            'SKU': 'SKU3', 'name': 'Item 3', 'category': 'Category1',
+            'stock_status': 'In Stock', 'available_stock': 3}, **self.auth)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Item.objects.using('replica').filter(SKU='SKU3').exists())
+        self.assertEqual(self.count(self.other_auth), 1)
+        # the replica answer cached for other users is not served to the writer
+        self.assertEqual(self.count(self.auth), 3)
+
+    def test_lagging_or_unreachable_replica_falls_back_to_primary(self):
+        REPLICA_LAG['replica'] = 30
+        self.assertEqual(self.count(self.auth), 2)
+        replicas.reset_lags()
+        response_cache.get_cache().clear()
+        REPLICA_LAG['replica'] = None
+        with self.assertLogs('api.replicas', 'WARNING'):
+            self.assertEqual(self.count(self.auth), 2)
+
+    def test_process_local_sticky_markers_keep_reads_on_the_primary(self):
+        config = {**replicas.get_config(), 'SINGLE_PROCESS': False}
+        with override_settings(READ_REPLICAS=config):
+            self.assertEqual(self.count(self.auth), 2)
+            self.assertEqual([error.id for error in replicas.check_sticky_cache()], ['api.W002'])
+        self.assertEqual(replicas.check_sticky_cache(), [])
+
+
+REPLICA_LAG = {}
+
+
+def replica_lag(alias):
+    lag = REPLICA_LAG[alias]
+    if lag is None:
+        raise ConnectionError(f'{alias} is down')
+    return lag
+
+
+
+@override_settings(CHANGE_FEED={'HEARTBEAT': 0.05, 'QUEUE_SIZE': 3, 'BUFFER_SIZE': 5})
+class ChangeFeedTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        changefeed.reset_hub()
+        self.addCleanup(changefeed.reset_hub)
+        self.hub = changefeed.get_hub()
+        super().setUp()
+        self.category = Category.objects.create(name='Category1')
+
+    def published(self, hub=None):
+        hub = hub or self.hub
+        return [(event.type, event.data.get('SKU')) for event in hub._buffer]
+
+    def test_writes_publish_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(SKU='SKU1', name='Item 1', category=self.category,
+                                stock_status='In Stock', available_stock=5)
+            # nothing goes out before the commit
+            self.assertEqual(self.published(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_view(adjustStock, '/api/item-stock-adjust/', [{'SKU': 'SKU1', 'delta': -5}])
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_view(bulkDeleteItems, '/api/item-bulk-delete/', {'SKUs': ['SKU1']})
+        self.assertEqual(self.published(), [('item.created', 'SKU1'), ('item.updated', 'SKU1'), ('item.deleted', 'SKU1')])
+        adjusted = list(self.hub._buffer)[1]
+        self.assertEqual((adjusted.data['available_stock'], adjusted.data['stock_status']), (0, 'Out of Stock'))
+        self.assertEqual(adjusted.categories, {'Category1'})
+
+    def test_filters_and_resume(self):
+        async def scenario():
+            hub = changefeed.LocalHub()
+            first = hub.publish('item.updated', {'SKU': 'A'}, {'Shirts'})
+            hub.publish('item.updated', {'SKU': 'B'}, {'Hats'})
+            hub.publish('item.deleted', {'SKU': 'C'}, {'Shirts'})
+            shirts = changefeed.EventFilter(categories=['Shirts'])
+            _, backlog, reset = hub.subscribe(shirts, (hub.epoch, first.seq))
+            self.assertFalse(reset)
+            self.assertEqual([event.data['SKU'] for event in backlog], ['C'])
+            # another process's ids, or ids older than the buffer, can't be resumed
+            self.assertTrue(hub.subscribe(shirts, ('0ther', 1))[2])
+            for sku in 'DEFGH':
+                hub.publish('item.updated', {'SKU': sku}, {'Shirts'})
+            self.assertTrue(hub.subscribe(shirts, (hub.epoch, first.seq))[2])
+            subscription, _, _ = hub.subscribe(changefeed.EventFilter(skus=['I'], types=['item.updated']))
+            hub.publish('item.deleted', {'SKU': 'I'}, {'Shirts'})
+            hub.publish('item.updated', {'SKU': 'I'}, {'Shirts'})
+            batch = await subscription.next_batch(1)
+            self.assertEqual([(event.type, event.data['SKU']) for event in batch], [('item.updated', 'I')])
+        asyncio.run(scenario())
+
+    def test_slow_subscriber_stream_ends(self):
+        async def scenario():
+            hub = changefeed.LocalHub()
+            subscription, backlog, reset = hub.subscribe(changefeed.EventFilter())
+            for sku in 'ABCDE':
+                hub.publish('item.updated', {'SKU': sku}, {'Shirts'})
+            with self.assertLogs('api.changefeed', 'INFO'):
+                chunks = [chunk async for chunk in changefeed.stream(subscription, backlog, reset, 0.05)]
+            self.assertEqual(b''.join(chunks).count(b'event: item.updated'), 3)
+            self.assertEqual(hub.subscriber_count, 0)
+        asyncio.run(scenario())
+
+    async def test_stream_endpoint(self):
+        first = self.hub.publish('item.updated', {'SKU': 'SKU1', 'category': 'Category1'}, {'Category1'})
+        self.hub.publish('item.updated', {'SKU': 'SKU2', 'category': 'Other'}, {'Other'})
+        self.hub.publish('item.deleted', {'SKU': 'SKU3', 'category': 'Category1'}, {'Category1'})
+        response = await AsyncClient().get(
+            '/api/async/changes/', {'category': 'Category1'},
+            headers={'Authorization': f'Token {self.token.key}', 'Last-Event-ID': f'{self.hub.epoch}:{first.seq}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''
+        async for chunk in response.streaming_content:
+            body += chunk
+            if b'keep-alive' in body:
+                break
+        await response.streaming_content.aclose()
+        response = await AsyncClient().get('/api/async/changes/', {'type': 'item.moved'},
+                                           headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'id: {self.hub.epoch}:3\nevent: item.deleted\ndata: {{"SKU":"SKU3","category":"Category1"}}'.encode(), body)
+        self.assertNotIn(b'SKU2', body)
+
+    async def test_stream_token(self):
+        client = AsyncClient()
+        response = await client.post('/api/async/changes/token/', headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 200)
+        stream_token = json.loads(response.content)['stream_token']
+        self.hub.publish('item.updated', {'SKU': 'SKU1'}, {'Category1'})
+        # EventSource can't send headers: the token rides in the query string
+        response = await client.get('/api/async/changes/', {'stream_token': stream_token, 'last_event_id': f'{self.hub.epoch}:0'})
+        self.assertEqual(response.status_code, 200)
+        body = b''
+        async for chunk in response.streaming_content:
+            body += chunk
+            if b'keep-alive' in body:
+                break
+        await response.streaming_content.aclose()
+        self.assertIn(b'event: item.updated', body)
+        # only the stream takes it, and only while it is fresh
+        response = await client.get('/api/async/item-list/', {'stream_token': stream_token})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual((await client.get('/api/async/changes/', {'stream_token': 'forged'})).status_code, 401)
+        self.assertEqual((await client.post('/api/async/changes/token/')).status_code, 401)
+        with override_settings(CHANGE_FEED={'STREAM_TOKEN_TTL': -1}):
+            response = await client.get('/api/async/changes/', {'stream_token': stream_token})
+        self.assertEqual(response.status_code, 401)
+
+    def test_stream_needs_asgi(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.assertEqual(self.client.get('/api/async/changes/', **auth).status_code, 501)
+        self.assertEqual(self.client.get('/api/async/changes/').status_code, 401)
+
+
+class ChangeLogSyncTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Category1')
+        for i in range(3):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Item {i}', category=self.category,
+                                stock_status='In Stock', available_stock=5)
+
+    def sync(self, **params):
+        return self.get_view(syncItems, '/api/item-sync/', params)
+
+    def test_first_sync_resets(self):
+        response = self.sync()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'reset': True, 'watermark': changelog.current_watermark(), 'more': False})
+        self.assertEqual(self.sync(since='soon').status_code, 400)
+        self.assertEqual(self.sync(since=-1).status_code, 400)
+
+    def test_changes_since_watermark(self):
+        watermark = self.sync().data['watermark']
+        item = Item.objects.get(SKU='SKU0')
+        item.available_stock = 0
+        item.save()
+        Item.objects.create(SKU='SKU9', name='Item 9', category=self.category,
+                            stock_status='In Stock', available_stock=1)
+        Item.objects.get(SKU='SKU9').delete()
+        renamed = Item.objects.get(SKU='SKU1')
+        renamed.SKU = 'SKU1-B'
+        renamed.save()
+        Category.objects.create(name='Category2')
+        response = self.sync(since=watermark)
+        self.assertFalse(response.data['reset'])
+        self.assertFalse(response.data['more'])
+        # each key once, as it is now
+        self.assertEqual([(row['SKU'], row['available_stock']) for row in response.data['items']['upserted']],
+                         [('SKU0', 0), ('SKU1-B', 5)])
+        self.assertEqual(response.data['items']['deleted'], ['SKU1', 'SKU9'])
+        self.assertEqual(response.data['categories'], {'upserted': ['Category2'], 'deleted': []})
+        # nothing new since
+        response = self.sync(since=response.data['watermark'])
+        self.assertEqual(response.data['items'], {'upserted': [], 'deleted': []})
+        self.assertEqual(response.data['watermark'], changelog.current_watermark())
+
+    def test_batches(self):
+        watermark = 0
+        synced = []
+        while True:
+            response = self.sync(since=watermark, limit=2)
+            synced += [row['SKU'] for row in response.data['items']['upserted']]
+            watermark = response.data['watermark']
+            if not response.data['more']:
+                break
+        self.assertEqual(sorted(synced), ['SKU0', 'SKU1', 'SKU2'])
+        self.assertEqual(watermark, changelog.current_watermark())
+
+    def test_reads_state_in_chunks(self):
+        # the horizon, the log rows, two chunks of items and one of categories
+        with mock.patch('api.batch.DEFAULT_CHUNK_SIZE', 2), self.assertNumQueries(5):
+            response = self.sync(since=0)
+        self.assertEqual([row['SKU'] for row in response.data['items']['upserted']], ['SKU0', 'SKU1', 'SKU2'])
+        self.assertEqual(response.data['categories']['upserted'], ['Category1'])
+
+    def test_postgresql_writers_take_the_log_lock(self):
+        pg = mock.MagicMock(vendor='postgresql')
+        with mock.patch.object(changelog, 'connection', pg):
+            changelog.record(ChangeLog.ITEM, ChangeLog.UPSERT, ['SKU0'])
+        pg.cursor.return_value.__enter__.return_value.execute.assert_called_once_with(
+            'SELECT pg_advisory_xact_lock(%s)', [changelog.ADVISORY_LOCK_KEY])
+
+    def test_bulk_writes_are_logged(self):
+        watermark = changelog.current_watermark()
+        self.post_view(bulkUpdateItems, '/api/item-bulk-update/', {'items': [{'SKU': 'SKU0', 'available_stock': 1}]})
+        self.post_view(bulkDeleteItems, '/api/item-bulk-delete/', {'SKUs': ['SKU2']})
+        self.post_view(adjustStock, '/api/item-stock-adjust/', [{'SKU': 'SKU1', 'delta': -5}])
+        response = self.sync(since=watermark)
+        self.assertEqual([row['SKU'] for row in response.data['items']['upserted']], ['SKU0', 'SKU1'])
+        self.assertEqual(response.data['items']['deleted'], ['SKU2'])
+
+    def test_compaction(self):
+        watermark = self.sync().data['watermark']
+        for stock in range(3):
+            Item.objects.filter(SKU='SKU0').update(available_stock=stock)
+            item = Item.objects.get(SKU='SKU0')
+            item.save()
+        before = self.sync(since=watermark).data
+        self.assertEqual(changelog.compact(retention_days=None), (3, 0))
+        self.assertEqual(self.sync(since=watermark).data, before)
+
+        # a week on, with a three day retention, the log is gone
+        now = timezone.now() + timedelta(days=7)
+        Item.objects.create(SKU='SKU8', name='Item 8', category=self.category,
+                            stock_status='In Stock', available_stock=1)
+        ChangeLog.objects.filter(key='SKU8').update(created_at=now)
+        self.assertEqual(changelog.compact(retention_days=3, now=now), (0, 4))
+        self.assertEqual(ChangeLogCompaction.objects.count(), 1)
+        self.assertTrue(self.sync(since=watermark).data['reset'])
+        response = self.sync(since=changelog.horizon())
+        self.assertFalse(response.data['reset'])
+        self.assertEqual([row['SKU'] for row in response.data['items']['upserted']], ['SKU8'])
+
+
+@override_settings(THROTTLING={'RATE': 1, 'BURST': 10, 'COSTS': {'search': 5, 'export': 20}})
+class ThrottlingTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        throttling.reset_backend()
+        self.addCleanup(throttling.reset_backend)
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        Item.objects.create(SKU='SKU1', name='Summer shirt', category=category,
+                            stock_status='In Stock', available_stock=5)
+
+    def test_search_costs_more(self):
+        for _ in range(2):
+            self.assertEqual(self.get_view(getAllItems, '/api/item-list/', {'search': 'summer'}).status_code, 200)
+        response = self.get_view(getAllItems, '/api/item-list/', {'search': 'summer'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response['Retry-After'], ('4', '5'))
+        # the bucket is this user's, for this endpoint
+        other = User.objects.create(username='other_user')
+        self.assertEqual(self.get_view(getAllItems, '/api/item-list/', {'search': 'summer'}, user=other).status_code, 200)
+        self.assertEqual(self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).status_code, 200)
+
+    def test_plain_requests_cost_one(self):
+        statuses = [self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).status_code for _ in range(11)]
+        self.assertEqual(statuses, [200] * 10 + [429])
+
+    def test_expensive_operation_capped_at_burst(self):
+        self.assertEqual(self.get_view(exportItems, '/api/item-export/', {}).status_code, 200)
+        self.assertEqual(self.get_view(exportItems, '/api/item-export/', {}).status_code, 429)
+
+    def test_buckets_refill(self):
+        buckets = throttling.LocalBuckets({'MAX_KEYS': 2})
+        with mock.patch('api.throttling.time.monotonic', side_effect=[0, 0, 1, 4, 4, 4]):
+            self.assertEqual(buckets.take('a', 3, 1, 3), 0)
+            self.assertEqual(buckets.take('a', 3, 1, 3), 3)
+            self.assertEqual(buckets.take('a', 3, 1, 3), 2)
+            self.assertEqual(buckets.take('a', 3, 1, 3), 0)
+        buckets = throttling.LocalBuckets({'MAX_KEYS': 2})
+        with mock.patch('api.throttling.time.monotonic', side_effect=[0, 1, 2, 2.5]):
+            buckets.take('a', 3, 1, 3)
+            buckets.take('b', 1, 1, 3)
+            buckets.take('c', 1, 1, 3)
+            # over MAX_KEYS: b has refilled, so it goes
+            self.assertEqual(set(buckets._buckets), {'a', 'c'})
+            buckets.take('d', 3, 1, 3)
+            # none has refilled: the least recently used go
+            self.assertEqual(set(buckets._buckets), {'c', 'd'})
+
+    @override_settings(THROTTLING={'BACKEND': 'api.throttling.CacheBuckets', 'RATE': 1, 'BURST': 2})
+    def test_cache_backend(self):
+        statuses = [self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # another worker sees the same bucket
+        throttling.reset_backend()
+        self.assertEqual(self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).status_code, 429)
+
+    async def test_async_views_share_the_buckets(self):
+        auth = {'Authorization': f'Token {self.token.key}'}
+        await sync_to_async(self.get_view)(getAllItems, '/api/item-list/', {'search': 'summer'})
+        response = await AsyncClient().get('/api/async/item-list/', {'search': 'summer'}, headers=auth)
+        self.assertEqual(response.status_code, 200)
+        response = await AsyncClient().get('/api/async/item-list/', {'search': 'summer'}, headers=auth)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response['Retry-After'], ('4', '5'))
+        self.assertIn('throttled', response.json()['detail'])
+
+    def test_loadtest_fails_when_mostly_throttled(self):
+        out = io.StringIO()
+        run = mock.AsyncMock(return_value=([1.0] * 10, {200: 4, 429: 6}, 0, 1.0))
+        with mock.patch.object(LoadTestCommand, 'run', run), self.assertRaisesMessage(CommandError, 'API_THROTTLING=off'):
+            call_command('loadtest', stdout=out)
+        self.assertIn('429: 6', out.getvalue())
+        run.return_value = ([1.0] * 10, {200: 9, 429: 1}, 0, 1.0)
+        with mock.patch.object(LoadTestCommand, 'run', run):
+            call_command('loadtest', stdout=out)
+
+
+@override_settings(RESPONSE_CACHE_ALIAS='query-count-off', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'query-count-off': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class ReadQueryCountTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Category1')
+        for i in range(7):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Summer item {i}', category=self.category,
+                                tags='cotton', stock_status='In Stock', available_stock=i)
+
+    def call(self, view, path, params=None, data=None):
+        if data is None:
+            return self.get_view(view, path, params)
+        return self.post_view(view, path, data)
+
+    def test_item_list(self):
+        # the count, then the page
+        for params in ({}, {'category': 'Category1'}, {'stock_status': 'In Stock', 'page': 2}):
+            with self.assertNumQueries(2):
+                response = self.call(getAllItems, '/api/item-list/', params)
+            self.assertEqual(response.data['count'], 7)
+        # an unknown category is a 404, from the count alone
+        with self.assertNumQueries(1):
+            self.assertEqual(self.call(getAllItems, '/api/item-list/', {'category': 'Nope'}).status_code, 404)
+        # estimates too, where the database has none
+        for params in ({'search': 'summer'}, {'tag': 'cotton', 'count': 'estimate'}, {'name': 'item 3'}):
+            with self.assertNumQueries(2):
+                response = self.call(getAllItems, '/api/item-list/', params)
+            self.assertEqual(response.data['count'], 1 if 'name' in params else 7)
+        with self.assertNumQueries(2):
+            response = self.call(getAllItems, '/api/item-list/', {'pagination': 'cursor', 'category': 'Category1'})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_counts_are_exact_unless_estimated(self):
+        # drifted rollups only show when the client settles for an estimate
+        InventoryRollup.objects.update(item_count=40)
+        self.assertEqual(self.call(getAllItems, '/api/item-list/', {}).data['count'], 7)
+        self.assertEqual(self.call(getAllItems, '/api/item-list/', {'count': 'estimate'}).data['count'], 40)
+        InventoryRollup.objects.update(item_count=0)
+        response = self.call(getAllItems, '/api/item-list/', {'count': 'estimate'})
+        self.assertEqual((response.status_code, response.data['count']), (200, 7))
+
+    def test_item_detail(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.call(getItem, '/api/item-detail/', {'SKU': 'SKU1'}).status_code, 200)
+
+    def test_item_update(self):
+        data = {'SKU': 'SKU1', 'name': 'Renamed', 'category': 'Category1',
+                'stock_status': 'In Stock', 'available_stock': 1}
+        # the item with its category, the update and its change log row, in a savepoint
+        with self.assertNumQueries(5):
+            response = self.call(updateItem, '/api/item-update/?SKU=SKU1', data=data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Item.objects.get(SKU='SKU1').name, 'Renamed')
+        # a new SKU and category are still checked
+        response = self.call(updateItem, '/api/item-update/?SKU=SKU1', data={**data, 'SKU': 'SKU2'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('SKU', response.data)
+        response = self.call(updateItem, '/api/item-update/?SKU=SKU1', data={**data, 'category': 'Nope'})
+        self.assertIn('category', response.data)
+        self.assertEqual(self.call(updateItem, '/api/item-update/?SKU=NOPE', data=data).status_code, 404)
+
+
+class SparseFieldsetTest(AuthenticatedAPITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Category1')
+        for i in range(7):
+            Item.objects.create(SKU=f'SKU{i}', name=f'Item {i}', category=category, tags='cotton',
+                                stock_status='In Stock', available_stock=i)
+
+    def test_item_list_reads_and_returns_the_fields_asked_for(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_view(getAllItems, '/api/item-list/', {'fields': 'available_stock, SKU', 'order_by': 'SKU'})
+        self.assertEqual(response.data['results'][0], {'SKU': 'SKU0', 'available_stock': 0})
+        page_query = queries.captured_queries[-1]['sql']
+        self.assertIn('"available_stock"', page_query)
+        self.assertNotIn('"name"', page_query)
+        self.assertNotIn('"tags"', page_query)
+
+    def test_cursor_pages_order_by_a_column_left_out(self):
+        params = {'fields': 'SKU', 'pagination': 'cursor', 'order_by': '-name', 'count': 'false'}
+        response = self.get_view(getAllItems, '/api/item-list/', params)
+        self.assertEqual(response.data['results'], [{'SKU': f'SKU{i}'} for i in range(6, 1, -1)])
+        response = self.get_view(getAllItems, response.data['next'], {})
+        self.assertEqual(response.data['results'], [{'SKU': 'SKU1'}, {'SKU': 'SKU0'}])
+
+    def test_item_detail_and_categories(self):
+        response = self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU3', 'fields': 'SKU,available_stock'})
+        self.assertEqual(response.data, {'SKU': 'SKU3', 'available_stock': 3})
+        self.assertEqual(self.get_view(getAllCategories, '/api/category-list/', {'fields': 'name'}).data,
+                         [{'name': 'Category1'}])
+        # empty means every field
+        self.assertEqual(len(self.get_view(getItem, '/api/item-detail/', {'SKU': 'SKU3', 'fields': ''}).data), 6)
+
+    def test_unknown_fields(self):
+        for view, path in ((getAllItems, '/api/item-list/'), (getItem, '/api/item-detail/'),
+                           (getAllCategories, '/api/category-list/')):
+            response = self.get_view(view, path, {'SKU': 'SKU1', 'fields': 'SKU,version'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fields', response.data)
+
+    async def test_async_views(self):
+        auth = {'Authorization': f'Token {self.token.key}'}
+        response = await AsyncClient().get('/api/async/item-list/', {'fields': 'SKU', 'order_by': 'SKU'}, headers=auth)
+        self.assertEqual(response.json()['results'][0], {'SKU': 'SKU0'})
+        response = await AsyncClient().get('/api/async/item-detail/', {'SKU': 'SKU1', 'fields': 'nope'}, headers=auth)
+        self.assertEqual(response.status_code, 400)
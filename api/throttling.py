@@ -0,0 +1,186 @@
+"""
+Per-user request throttling.
+
+Every user (or, before login, every client address) gets a token bucket per
+endpoint: it holds up to BURST tokens and refills at RATE tokens a second. A
+request takes one token, and expensive operations take their COSTS weight,
+so one integration hammering search or export runs dry long before it can
+starve the database. A request the bucket can't pay for answers 429 with a
+Retry-After of the seconds until it could.
+
+TokenBucketThrottle is in DEFAULT_THROTTLE_CLASSES and weighs any request
+carrying a search parameter as a search; views of the other expensive
+operations use one of its subclasses through @throttle_classes. The async
+views call check() themselves.
+
+LocalBuckets keeps the buckets in process memory, so each worker allows
+RATE on its own. CacheBuckets shares them through a cache alias, at the
+price of a cache round trip and some slack: concurrent requests of one user
+on different workers may both be let through.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'api.throttling.LocalBuckets',
+    # tokens added to each bucket per second, and the most it holds
+    'RATE': 20,
+    'BURST': 100,
+    # tokens taken by expensive operations, instead of one; capped at BURST
+    'COSTS': {
+        'search': 5,
+        'export': 20,
+        'import': 50,
+        'category-delete': 50,
+    },
+    # CacheBuckets: alias from CACHES holding the buckets
+    'CACHE_ALIAS': 'default',
+    # LocalBuckets: buckets kept before idle ones are dropped
+    'MAX_KEYS': 100000,
+}
+
+# query parameters that turn a read into a text search (icontains or FTS)
+SEARCH_PARAMS = ('search', 'q', 'sku', 'name')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+class LocalBuckets:
+    """Buckets in this process's memory."""
+
+    def __init__(self, config):
+        self.max_keys = config['MAX_KEYS']
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Take ``cost`` tokens from the bucket; seconds to wait when it holds too few, else 0."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, rate, burst)
+        return 0
+
+    async def atake(self, key, cost, rate, burst):
+        return self.take(key, cost, rate, burst)
+
+    def _prune(self, now, rate, burst):
+        # a bucket that has refilled is the same as no bucket
+        self._buckets = {key: (tokens, stamp) for key, (tokens, stamp) in self._buckets.items()
+                         if tokens + (now - stamp) * rate < burst}
+        excess = len(self._buckets) - self.max_keys
+        if excess > 0:
+            for key, _ in sorted(self._buckets.items(), key=lambda bucket: bucket[1][1])[:excess]:
+                del self._buckets[key]
+
+
+class CacheBuckets:
+    """Buckets in a shared cache, so every worker draws from the same ones."""
+
+    def __init__(self, config):
+        self.cache = caches[config['CACHE_ALIAS']]
+
+    @staticmethod
+    def _take(bucket, now, cost, rate, burst):
+        tokens, stamp = bucket or (burst, now)
+        tokens = min(burst, tokens + max(now - stamp, 0) * rate)
+        if tokens < cost:
+            return (tokens, now), (cost - tokens) / rate
+        return (tokens - cost, now), 0
+
+    def take(self, key, cost, rate, burst):
+        bucket, wait = self._take(self.cache.get(f'throttle:{key}'), time.time(), cost, rate, burst)
+        # an untouched bucket is full again after burst / rate seconds
+        self.cache.set(f'throttle:{key}', bucket, int(burst / rate) + 1)
+        return wait
+
+    async def atake(self, key, cost, rate, burst):
+        bucket, wait = self._take(await self.cache.aget(f'throttle:{key}'), time.time(), cost, rate, burst)
+        await self.cache.aset(f'throttle:{key}', bucket, int(burst / rate) + 1)
+        return wait
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = get_config()
+        _backend = import_string(config['BACKEND'])(config)
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+def _bucket(request, endpoint, operation, config):
+    """(bucket key, cost) of a request to ``endpoint``."""
+    if operation is None and any(request.GET.get(param) for param in SEARCH_PARAMS):
+        operation = 'search'
+    cost = min(config['COSTS'].get(operation, 1), config['BURST']) if operation else 1
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        client = f'user:{user.pk}'
+    else:
+        client = f'ip:{BaseThrottle().get_ident(request)}'
+    return f'{client}:{endpoint}', cost
+
+
+def check(request, endpoint, operation=None):
+    """Seconds ``request`` must wait before ``endpoint`` takes it, 0 to go ahead."""
+    config = get_config()
+    if not config['ENABLED']:
+        return 0
+    key, cost = _bucket(request, endpoint, operation, config)
+    return get_backend().take(key, cost, config['RATE'], config['BURST'])
+
+
+async def acheck(request, endpoint, operation=None):
+    config = get_config()
+    if not config['ENABLED']:
+        return 0
+    key, cost = _bucket(request, endpoint, operation, config)
+    return await get_backend().atake(key, cost, config['RATE'], config['BURST'])
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle against the user's bucket for this view. DRF answers 429 with Retry-After."""
+    # key into COSTS; None weighs the request by its parameters
+    operation = None
+
+    def allow_request(self, request, view):
+        # api_view names the view class after the view function
+        self.wait_seconds = check(request, type(view).__name__, self.operation)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ExportThrottle(TokenBucketThrottle):
+    operation = 'export'
+
+
+class ImportThrottle(TokenBucketThrottle):
+    operation = 'import'
+
+
+class CategoryDeleteThrottle(TokenBucketThrottle):
+    operation = 'category-delete'
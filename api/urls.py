@@ -1,14 +1,32 @@
 from django.urls import path, re_path
-from . import views
+from . import async_views, views
 urlpatterns = [
     path('item-list/',views.getAllItems),
     path('item-detail/',views.getItem),
+    path('item-batch/',views.getItems),
+    path('item-search/',views.searchItems),
+    path('item-export/',views.exportItems),
     path('item-update/',views.updateItem),
     path('item-create/',views.createItem),
+    path('item-import/',views.importItems),
     path('item-delete/',views.deleteItem),
+    path('item-bulk-update/',views.bulkUpdateItems),
+    path('item-bulk-delete/',views.bulkDeleteItems),
+    path('item-stock-adjust/',views.adjustStock),
+    path('item-sync/',views.syncItems),
     path('category-list/',views.getAllCategories),
+    path('inventory-stats/',views.inventoryStats),
+    path('metrics/',views.metricsView),
     path('category-create/',views.createCategory),
     path('category-delete/',views.delete_category),
+    path('category-delete-status/',views.categoryDeletionStatus),
+    path('category-delete-cancel/',views.cancelCategoryDeletion),
+    path('async/item-list/',async_views.getAllItems),
+    path('async/item-detail/',async_views.getItem),
+    path('async/category-list/',async_views.getAllCategories),
+    path('async/authentication/testtoken',async_views.testToken),
+    path('async/changes/',async_views.changeStream),
+    path('async/changes/token/',async_views.streamToken),
     re_path('authentication/login', views.login),
     re_path('authentication/signup', views.signup),
     re_path('authentication/testtoken', views.testToken),
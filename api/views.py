@@ -1,89 +1,202 @@
+import logging
 from base64 import urlsafe_b64decode, urlsafe_b64encode
-from rest_framework.pagination import PageNumberPagination
 from rest_framework import status
-from .models import Item, Category
-from .serializers import CategorySerializer, ItemSerializer, UserSerializer
+from .models import Item, Category, CategoryDeletion
+from .serializers import CategorySerializer, CategoryRowSerializer, ItemRowSerializer, ItemSerializer, UserSerializer
+from .pagination import ItemCursorPagination, ItemPagePagination
+from .queries import count_items, item_queryset
+from .search import get_search_backend
+from .authentication import CachedTokenAuthentication
+from . import changelog, mailqueue, metrics, response_cache
+from .response_cache import cached_response
+from .replicas import replica_reads
+from .throttling import CategoryDeleteThrottle, ExportThrottle, ImportThrottle
+from .importer import READERS, import_items, text_stream
+from .export import EXPORT_FORMATS, export_rows
+from .facets import facet_counts
+from .renderers import PassthroughRenderer, PrometheusRenderer
+from .rollups import inventory_stats
+from .stock import adjust_stock, parse_adjustments
+from .category_deletion import cancel_deletion, job_status, start_deletion
+from .batch import MAX_BATCH_SIZE, delete_items, fetch_items, parse_skus, update_items
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
-from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, renderer_classes, throttle_classes
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.db import transaction
 from django.contrib.auth.tokens import default_token_generator
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
 from django.utils.encoding import force_bytes
 
+logger = logging.getLogger(__name__)
+
+def item_list_scopes(request):
+    # a category filter only depends on that category's items
+    category = request.GET.get('category')
+    return [response_cache.category_scope(category)] if category else [response_cache.GLOBAL]
+
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@replica_reads
+@cached_response(item_list_scopes)
 def getAllItems(request):
 
-    paginator = PageNumberPagination()
-    paginator.page_size = 5  # Set the number of items per page
-
-    queryset = Item.objects.all()
-    search_param = request.GET.get('search')
-    order_by_param = request.GET.get('order_by')
-    search_sku = request.GET.get('sku')
-    search_name = request.GET.get('name')
-    search_category = request.GET.get('category')
-    search_stock_status = request.GET.get('stock_status')
-    if search_param:
-        queryset = queryset.filter(name__icontains=search_param)
-    
-    if order_by_param:
-        queryset = queryset.order_by(order_by_param)
-    
-    if search_sku:
-        queryset = queryset.filter(SKU__icontains=search_sku)
+    # ?fields=SKU,available_stock narrows the columns read and the rows returned
+    fields = ItemRowSerializer.parse_fields(request.GET.get('fields'))
+    # ?pagination=cursor switches to keyset paging, which costs the same on every page
+    cursor_mode = request.GET.get('pagination') == 'cursor' or 'cursor' in request.GET
+    queryset = item_queryset(request.GET, ordered=not cursor_mode)
+    if cursor_mode:
+        paginator = ItemCursorPagination()
+        # the cursor is built from the order column, whether it is returned or not
+        serializer = ItemRowSerializer(fields, [paginator.get_ordering(request)[0]])
+    else:
+        # the count doubles as the existence check; ?count=estimate may take the
+        # rollups' or the planner's word for it, but never 404s on an estimate
+        estimate = request.GET.get('count') == 'estimate'
+        count = count_items(request.GET, queryset, estimate=estimate)
+        if not count and estimate:
+            count = queryset.count()
+        if not count:
+            return Response([],status=status.HTTP_404_NOT_FOUND)
+        paginator = ItemPagePagination(count)
+        serializer = ItemRowSerializer(fields)
 
-    if search_name:
-        queryset = queryset.filter(name__icontains=search_name)
+    paginated_rows = paginator.paginate_queryset(serializer.project(queryset), request)
+    response = paginator.get_paginated_response(serializer.serialize(paginated_rows))
+    # ?facets=category,stock_status,tag: counts per value for the sidebar
+    facets = facet_counts(request, item_queryset(request.GET, ordered=False))
+    if facets is not None:
+        response.data['facets'] = facets
+    return response
 
-    if search_category:
-        category = Category.objects.get(name=search_category)
-        queryset = queryset.filter(category=category)
-    
-    if search_stock_status:  
-        queryset = queryset.filter(stock_status=search_stock_status)
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@throttle_classes([ExportThrottle])
+@renderer_classes([PassthroughRenderer])
+def exportItems(request):
+    # "format" is taken by DRF's format suffixes, hence export_format
+    export_format = request.GET.get('export_format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return Response(f"export_format must be one of {', '.join(EXPORT_FORMATS)}", status=status.HTTP_400_BAD_REQUEST)
+    writer, content_type, extension = EXPORT_FORMATS[export_format]
+    queryset = item_queryset(request.GET)
+    if not queryset.query.order_by:
+        queryset = queryset.order_by('id')
+    response = StreamingHttpResponse(writer(export_rows(queryset)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="items.{extension}"'
+    return response
 
-    if not queryset.exists():
-        return Response([],status=status.HTTP_404_NOT_FOUND)
-    paginated_queryset = paginator.paginate_queryset(queryset, request)
-    serializer = ItemSerializer(paginated_queryset, many = True)
-    return paginator.get_paginated_response(serializer.data)
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@replica_reads
+@cached_response(lambda request: [response_cache.GLOBAL])
+def searchItems(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response("Please provide q", status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        return Response("limit must be an integer", status=status.HTTP_400_BAD_REQUEST)
+    serializer = ItemRowSerializer()
+    items = get_search_backend().suggest(Item.objects.all(), query, limit)
+    return Response(serializer.serialize(serializer.project(items)))
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@replica_reads
+@cached_response(lambda request: [response_cache.CATEGORIES])
 def getAllCategories(request):
     # 
     # add sorting and pagination
     # (pageNo - 1)pageSize
     # 
-    categories = Category.objects.all()
-    serializer = CategorySerializer(categories, many = True)
-    return Response(serializer.data)
+    serializer = CategoryRowSerializer(CategoryRowSerializer.parse_fields(request.GET.get('fields')))
+    return Response(serializer.serialize(serializer.project(Category.objects.all())))
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@cached_response(lambda request: response_cache.item_scopes([request.GET.get('SKU', '')]))
 def getItem(request):
     SKU = request.GET.get('SKU')
     if not SKU :
         return Response("Please provide SKU",status=status.HTTP_400_BAD_REQUEST)
-    item = Item.objects.get(SKU=SKU)
+    serializer = ItemRowSerializer(ItemRowSerializer.parse_fields(request.GET.get('fields')))
+    item = serializer.project(Item.objects.filter(SKU=SKU)).first()
     if not item:
         return Response("Not found", status=status.HTTP_404_NOT_FOUND)
-    serializer = ItemSerializer(item, many = False)
-    return Response(serializer.data)
+    return Response(serializer.to_dict(item))
 
 
+def item_batch_scopes(request):
+    skus, error = parse_skus(request.GET.getlist('SKU') or request.GET.get('SKUs', ''))
+    return [response_cache.GLOBAL] if error else response_cache.item_scopes(skus)
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@cached_response(item_batch_scopes)
+def getItems(request):
+    # GET ?SKU=A&SKU=B or ?SKUs=A,B; POST {"SKUs": [...]} or a plain list
+    if request.method == 'GET':
+        data = request.GET.getlist('SKU') or request.GET.get('SKUs', '')
+    else:
+        data = request.data.get('SKUs') if isinstance(request.data, dict) else request.data
+    skus, error = parse_skus(data)
+    if error:
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
+    results = fetch_items(skus)
+    return Response({
+        'found': sum(result['status'] == 'ok' for result in results),
+        'missing': [result['SKU'] for result in results if result['status'] == 'not_found'],
+        'results': results,
+    })
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@replica_reads
+def syncItems(request):
+    # ?since=<watermark from the last sync>; without it the client is told to reset
+    config = changelog.get_config()
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since not in (None, '') else None
+        limit = min(max(int(request.GET.get('limit', config['BATCH_SIZE'])), 1), config['MAX_BATCH_SIZE'])
+    except ValueError:
+        return Response("since and limit must be integers", status=status.HTTP_400_BAD_REQUEST)
+    if since is not None and since < 0:
+        return Response("since must not be negative", status=status.HTTP_400_BAD_REQUEST)
+    return Response(changelog.changes_since(since, limit))
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@cached_response(lambda request: [response_cache.GLOBAL])
+def inventoryStats(request):
+    return Response(inventory_stats())
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes([PrometheusRenderer])
+def metricsView(request):
+    # this worker's request metrics, for a Prometheus scrape
+    return Response(metrics.expose())
+
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def createCategory(request):
     serializer = CategorySerializer(data=request.data)
@@ -93,8 +206,9 @@ def createCategory(request):
     return Response(serializer.errors, status=400)
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def createItem(request):
     serializer = ItemSerializer(data=request.data)
     if(serializer.is_valid()):
@@ -102,21 +216,107 @@ def createItem(request):
         return Response(status=status.HTTP_201_CREATED)
     return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
 
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+}
+
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+@throttle_classes([ImportThrottle])
+def importItems(request):
+    # either a multipart upload in "file" or the raw CSV/JSONL body
+    content_type = request.content_type.split(';')[0].strip()
+    file_format = request.GET.get('file_format')
+    if content_type in IMPORT_CONTENT_TYPES:
+        stream = request.stream
+        file_format = file_format or IMPORT_CONTENT_TYPES[content_type]
+    else:
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response("Please provide a CSV or JSONL file", status=status.HTTP_400_BAD_REQUEST)
+        stream = upload
+        file_format = file_format or upload.name.rsplit('.', 1)[-1].lower()
+    if stream is None:
+        return Response("Please provide a CSV or JSONL file", status=status.HTTP_400_BAD_REQUEST)
+    if file_format not in READERS:
+        return Response("file_format must be csv or jsonl", status=status.HTTP_400_BAD_REQUEST)
+    try:
+        batch_size = min(max(int(request.GET.get('batch_size', 1000)), 1), 5000)
+    except ValueError:
+        return Response("batch_size must be an integer", status=status.HTTP_400_BAD_REQUEST)
+    result = import_items(text_stream(stream), file_format, batch_size)
+    return Response(result.as_dict(), status=status.HTTP_200_OK)
+
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def updateItem(request):
-    item = Item.objects.get(SKU=request.GET.get('SKU'))
-    serializer = ItemSerializer(instance=item, data= request.data)
+    # the category comes along in the same query, so an unchanged one validates for free
+    item = Item.objects.select_related('category').filter(SKU=request.GET.get('SKU')).first()
     if not item:
         return Response("Not found", status=status.HTTP_404_NOT_FOUND)
-    if serializer.is_valid():
-        serializer.save()
+    serializer = ItemSerializer(instance=item, data= request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    serializer.save()
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def adjustStock(request):
+    data = request.data.get('adjustments') if isinstance(request.data, dict) else request.data
+    adjustments, errors = parse_adjustments(data)
+    if None in errors:
+        return Response(errors[None], status=status.HTTP_400_BAD_REQUEST)
+    results = adjust_stock(adjustments)
+    for position, error in errors.items():
+        results[position] = {'SKU': data[position].get('SKU') if isinstance(data[position], dict) else None,
+                             'status': 'invalid', 'error': error}
+    results = [results[position] for position in sorted(results)]
+    return Response({
+        'applied': sum(result['status'] == 'ok' for result in results),
+        'conflicts': sum(result['status'] == 'conflict' for result in results),
+        'results': results,
+    })
+
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bulkUpdateItems(request):
+    rows = request.data.get('items') if isinstance(request.data, dict) else request.data
+    if not isinstance(rows, list) or not rows:
+        return Response("Provide a list of item updates.", status=status.HTTP_400_BAD_REQUEST)
+    if len(rows) > MAX_BATCH_SIZE:
+        return Response(f"At most {MAX_BATCH_SIZE} updates per request.", status=status.HTTP_400_BAD_REQUEST)
+    results = update_items(rows)
+    return Response({
+        'updated': sum(result['status'] == 'ok' for result in results),
+        'results': results,
+    })
+
+@api_view(['POST', 'DELETE'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bulkDeleteItems(request):
+    data = request.data.get('SKUs') if isinstance(request.data, dict) else request.data
+    skus, error = parse_skus(data)
+    if error:
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
+    results = delete_items(skus)
+    return Response({
+        'deleted': sum(result['status'] == 'ok' for result in results),
+        'results': results,
+    })
+
 @api_view(['DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@transaction.atomic
 def deleteItem(request):
     SKU = request.GET.get('SKU')
     if not SKU :
@@ -128,6 +328,7 @@ def deleteItem(request):
     return Response('deleted')
 
 @api_view(['DELETE'])
+@throttle_classes([CategoryDeleteThrottle])
 def delete_category(request):
     try:
         key = request.GET.get('category')
@@ -137,9 +338,36 @@ def delete_category(request):
     except Category.DoesNotExist:
         return Response({"message": "Category does not exist"}, status=status.HTTP_404_NOT_FOUND)
 
-    # If category exists, delete it and its associated items
-    category.delete()
-    return Response({"message": "Category and associated items deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+    # Items are deleted in the background, a batch at a time; poll category-delete-status
+    job = start_deletion(category)
+    return Response({"message": "Category deletion started", **job_status(job)}, status=status.HTTP_202_ACCEPTED)
+
+def category_deletion_job(request):
+    try:
+        return CategoryDeletion.objects.get(pk=int(request.GET.get('job', '')))
+    except (ValueError, CategoryDeletion.DoesNotExist):
+        return None
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def categoryDeletionStatus(request):
+    job = category_deletion_job(request)
+    if job is None:
+        return Response("Not found", status=status.HTTP_404_NOT_FOUND)
+    return Response(job_status(job))
+
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def cancelCategoryDeletion(request):
+    job = category_deletion_job(request)
+    if job is None:
+        return Response("Not found", status=status.HTTP_404_NOT_FOUND)
+    if not cancel_deletion(job):
+        return Response("Deletion already finished", status=status.HTTP_409_CONFLICT)
+    job.refresh_from_db()
+    return Response(job_status(job))
 
 @api_view(['POST'])
 def login(request):
@@ -164,7 +392,7 @@ def signup(request):
     
 
 @api_view(['GET'])
-@authentication_classes([SessionAuthentication, TokenAuthentication])
+@authentication_classes([SessionAuthentication, CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def testToken(request):
     return Response("passed!")
@@ -180,10 +408,10 @@ def forgot_password(request):
             # Build password reset link
             uid = user.pk
             reset_link = f"http://3.19.242.75:8000/api/authentication/reset-password/?uidEncoded={uidb64}&token={token}"
-            # Send reset link via email
+            # Queue the reset link, send_queued_mail delivers it
             subject = "Password Reset"
             message = reset_link
-            send_mail(subject, message, 'from@example.com', [email])
+            mailqueue.enqueue(subject, message, 'from@example.com', [email])
         return Response("Password reset link sent if the email exists.", status=status.HTTP_200_OK)
     return Response("Email field is required.", status=status.HTTP_400_BAD_REQUEST)
 
@@ -193,20 +421,20 @@ def reset_password(request):
     uidEncoded = request.GET.get('uidEncoded')
     uid = urlsafe_base64_decode(uidEncoded).decode()
     token = request.GET.get('token')
-    print(uid)
-    print(token)
     try:
         user = User.objects.get(pk=uid)
     except (TypeError, ValueError, OverflowError, User.DoesNotExist):
         user = None
-        print("no user found")
+        logger.info("Password reset for unknown user id %s", uid)
     if user is not None and default_token_generator.check_token(user, token):
         # Update user's password
         new_password = request.data.get('new_password')
-        print(new_password)
         if new_password:
             user.set_password(new_password)
             user.save()
+            logger.info("Password reset for user %s", user.pk)
             return Response("Password reset successfully.", status=status.HTTP_200_OK)
         return Response("New password is required.", status=status.HTTP_400_BAD_REQUEST)
+    if user is not None:
+        logger.info("Password reset with an invalid token for user %s", user.pk)
     return Response("Invalid reset link or token.", status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
@@ -52,6 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost, so its timings include the other middleware
+    'api.metrics.InstrumentationMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,11 +89,83 @@ WSGI_APPLICATION = 'dashboard.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default. Set POSTGRES_DB (and POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST, POSTGRES_PORT) to use PostgreSQL with a psycopg pool instead;
+# that needs psycopg[pool] installed.
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', ''),
+            'PORT': os.environ.get('POSTGRES_PORT', ''),
+            # pooled connections are reused across requests, so CONN_MAX_AGE
+            # stays 0 (Django refuses both)
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('POSTGRES_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('POSTGRES_POOL_MAX', 10)),
+                    'timeout': 10,
+                },
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # keep connections, and the PRAGMAs and page cache that come with
+            # them, across requests
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # transactions take the write lock when they begin, waiting up to
+                # busy_timeout for it, instead of failing with "database is locked"
+                # when a read turns into a write
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
+
+# Read replicas: set POSTGRES_REPLICA_HOST to add one, a hot standby of the
+# primary. List endpoints and search read from it, see api.replicas.DEFAULTS.
+if 'postgresql' in DATABASES['default']['ENGINE'] and os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        # the test runner points the replica at the test primary
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Users who wrote are kept on the primary through markers in CACHE_ALIAS,
+# which every worker must share: with the LocMemCache above reads stay on the
+# primary unless SINGLE_PROCESS says one process serves every request.
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 10,
+    'MAX_LAG': 5,
+    'CACHE_ALIAS': 'default',
+    'SINGLE_PROCESS': DEBUG,
+}
+
+# PRAGMAs applied to every new SQLite connection, see api.db.DEFAULTS. The
+# journal mode is stored in the database file and set by migration 0014.
+DATABASE_TUNING = {
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'journal_size_limit': 67108864,
+    },
 }
 
 
@@ -142,3 +217,119 @@ EMAIL_USE_TLS = True  # Set to True if your SMTP server uses TLS
 EMAIL_USE_SSL = False  # Set to True if your SMTP server uses SSL
 EMAIL_HOST_USER = 'sushrutgamer6@gmail.com'  # Replace with your SMTP username
 EMAIL_HOST_PASSWORD = 'moes hfxa srsr iqub '  # Replace with your SMTP password
+
+# Outbound mail is queued in the database and sent by manage.py send_queued_mail,
+# see api.mailqueue.DEFAULTS.
+MAIL_QUEUE = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 30,
+    'RATE_LIMIT': 5,
+}
+
+# Item search backend. Defaults to the FTS5 index on SQLite and plain
+# icontains filters elsewhere; point this at another backend class to swap it.
+# ITEM_SEARCH_BACKEND = 'api.search.SQLiteFTSBackend'
+
+# Resolved auth tokens are cached in process, see api.authentication.DEFAULTS.
+# Set SHARED_CACHE to an alias from CACHES to share them between workers.
+TOKEN_AUTH_CACHE = {
+    'LOCAL_TTL': 300,
+    'MAX_SIZE': 10000,
+    'SHARED_CACHE': None,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Read responses for items and categories are cached in this alias and
+# invalidated by version counters bumped on every catalog write. The counters
+# must be shared by every worker: with a process-local alias (LocMemCache) the
+# response cache stays off, unless RESPONSE_CACHE_SINGLE_PROCESS says one
+# process serves every request (runserver). Under gunicorn or uwsgi point
+# RESPONSE_CACHE_ALIAS at redis or memcached; None turns the cache off.
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_SINGLE_PROCESS = DEBUG
+
+REST_FRAMEWORK = {
+    # orjson-backed when installed, byte-compatible with DRF's JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # per-user token buckets, see THROTTLING
+    'DEFAULT_THROTTLE_CLASSES': ['api.throttling.TokenBucketThrottle'],
+}
+
+# Each user gets a bucket per endpoint holding BURST tokens, refilled at RATE
+# a second. Expensive operations take COSTS tokens. LocalBuckets limits each
+# worker on its own; api.throttling.CacheBuckets shares the buckets through
+# CACHE_ALIAS (point it at redis or memcached in production). Start the server
+# with API_THROTTLING=off to load test it (manage.py loadtest) unthrottled.
+THROTTLING = {
+    'ENABLED': os.environ.get('API_THROTTLING') != 'off',
+    'BACKEND': 'api.throttling.LocalBuckets',
+    'RATE': 20,
+    'BURST': 100,
+    'COSTS': {
+        'search': 5,
+        'export': 20,
+        'import': 50,
+        'category-delete': 50,
+    },
+    'CACHE_ALIAS': 'default',
+}
+
+# Items at or below this stock count as low stock in inventory-stats.
+# Run manage.py rebuild_rollups after changing it.
+LOW_STOCK_THRESHOLD = 5
+
+# Category deletes run in the background in batches, see
+# api.category_deletion.DEFAULTS.
+CATEGORY_DELETION = {
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.05,
+    'RUN_IN_THREAD': True,
+}
+
+# Per-endpoint request metrics, served in Prometheus format at /api/metrics/.
+# Requests slower than SLOW_REQUEST_MS are logged to api.slow_requests with
+# their queries.
+INSTRUMENTATION = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 500,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Item and category changes pushed to /api/async/changes/ as Server-Sent
+# Events, see api.changefeed.DEFAULTS. LocalHub is per process: a stream only
+# carries the writes served by its own worker, so run a single process (one
+# ASGI worker serving writes and streams) or point HUB at a hub shared
+# through a broker. Stream tokens let EventSource clients open a stream for
+# STREAM_TOKEN_TTL seconds without the Authorization header.
+CHANGE_FEED = {
+    'HUB': 'api.changefeed.LocalHub',
+    'BUFFER_SIZE': 1000,
+    'HEARTBEAT': 15,
+    'STREAM_TOKEN_TTL': 60,
+}
+
+CHANGE_LOG = {
+    'BATCH_SIZE': 500,
+    'MAX_BATCH_SIZE': 5000,
+    'RETENTION_DAYS': 30,
+}